@@ -0,0 +1,179 @@
+"""
+Accuracy and throughput of the sentence encoder backends.
+
+Ranks the section titles of every recorded TEI (the inputs of
+run_benchmarks.py) against the ranking queries with the fp32
+SentenceTransformer and with each SentenceEncoder backend of
+utils.tei_extraction, and reports for each backend:
+
+  - ranking agreement with fp32: share of papers with the same top section,
+    mean top-3 overlap and mean Spearman correlation of the title scores
+  - mean cosine similarity of its embeddings to the fp32 ones
+  - sentences per second on section titles and on paragraphs
+
+Exits with status 1 if a backend's top-1 agreement is below --min-agreement.
+Without torch and sentence-transformers there is no fp32 reference to compare
+with: the check prints SKIPPED and exits with status 0. A backend whose own
+dependencies are missing (e.g. optimum for onnx) is reported as skipped.
+Run from the repository root:
+
+    python benchmarks/encoder_check.py [--backends int8 onnx] [--limit 30]
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from run_benchmarks import DEFAULT_PDF_DIRS, PROJECT_ROOT, RANKING_QUERIES, ensure_recordings, list_pdfs
+from grobid_stub import DEFAULT_RECORDINGS
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / "results" / "encoders.json"
+DEFAULT_MIN_AGREEMENT = 0.9
+# Paragraphs timed per backend (the longest inputs the encoder sees)
+MAX_PARAGRAPHS = 2000
+
+
+# Needed by the fp32 reference model and every backend
+REQUIRED_MODULES = ("torch", "sentence_transformers")
+
+
+def missing_modules() -> list[str]:
+    """REQUIRED_MODULES that can't be imported here, with the reason."""
+    missing = []
+    for name in REQUIRED_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            missing.append(f"{name} ({e})")
+    return missing
+
+
+def _ranks(scores):
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(scores, kind="stable")] = np.arange(len(scores))
+    return ranks
+
+
+def ranking_agreement(reference, candidate, k: int = 3) -> dict:
+    """
+    Agreement of two rankings of the same papers, each a list of
+    [(title, score)] per paper as returned by rank_sections_corpus.
+    """
+    top1, overlap, spearman = [], [], []
+    for ref, cand in zip(reference, candidate):
+        if not ref:
+            continue
+        top1.append(ref[0][0] == cand[0][0])
+        overlap.append(len({t for t, _ in ref[:k]} & {t for t, _ in cand[:k]}) / min(k, len(ref)))
+        if len(ref) > 2:
+            # Scores of the same titles in the same order
+            cand_scores = dict(cand)
+            a = _ranks(np.array([s for _, s in ref]))
+            b = _ranks(np.array([cand_scores[t] for t, _ in ref]))
+            if a.std() and b.std():
+                spearman.append(float(np.corrcoef(a, b)[0, 1]))
+    return {
+        "papers": len(top1),
+        "top1_agreement": float(np.mean(top1)) if top1 else None,
+        f"top{k}_overlap": float(np.mean(overlap)) if overlap else None,
+        "spearman": float(np.mean(spearman)) if spearman else None,
+    }
+
+
+def throughput(model, sentences, batch_size: int = 64) -> float:
+    """Sentences per second of `model.encode` over `sentences`, after a warm-up batch."""
+    model.encode(sentences[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    model.encode(sentences, batch_size=batch_size)
+    return len(sentences) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", action="append", help="Defaults to data/pdf_files and table_extraction/pdfs_prueba")
+    parser.add_argument("--limit", type=int, help="Only the first N PDFs")
+    parser.add_argument("--recordings", default=str(DEFAULT_RECORDINGS))
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    parser.add_argument("--onnx-file", help="e.g. onnx/model_qint8_avx2.onnx")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT)
+    parser.add_argument("-o", "--output", default=str(DEFAULT_OUTPUT))
+    args = parser.parse_args()
+
+    missing = missing_modules()
+    if missing:
+        print(f"SKIPPED: the encoder check needs {' and '.join(REQUIRED_MODULES)}; can't import {', '.join(missing)}")
+        return
+
+    sys.path.insert(0, str(PROJECT_ROOT))
+    from utils.tei_extraction import SentenceEncoder, TEIDocument, get_sentence_model, rank_sections_corpus
+
+    pdfs = list_pdfs(args.pdf_dir or DEFAULT_PDF_DIRS, args.limit)
+    docs = [TEIDocument(Path(p).read_bytes()) for p in ensure_recordings(pdfs, args.recordings).values()]
+    titles = [[s["title"] for s in doc.flat_sections if s["title"]] for doc in docs]
+    unique_titles = list(dict.fromkeys(t for paper in titles for t in paper))
+    paragraphs = [p for doc in docs for s in doc.sections for p in s["paragraphs"]][:MAX_PARAGRAPHS]
+    print(f"{len(docs)} papers, {len(unique_titles)} distinct titles, {len(paragraphs)} paragraphs")
+
+    reference = get_sentence_model(args.model)
+    reference_ranking = rank_sections_corpus(titles, RANKING_QUERIES, reference)
+    reference_embs = reference.encode(unique_titles, batch_size=args.batch_size, normalize_embeddings=True)
+
+    results = {"model": args.model, "inputs": {"papers": len(docs), "titles": len(unique_titles),
+                                                "paragraphs": len(paragraphs)}, "backends": {}}
+    results["backends"]["fp32_sentence_transformers"] = {
+        "titles_per_second": throughput(reference, unique_titles, args.batch_size),
+        "paragraphs_per_second": throughput(reference, paragraphs, args.batch_size),
+    }
+
+    failed = []
+    for backend in args.backends:
+        print(f"Loading the {backend} backend...")
+        try:
+            encoder = SentenceEncoder(args.model, backend, onnx_file=args.onnx_file, num_threads=args.threads)
+        except Exception as e:
+            results["backends"][backend] = {"skipped": f"{type(e).__name__}: {e}"}
+            continue
+        embs = encoder.encode(unique_titles, batch_size=args.batch_size, normalize_embeddings=True)
+        result = ranking_agreement(reference_ranking, rank_sections_corpus(titles, RANKING_QUERIES, encoder))
+        result["mean_cosine_to_fp32"] = float(np.mean(np.sum(embs * reference_embs, axis=1)))
+        result["titles_per_second"] = throughput(encoder, unique_titles, args.batch_size)
+        result["paragraphs_per_second"] = throughput(encoder, paragraphs, args.batch_size)
+        results["backends"][backend] = result
+        if result["top1_agreement"] is not None and result["top1_agreement"] < args.min_agreement:
+            failed.append(backend)
+
+    print(f"\n{'backend':<28}{'top1':>7}{'top3':>7}{'rho':>7}{'cos':>8}{'titles/s':>11}{'paras/s':>10}")
+    for backend, r in results["backends"].items():
+        if "skipped" in r:
+            print(f"{backend:<28} skipped: {r['skipped']}")
+            continue
+
+        def fmt(key, width, digits=3):
+            value = r.get(key)
+            return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+        print(f"{backend:<28}{fmt('top1_agreement', 7, 2)}{fmt('top3_overlap', 7, 2)}{fmt('spearman', 7, 2)}"
+              f"{fmt('mean_cosine_to_fp32', 8)}{fmt('titles_per_second', 11, 1)}{fmt('paragraphs_per_second', 10, 1)}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(f"\nResults saved in '{args.output}'")
+
+    for backend in failed:
+        print(f"FAILED {backend}: top-1 agreement {results['backends'][backend]['top1_agreement']:.2f} "
+              f"< {args.min_agreement}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
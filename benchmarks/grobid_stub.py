@@ -0,0 +1,264 @@
+"""
+Local stand-in for a GROBID server, for benchmarks and offline runs.
+
+Answers /api/isalive and /api/<service> like GROBID does, replaying recorded
+TEI responses from `<recordings>/<service>/<pdf sha256>.tei.xml`. With
+--upstream, unknown PDFs are forwarded to a real GROBID and the responses
+recorded; without it, a TEI is synthesized from the PDF text (pypdf) and kept
+as `<sha256>.synthetic.tei.xml` so the suite still runs with no GROBID at all.
+
+    python benchmarks/grobid_stub.py --recordings benchmarks/recordings [--upstream http://localhost:8070]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+DEFAULT_RECORDINGS = Path(__file__).resolve().parent / "recordings"
+
+# "3 Experiments", "4.1 Datasets", "Related Work" alone on a line
+HEADING_REGEX = re.compile(r"^(?:(\d+(?:\.\d+)*)\.?\s+)?([A-Z][A-Za-z][\w ,:&-]{2,60})$")
+# Not allowed in XML 1.0, but pypdf does return them for some fonts
+CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+TEI_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0">
+<teiHeader><fileDesc><titleStmt><title level="a" type="main">{title}</title></titleStmt>
+<sourceDesc><biblStruct><analytic>{authors}</analytic></biblStruct></sourceDesc></fileDesc>
+<profileDesc><abstract><div><p>{abstract}</p></div></abstract></profileDesc></teiHeader>
+<text><body>{body}</body><back><div type="references"><listBibl>{references}</listBibl></div></back></text>
+</TEI>
+"""
+
+
+def _multipart_file(body: bytes, content_type: str, field: str = "input") -> bytes | None:
+    # The PDF part of a multipart/form-data request
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if not match:
+        return None
+    for part in body.split(b"--" + match.group(1).encode()):
+        head, sep, data = part.partition(b"\r\n\r\n")
+        if sep and f'name="{field}"'.encode() in head:
+            return data[:-2] if data.endswith(b"\r\n") else data
+    return None
+
+
+def synthesize_tei(pdf_bytes: bytes) -> str:
+    """
+    A plausible fulltext TEI built from the PDF's own text: title, abstract,
+    numbered sections with paragraphs and a reference list. Only meant to
+    exercise the TEI consumers with realistic sizes, not to match GROBID.
+    """
+    from pypdf import PdfReader
+
+    # Font warnings are irrelevant here
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    text = "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(pdf_bytes)).pages)
+    text = CONTROL_CHARS.sub(" ", text)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    title = lines[0] if lines else "Untitled"
+
+    abstract, sections, references = [], [], []
+    current = None
+    in_references = False
+    for line in lines[1:]:
+        heading = HEADING_REGEX.match(line)
+        if heading and len(line.split()) <= 8:
+            name = heading.group(2).strip()
+            if name.lower() == "abstract":
+                current = abstract
+                continue
+            if name.lower().startswith("references"):
+                in_references = True
+                continue
+            if heading.group(1) or name.lower() in ("introduction", "conclusion", "related work"):
+                in_references = False
+                current = {"n": heading.group(1), "title": name, "paragraphs": [[]]}
+                sections.append(current)
+                continue
+        if in_references:
+            references.append(line)
+        elif isinstance(current, dict):
+            # A short line ending a sentence closes the paragraph
+            current["paragraphs"][-1].append(line)
+            if line.endswith(".") and len(line) < 60:
+                current["paragraphs"].append([])
+        elif current is abstract:
+            abstract.append(line)
+
+    body = []
+    for section in sections:
+        n = f' n="{section["n"]}"' if section["n"] else ""
+        paragraphs = "".join(f"<p>{escape(' '.join(p))}</p>" for p in section["paragraphs"] if p)
+        body.append(f'<div><head{n}>{escape(section["title"])}</head>{paragraphs}</div>')
+    return TEI_TEMPLATE.format(
+        title=escape(title),
+        authors="",
+        abstract=escape(" ".join(abstract)),
+        body="".join(body),
+        references="".join(f"<biblStruct><note>{escape(r)}</note></biblStruct>" for r in references),
+    )
+
+
+def _save(path: Path, tei: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(tei)
+    os.replace(tmp_path, path)
+
+
+def recorded_response(recordings_dir, service: str, pdf_bytes: bytes, synthesize: bool = True, upstream=None,
+                      body: bytes = b"", content_type: str = "") -> tuple[int, str, str]:
+    """
+    (status, TEI or error text, source) for a PDF, where source is one of
+    replayed, recorded (fetched from `upstream`), synthesized or missing.
+    """
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    service_dir = Path(recordings_dir) / service
+    for name in (f"{digest}.tei.xml", f"{digest}.synthetic.tei.xml"):
+        path = service_dir / name
+        if path.exists():
+            return 200, path.read_text(encoding="utf-8"), "replayed"
+
+    if upstream:
+        import requests
+
+        response = requests.post(f"{upstream}/api/{service}", data=body,
+                                 headers={"Content-Type": content_type}, timeout=300)
+        if response.status_code == 200:
+            _save(service_dir / f"{digest}.tei.xml", response.text)
+            return 200, response.text, "recorded"
+        return response.status_code, response.text, "missing"
+
+    if synthesize:
+        tei = synthesize_tei(pdf_bytes)
+        _save(service_dir / f"{digest}.synthetic.tei.xml", tei)
+        return 200, tei, "synthesized"
+
+    return 404, f"No recorded response for {digest}", "missing"
+
+
+class GrobidStub:
+    """
+    Threaded HTTP server replaying recorded TEI. Use as a context manager:
+
+        with GrobidStub(recordings_dir) as stub:
+            GrobidService(config_path=stub.write_config(tmp_dir))
+
+    `latency` (seconds) is added to every processing request to emulate
+    GROBID's own processing time when measuring client-side concurrency.
+    """
+
+    def __init__(self, recordings_dir=DEFAULT_RECORDINGS, host="127.0.0.1", port=0, upstream=None,
+                 synthesize=True, latency=0.0):
+        self.recordings_dir = Path(recordings_dir)
+        self.upstream = upstream
+        self.synthesize = synthesize
+        self.latency = latency
+        self.counts = {"replayed": 0, "recorded": 0, "synthesized": 0, "missing": 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def write_config(self, directory) -> str:
+        """grobid_client config file pointing at this stub."""
+        path = os.path.join(directory, "grobid_stub_config.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"grobid_server": self.url, "batch_size": 1000, "sleep_time": 1, "timeout": 60,
+                       "coordinates": []}, f)
+        return path
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def response_for(self, service: str, pdf_bytes: bytes, body: bytes, content_type: str) -> tuple[int, str]:
+        status, text, source = recorded_response(
+            self.recordings_dir, service, pdf_bytes, self.synthesize,
+            upstream=self.upstream, body=body, content_type=content_type
+        )
+        with self._lock:
+            self.counts[source] += 1
+        return status, text
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") == "/api/isalive":
+                    self._reply(200, "true", "text/plain")
+                else:
+                    self._reply(404, "not found", "text/plain")
+
+            def do_POST(self):
+                service = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                content_type = self.headers.get("Content-Type", "")
+                pdf_bytes = _multipart_file(body, content_type)
+                if pdf_bytes is None:
+                    self._reply(400, "missing input file", "text/plain")
+                    return
+                if stub.latency:
+                    time.sleep(stub.latency)
+                try:
+                    status, text = stub.response_for(service, pdf_bytes, body, content_type)
+                except Exception as e:
+                    status, text = 500, f"{type(e).__name__}: {e}"
+                self._reply(status, text, "application/xml" if status == 200 else "text/plain")
+
+            def _reply(self, status, text, content_type):
+                data = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", f"{content_type}; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", default=str(DEFAULT_RECORDINGS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8070)
+    parser.add_argument("--upstream", help="Real GROBID to forward and record unknown PDFs")
+    parser.add_argument("--no-synthesize", action="store_true", help="Answer 404 for PDFs with no recording")
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = GrobidStub(args.recordings, args.host, args.port, args.upstream, not args.no_synthesize, args.latency)
+    print(f"GROBID stub on {stub.url} replaying {args.recordings}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
@@ -0,0 +1,89 @@
+"""
+Import-time budget check.
+
+Imports every module of utils/ and table_extraction/ in a fresh interpreter
+(new modules are picked up without editing a list) and fails if it
+takes longer than the budget or drags in a heavy dependency (torch,
+sentence_transformers, deepdoctection, ...). tests/test_import_budget.py
+runs the same check over LIGHT_MODULES with pytest; to see the timings, run
+from the repository root:
+
+    python benchmarks/import_budget.py [--budget 1.0]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BUDGET = 1.0
+
+
+def light_modules() -> list[str]:
+    """
+    Every module of utils/ (as utils.<name>) and table_extraction/ (flat, as
+    its scripts import them): heavy dependencies are only imported on first use.
+    """
+    utils = [f"utils.{p.stem}" for p in sorted((PROJECT_ROOT / "utils").glob("*.py")) if p.stem != "__init__"]
+    return utils + [p.stem for p in sorted((PROJECT_ROOT / "table_extraction").glob("*.py"))]
+
+
+LIGHT_MODULES = light_modules()
+
+HEAVY_MODULES = [
+    "torch",
+    "sentence_transformers",
+    "transformers",
+    "deepdoctection",
+    "pandas",
+]
+
+PROBE = """
+import json, sys, time
+sys.path[:0] = [{root!r}, {root!r} + '/table_extraction']
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    code = PROBE.format(root=str(PROJECT_ROOT), module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, cwd=PROJECT_ROOT
+    )
+    if result.returncode != 0:
+        return {"module": module, "error": result.stderr.strip().splitlines()[-1]}
+    return {"module": module, **json.loads(result.stdout)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="Seconds allowed per import")
+    parser.add_argument("modules", nargs="*", default=LIGHT_MODULES)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        r = measure(module)
+        if "error" in r:
+            status = f"ERROR {r['error']}"
+            failed = True
+        elif r["heavy"]:
+            status = f"FAIL imports {', '.join(r['heavy'])}"
+            failed = True
+        elif r["seconds"] > args.budget:
+            status = f"FAIL over {args.budget:.2f}s budget"
+            failed = True
+        else:
+            status = "ok"
+        seconds = f"{r['seconds']:.3f}s" if "seconds" in r else "-"
+        print(f"{module:<28} {seconds:>8}  {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Offline benchmark suite.
+
+Runs the GROBID round trip (against the local stub in grobid_stub.py, which
+replays recorded TEI), TEI parsing, section ranking, HTML table parsing and
+value extraction over the PDFs in data/pdf_files and
+table_extraction/pdfs_prueba. Each stage runs in its own fresh process and
+reports latency percentiles, throughput, error rate and peak RSS. Failed
+items are left out of latencies and throughput. Results are written as JSON
+and can be compared against a baseline to catch regressions. Run from
+the repository root:
+
+    python benchmarks/run_benchmarks.py [--limit 20] [--baseline benchmarks/results/baseline.json]
+
+Table HTML comes from DeepDoctection outputs given with --tables-json, or is
+rendered from the ground-truth tables in table_extraction/pdfs_prueba.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from grobid_stub import DEFAULT_RECORDINGS, GrobidStub, recorded_response
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_PDF_DIRS = [PROJECT_ROOT / "data" / "pdf_files", PROJECT_ROOT / "table_extraction" / "pdfs_prueba"]
+DEFAULT_GROUND_TRUTH = PROJECT_ROOT / "table_extraction" / "pdfs_prueba" / "ground_truth" / "ground_truth_kge.json"
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / "results" / "latest.json"
+SERVICE = "processFulltextDocument"
+RANKING_QUERIES = ["Experiments", "Evaluation"]
+
+STAGES = ["grobid", "tei_parse", "section_ranking", "table_parse", "value_extraction"]
+# Relative change tolerated before a stage counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "p50": at(0.50), "p90": at(0.90), "p99": at(0.99),
+        "mean": sum(ordered) / len(ordered), "max": ordered[-1],
+    }
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _summary(latencies, papers, total_seconds, n_bytes=0, errors=()) -> dict:
+    # `latencies` and `total_seconds` cover the successful items only; papers
+    # are scaled by the share of items that succeeded
+    items = len(latencies) + len(errors)
+    succeeded = len(latencies) / items if items else 0.0
+    return {
+        "items": items,
+        "papers": papers,
+        "errors": len(errors),
+        "error_rate": len(errors) / items if items else 0.0,
+        "first_error": errors[0] if errors else None,
+        "bytes": n_bytes,
+        "total_seconds": total_seconds,
+        "latency_ms": {k: v * 1000 for k, v in percentiles(latencies).items()},
+        "items_per_second": len(latencies) / total_seconds if total_seconds else 0.0,
+        "papers_per_second": papers * succeeded / total_seconds if total_seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _timed(func, items):
+    # Failed items are only counted as errors: a fast failure must not look
+    # like a fast item
+    latencies = []
+    errors = []
+    for item in items:
+        t = time.perf_counter()
+        try:
+            func(item)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        latencies.append(time.perf_counter() - t)
+    return latencies, sum(latencies), errors
+
+
+# Stage bodies. Each runs in a fresh child process and returns its summary.
+
+def _import_paths():
+    sys.path[:0] = [str(PROJECT_ROOT), str(PROJECT_ROOT / "table_extraction")]
+
+
+def stage_grobid(pdf_paths, config_path):
+    _import_paths()
+    from utils.grobid_service import GrobidService
+
+    grobid = GrobidService(config_path=config_path)
+    latencies, total, errors = _timed(grobid.process_full_text, pdf_paths)
+    return _summary(latencies, len(pdf_paths), total, sum(os.path.getsize(p) for p in pdf_paths), errors)
+
+
+def stage_tei_parse(tei_paths):
+    _import_paths()
+    from utils.tei_extraction import TEIDocument
+
+    teis = [Path(p).read_bytes() for p in tei_paths]
+
+    def parse(tei):
+        doc = TEIDocument(tei)
+        doc.sections, doc.flat_sections, doc.abstract, doc.raw_text, doc.authors
+
+    latencies, total, errors = _timed(parse, teis)
+    return _summary(latencies, len(teis), total, sum(len(t) for t in teis), errors)
+
+
+def stage_section_ranking(tei_paths, model_name, backend=None):
+    _import_paths()
+    from utils.tei_extraction import TEIDocument, get_sentence_model, rank_sections_by_semantic_similarity
+
+    try:
+        model = get_sentence_model(model_name, backend)
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    titles = [[s["title"] for s in TEIDocument(Path(p).read_bytes()).flat_sections] for p in tei_paths]
+    titles = [t for t in titles if t]
+
+    latencies, total, errors = _timed(
+        lambda paper_titles: rank_sections_by_semantic_similarity(paper_titles, RANKING_QUERIES, model), titles
+    )
+    return _summary(latencies, len(titles), total, errors=errors)
+
+
+def stage_table_parse(tables):
+    _import_paths()
+    import table_extraction_utils as teu
+
+    htmls = [html for _, html in tables]
+    latencies, total, errors = _timed(teu.TableGrid.from_html, htmls)
+    return _summary(latencies, len({paper for paper, _ in tables}), total, sum(len(h) for h in htmls), errors)
+
+
+def stage_value_extraction(tables):
+    _import_paths()
+    import table_extraction as te
+    import table_extraction_utils as teu
+
+    grids = [teu.TableGrid.from_html(html) for _, html in tables]
+    te.get_vocabulary()
+
+    def extract(grid):
+        te.annotate_values(grid, teu.extract_values_from_html_table(grid))
+        te.metric_extraction_from_table(grid, te.METRICS_LIST)
+
+    latencies, total, errors = _timed(extract, grids)
+    return _summary(latencies, len({paper for paper, _ in tables}), total, errors=errors)
+
+
+STAGE_FUNCTIONS = {
+    "grobid": stage_grobid,
+    "tei_parse": stage_tei_parse,
+    "section_ranking": stage_section_ranking,
+    "table_parse": stage_table_parse,
+    "value_extraction": stage_value_extraction,
+}
+
+
+def run_isolated(stage, *args):
+    # A fresh interpreter per stage so peak RSS belongs to that stage alone
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(STAGE_FUNCTIONS[stage], *args).result()
+
+
+# Inputs
+
+def list_pdfs(pdf_dirs, limit=None):
+    pdfs = sorted(str(p) for d in pdf_dirs for p in Path(d).glob("*.pdf"))
+    return pdfs[:limit] if limit else pdfs
+
+
+def _warm_recording(args):
+    recordings_dir, pdf_path = args
+    try:
+        status, _, source = recorded_response(recordings_dir, SERVICE, Path(pdf_path).read_bytes())
+    except Exception as e:
+        # Not a readable PDF (e.g. an HTML page saved as .pdf): nothing to synthesize from
+        return pdf_path, 500, f"{type(e).__name__}: {e}"
+    return pdf_path, status, source
+
+
+def ensure_recordings(pdf_paths, recordings_dir, workers=None) -> dict:
+    """
+    Makes sure every PDF has a recorded (or synthesized) TEI before timing, and
+    returns {pdf_path: tei_path}.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        results = list(pool.map(_warm_recording, [(str(recordings_dir), p) for p in pdf_paths]))
+
+    import hashlib
+
+    tei_paths = {}
+    for pdf_path, status, source in results:
+        if status != 200:
+            print(f"No TEI for {pdf_path} ({source})")
+            continue
+        digest = hashlib.sha256(Path(pdf_path).read_bytes()).hexdigest()
+        service_dir = Path(recordings_dir) / SERVICE
+        recorded = service_dir / f"{digest}.tei.xml"
+        tei_paths[pdf_path] = str(recorded if recorded.exists() else service_dir / f"{digest}.synthetic.tei.xml")
+    return tei_paths
+
+
+def ground_truth_tables(path=DEFAULT_GROUND_TRUTH) -> list[tuple[str, str]]:
+    """
+    (paper, html) for every ground-truth table, rendered with multi-level
+    headers: "WN18_Hits@10_raw" becomes three header rows with colspans.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        documents = json.load(f)["documents"]
+
+    tables = []
+    for doc in documents:
+        for table in doc["tables"]:
+            columns = [c.split("_") for c in table["evaluation"]["columns"]]
+            depth = max(len(c) for c in columns)
+            header = []
+            for level in range(depth):
+                cells = []
+                for i, column in enumerate(columns):
+                    if len(column) == 1:
+                        if level == 0:
+                            rowspan = f' rowspan="{depth}"' if depth > 1 else ""
+                            cells.append(f"<th{rowspan}>{column[0]}</th>")
+                        continue
+                    label = column[level] if level < len(column) else ""
+                    prefix = column[:level + 1]
+                    if i and columns[i - 1][:level + 1] == prefix:
+                        continue
+                    span = 1
+                    while i + span < len(columns) and columns[i + span][:level + 1] == prefix:
+                        span += 1
+                    cells.append(f'<th colspan="{span}">{label}</th>' if span > 1 else f"<th>{label}</th>")
+                header.append(f"<tr>{''.join(cells)}</tr>")
+            rows = [
+                "<tr>" + "".join(f"<td>{'-' if v is None else v}</td>" for v in row) + "</tr>"
+                for row in table["rows"]
+            ]
+            tables.append((doc["paper_title"], f"<table>{''.join(header)}{''.join(rows)}</table>"))
+    return tables
+
+
+def deepdoctection_tables(paths) -> list[tuple[str, str]]:
+    tables = []
+    for path in paths:
+        path = Path(path)
+        for json_path in sorted(path.glob("*.json")) if path.is_dir() else [path]:
+            with open(json_path, "r", encoding="utf-8") as f:
+                output = json.load(f)
+            for page in output["results"]:
+                tables += [(output["file_name"], table["html"]) for table in page["tables"]]
+    return tables
+
+
+# Baseline comparison
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """
+    Regressions of `results` against `baseline`, as readable messages. Any
+    increase in a stage's errors is a regression.
+    """
+    regressions = []
+    for stage, current in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or "skipped" in current or "skipped" in before:
+            continue
+        if current.get("errors", 0) > before.get("errors", 0):
+            regressions.append(f"{stage}: errors {before.get('errors', 0)} -> {current['errors']} "
+                               f"(first: {(current.get('first_error') or '')[:80]})")
+        checks = [
+            ("p50 latency", current["latency_ms"].get("p50"), before["latency_ms"].get("p50"), 1),
+            ("peak RSS", current.get("peak_rss_mb"), before.get("peak_rss_mb"), 1),
+            ("throughput", current.get("papers_per_second"), before.get("papers_per_second"), -1),
+        ]
+        for name, now, then, direction in checks:
+            if now is None or not then:
+                continue
+            change = (now - then) / then
+            if direction * change > tolerance:
+                regressions.append(f"{stage}: {name} {then:.4g} -> {now:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", action="append", help="Defaults to data/pdf_files and table_extraction/pdfs_prueba")
+    parser.add_argument("--limit", type=int, help="Only the first N PDFs")
+    parser.add_argument("--recordings", default=str(DEFAULT_RECORDINGS))
+    parser.add_argument("--tables-json", action="append", help="DeepDoctection output file or directory")
+    parser.add_argument("--model", default="all-mpnet-base-v2", help="Sentence model for section ranking")
+    parser.add_argument("--encoder-backend", choices=["torch", "int8", "onnx"],
+                        help="Rank with a SentenceEncoder backend instead of the SentenceTransformer")
+    parser.add_argument("--stages", nargs="*", default=STAGES, choices=STAGES)
+    parser.add_argument("-o", "--output", default=str(DEFAULT_OUTPUT))
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    pdfs = list_pdfs(args.pdf_dir or DEFAULT_PDF_DIRS, args.limit)
+    print(f"Preparing TEI recordings for {len(pdfs)} PDFs...")
+    tei_paths = ensure_recordings(pdfs, args.recordings)
+    tables = deepdoctection_tables(args.tables_json) if args.tables_json else ground_truth_tables()
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "inputs": {"pdfs": len(pdfs), "teis": len(tei_paths), "tables": len(tables)},
+        "stages": {},
+    }
+    teis = list(tei_paths.values())
+    with tempfile.TemporaryDirectory() as tmp_dir, GrobidStub(args.recordings, synthesize=False) as stub:
+        stage_args = {
+            "grobid": (list(tei_paths), stub.write_config(tmp_dir)),
+            "tei_parse": (teis,),
+            "section_ranking": (teis, args.model, args.encoder_backend),
+            "table_parse": (tables,),
+            "value_extraction": (tables,),
+        }
+        for stage in args.stages:
+            print(f"Running {stage}...")
+            results["stages"][stage] = run_isolated(stage, *stage_args[stage])
+
+    print(f"\n{'stage':<18}{'items':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'papers/s':>10}{'RSS MB':>9}")
+    for stage, r in results["stages"].items():
+        if "skipped" in r:
+            print(f"{stage:<18} skipped: {r['skipped']}")
+            continue
+        lat = r["latency_ms"]
+        errors = f"  ({r['errors']} errors, {r['error_rate']:.0%}, first: {r['first_error'][:80]})" if r["errors"] else ""
+        print(f"{stage:<18}{r['items']:>7}{lat.get('p50', 0):>10.2f}{lat.get('p90', 0):>10.2f}{lat.get('p99', 0):>10.2f}"
+              f"{r['papers_per_second'] or 0:>10.1f}{r['peak_rss_mb'] or 0:>9.0f}{errors}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(f"\nResults saved in '{args.output}'")
+
+    # A stage where every item failed measured nothing
+    broken = [stage for stage, r in results["stages"].items() if r.get("items") and r["error_rate"] == 1.0]
+    for stage in broken:
+        print(f"FAILED {stage}: all {results['stages'][stage]['items']} items failed "
+              f"(first: {results['stages'][stage]['first_error']})")
+    if broken:
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
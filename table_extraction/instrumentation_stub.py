@@ -0,0 +1,46 @@
+import time
+
+# Stand-in for utils.instrumentation when the repository root is not on
+# sys.path (scripts and notebooks run from table_extraction/). Spans are still
+# timed, since callers read `wall_seconds`, but nothing is recorded.
+
+
+class Span:
+    def __init__(self, n_bytes: int | None, attrs: dict):
+        self.bytes = n_bytes or 0
+        self.attrs = attrs
+        self.wall_seconds = None
+
+    def add_bytes(self, n_bytes: int):
+        self.bytes += n_bytes
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class span:
+    def __init__(self, name: str, bytes: int | None = None, **attrs):
+        self.name = name
+        self.bytes = bytes
+        self.attrs = attrs
+
+    def __enter__(self) -> Span:
+        self._span = Span(self.bytes, dict(self.attrs))
+        self._wall = time.perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.wall_seconds = time.perf_counter() - self._wall
+        return False
+
+
+def count(name: str, value: float = 1, **labels):
+    pass
+
+
+def event(name: str, **attrs):
+    pass
+
+
+def flush():
+    pass
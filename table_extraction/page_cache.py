@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from importlib import metadata
+from pathlib import Path
+
+# Raw DeepDoctection output (table HTML, CSV and boxes) of every analyzed page,
+# so that changes to the HTML post-processing (split_header, extract_tuples...)
+# re-run from disk instead of repeating the layout analysis.
+#
+# Entries are keyed by the analyzer configuration, the SHA-256 of the PDF and
+# the page number: <cache_dir>/<config hash>/<sha[:2]>/<sha>.json holds the
+# pages of one PDF. A new deepdoctection/torch version, another
+# config_overwrite or an edited analyzer yaml gives a new config hash, so
+# stale pages are never read; `prune` deletes them.
+
+CACHE_FORMAT = 1
+CONFIG_NAME = "config.json"
+# Packages whose version changes the analyzer's models or their output
+ANALYZER_PACKAGES = ("deepdoctection", "torch", "torchvision", "timm", "transformers", "pdfplumber")
+
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _dd_config_digest():
+    # The analyzer yaml names the layout, table and cell models (and their
+    # weights); deepdoctection copies it to its cache directory, where it can be edited
+    root = os.environ.get("DEEPDOCTECTION_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "deepdoctection"))
+    path = os.path.join(root, "configs", "dd", "conf_dd_one.yaml")
+    return _file_sha256(path) if os.path.exists(path) else None
+
+
+def analyzer_config(config_overwrite):
+    """
+    Everything the analyzer output depends on besides the PDF: the
+    config_overwrite (USE_OCR, USE_PDF_MINER...), package versions and the
+    analyzer yaml. Computed without importing deepdoctection.
+    """
+    return {
+        "format": CACHE_FORMAT,
+        "config_overwrite": sorted(config_overwrite),
+        "packages": {name: _package_version(name) for name in ANALYZER_PACKAGES},
+        "dd_config": _dd_config_digest(),
+    }
+
+
+def config_hash(config):
+    payload = json.dumps(config, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class PageCache:
+    """
+    Per-page analyzer output on disk for one analyzer configuration.
+
+    Each page entry is {"page", "width", "height", "tables": [{"csv", "html",
+    "bbox"}]}; pages without tables are stored too, so they are not analyzed
+    again. Meant for one writer per PDF at a time (files are replaced
+    atomically).
+    """
+
+    def __init__(self, cache_dir, config):
+        self.root = Path(cache_dir)
+        self.config = config
+        self.config_hash = config_hash(config)
+        self.path = self.root / self.config_hash
+        self.hits = 0
+        self.misses = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        config_path = self.path / CONFIG_NAME
+        if not config_path.exists():
+            _write_json_atomic(config_path, config)
+
+    @staticmethod
+    def digest(path_pdf):
+        return _file_sha256(path_pdf)
+
+    def _document_path(self, digest):
+        return self.path / digest[:2] / f"{digest}.json"
+
+    def document(self, digest):
+        """{"file_name", "num_pages", "pages": {page number: entry}} of a PDF, or None."""
+        try:
+            with open(self._document_path(digest), "r", encoding="utf-8") as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return None
+        document["pages"] = {int(number): page for number, page in document["pages"].items()}
+        return document
+
+    def num_pages(self, digest, path_pdf):
+        """Page count of the PDF, read once with pypdf and then kept in the cache."""
+        document = self.document(digest)
+        if document is not None and document.get("num_pages"):
+            return document["num_pages"]
+        from pypdf import PdfReader
+
+        num_pages = len(PdfReader(str(path_pdf)).pages)
+        self.put(digest, [], file_name=str(path_pdf), num_pages=num_pages)
+        return num_pages
+
+    def get(self, digest, pages):
+        """The cached entries among `pages` (1-based), by page number."""
+        document = self.document(digest)
+        cached = document["pages"] if document is not None else {}
+        found = {number: cached[number] for number in pages if number in cached}
+        self.hits += len(found)
+        self.misses += len(pages) - len(found)
+        return found
+
+    def put(self, digest, page_entries, file_name=None, num_pages=None):
+        document = self.document(digest) or {"file_name": None, "num_pages": None, "pages": {}}
+        document["file_name"] = file_name or document["file_name"]
+        document["num_pages"] = num_pages or document["num_pages"]
+        document["pages"].update((entry["page"], entry) for entry in page_entries)
+        path = self._document_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(path, document)
+
+    def documents(self):
+        """(digest, document) of every PDF in the cache of this configuration."""
+        for path in sorted(self.path.glob("*/*.json")):
+            yield path.stem, self.document(path.stem)
+
+    def tables_output(self, document):
+        """
+        A cached PDF in the format of `extract_table_deepdoctection` output
+        (pages with tables only), e.g. for `extract_values_from_paper`.
+        """
+        results = [
+            {"page": number, "tables": page["tables"]}
+            for number, page in sorted(document["pages"].items()) if page["tables"]
+        ]
+        return {
+            "file_name": document["file_name"],
+            "total_num_tables": sum(len(p["tables"]) for p in results),
+            "results": results,
+        }
+
+    def stale_configs(self):
+        return sorted(p for p in self.root.iterdir() if p.is_dir() and p.name != self.config_hash)
+
+    def prune(self):
+        """Deletes the entries of every other analyzer configuration. Returns their directories."""
+        stale = self.stale_configs()
+        for path in stale:
+            shutil.rmtree(path)
+        return stale
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    import table_extraction_utils as teu
+
+    parser = argparse.ArgumentParser(description="Inspect or prune the DeepDoctection page cache")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--prune", action="store_true", help="Delete entries of other analyzer configurations")
+    args = parser.parse_args()
+
+    cache = teu.page_cache(args.cache_dir)
+    documents = list(cache.documents())
+    print(f"Configuration {cache.config_hash}: {len(documents)} PDFs, "
+          f"{sum(len(d['pages']) for _, d in documents)} pages")
+    for path in cache.stale_configs():
+        print(f"Stale configuration: {path.name}")
+    if args.prune:
+        print(f"{len(cache.prune())} stale configurations deleted")
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+# One row per extracted value. Strings are dictionary-encoded: each string
+# column holds an index into the store's shared string table (-1 = missing).
+RECORD_DTYPE = np.dtype([
+    ("paper", "<i4"),
+    ("table_id", "<i4"),
+    ("page", "<i4"),
+    ("row", "<i4"),
+    ("column", "<i4"),
+    ("metric", "<i4"),
+    ("dataset", "<i4"),
+    ("value", "<f8"),
+])
+STRING_COLUMNS = ("paper", "row", "column", "metric", "dataset")
+INDEXED_COLUMNS = ("paper", "metric", "dataset")
+MISSING = -1
+
+STRINGS_NAME = "strings.json"
+SEGMENTS_DIR = "papers"
+
+
+def records_from_values(values_json):
+    """
+    Flattens the output of `table_extraction.extract_values_from_paper` into
+    one record per value.
+    """
+    records = []
+    for table in values_json["table_values"]:
+        for item in table["data"]:
+            records.append({
+                "table_id": table["id"],
+                "page": table["page"],
+                "row": item["row"],
+                "column": item["column"],
+                "metric": item.get("metric"),
+                "dataset": item.get("dataset"),
+                "value": item["value"],
+            })
+    return records
+
+
+class ResultsStore:
+    """
+    Corpus-level store of extracted table values, as NumPy structured arrays.
+
+    The store is a directory with the shared string table (`strings.json`,
+    append-only) and one `.npy` segment per paper under `papers/`, so adding
+    or re-extracting a paper only rewrites that paper's segment. Reads
+    concatenate the segments once and build sorted indexes on paper, metric
+    and dataset for queries such as `query(metric="Hits@10", dataset="FB15k")`.
+    Meant for a single writer process.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        (self.path / SEGMENTS_DIR).mkdir(parents=True, exist_ok=True)
+
+        strings_path = self.path / STRINGS_NAME
+        self.strings = []
+        if strings_path.exists():
+            with open(strings_path, "r", encoding="utf-8") as f:
+                self.strings = json.load(f)
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+
+        self._segments = {}
+        for segment_path in sorted((self.path / SEGMENTS_DIR).glob("*.npy")):
+            self._segments[int(segment_path.stem)] = np.load(segment_path)
+        self._table = None
+        self._indexes = {}
+
+    def add_paper(self, paper, records):
+        """
+        Stores the records of one paper, replacing any previous records of it.
+        A record is a dict with the RECORD_DTYPE fields; `paper` is taken from
+        the argument and missing strings or values may be None.
+        """
+        paper_code = self.encode(paper)
+        rows = np.empty(len(records), dtype=RECORD_DTYPE)
+        for i, record in enumerate(records):
+            value = record.get("value")
+            rows[i] = (
+                paper_code,
+                record.get("table_id", MISSING),
+                record.get("page", MISSING),
+                self.encode(record.get("row")),
+                self.encode(record.get("column")),
+                self.encode(record.get("metric")),
+                self.encode(record.get("dataset")),
+                np.nan if value is None else value,
+            )
+
+        # The string table goes first so a segment never refers to unsaved strings
+        self._save_strings()
+        segment_path = self.path / SEGMENTS_DIR / f"{paper_code}.npy"
+        tmp_path = f"{segment_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, rows)
+        os.replace(tmp_path, segment_path)
+
+        self._segments[paper_code] = rows
+        self._invalidate()
+        return len(rows)
+
+    def add_values(self, values_json, paper=None):
+        """Stores the output of `extract_values_from_paper` (paper defaults to the PDF stem)."""
+        paper = paper or Path(values_json["file_name"]).stem
+        return self.add_paper(paper, records_from_values(values_json))
+
+    def remove_paper(self, paper):
+        paper_code = self._codes.get(paper)
+        if paper_code is None or paper_code not in self._segments:
+            return False
+        os.remove(self.path / SEGMENTS_DIR / f"{paper_code}.npy")
+        del self._segments[paper_code]
+        self._invalidate()
+        return True
+
+    def papers(self):
+        return [self.strings[code] for code in self._segments]
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def table(self):
+        """All records as a single structured array (string columns encoded)."""
+        if self._table is None:
+            segments = list(self._segments.values())
+            self._table = np.concatenate(segments) if segments else np.empty(0, dtype=RECORD_DTYPE)
+        return self._table
+
+    def encode(self, text):
+        if text is None:
+            return MISSING
+        code = self._codes.get(text)
+        if code is None:
+            code = self._codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+
+    def decode(self, code):
+        return None if code == MISSING else self.strings[code]
+
+    def query(self, paper=None, metric=None, dataset=None):
+        """
+        Encoded rows matching every given filter, e.g.
+        `store.query(metric="Hits@10", dataset="FB15k")`.
+        """
+        rows = None
+        for column, text in (("paper", paper), ("metric", metric), ("dataset", dataset)):
+            if text is None:
+                continue
+            code = self._codes.get(text)
+            if code is None:
+                return self.table[:0]
+            order, keys = self._index(column)
+            matches = order[np.searchsorted(keys, code, "left"):np.searchsorted(keys, code, "right")]
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        if rows is None:
+            return self.table
+        return self.table[np.sort(rows)]
+
+    def to_records(self, rows=None):
+        """Decodes structured rows (all by default) into a list of dicts."""
+        rows = self.table if rows is None else rows
+        records = []
+        for row in rows.tolist():
+            record = dict(zip(RECORD_DTYPE.names, row))
+            for column in STRING_COLUMNS:
+                record[column] = self.decode(record[column])
+            if np.isnan(record["value"]):
+                record["value"] = None
+            records.append(record)
+        return records
+
+    def _index(self, column):
+        # Row order sorting `column`, and the sorted keys for binary search
+        if column not in self._indexes:
+            order = np.argsort(self.table[column], kind="stable")
+            self._indexes[column] = (order, self.table[column][order])
+        return self._indexes[column]
+
+    def _invalidate(self):
+        self._table = None
+        self._indexes = {}
+
+    def _save_strings(self):
+        strings_path = self.path / STRINGS_NAME
+        tmp_path = f"{strings_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.strings, f, ensure_ascii=False)
+        os.replace(tmp_path, strings_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a results store")
+    parser.add_argument("store")
+    parser.add_argument("--paper")
+    parser.add_argument("--metric", help="e.g. Hits@10")
+    parser.add_argument("--dataset", help="e.g. FB15k")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    records = store.to_records(store.query(paper=args.paper, metric=args.metric, dataset=args.dataset))
+    for record in records:
+        print(f"{record['paper'][:40]:<40} {record['row'][:30]:<30} {record['metric'] or '-':<10} "
+              f"{record['dataset'] or '-':<12} {record['value']}")
+    print(f"{len(records)} values")
@@ -1,98 +1,173 @@
 import json
-import deepdoctection as dd
 import time
-import io
-import re
-import pandas as pd
 from pathlib import Path
 import table_extraction_utils as teu
+import vocabulary as voc
+
+try:
+    from utils import instrumentation as inst
+except ImportError:
+    # Repository root not on sys.path (run from table_extraction/): nothing is recorded
+    import instrumentation_stub as inst
 
 #Global variables
 METRICS_LIST = ["Accuracy", "MRR", "Hits@1", "Hits@3", "Hits@10", "F1-Score"]
 
 DATASET_LIST = ["WN18","Dataset-B1","FB15k", "Dataset_A2", "WD"]
 
+# Rows read as column headers when looking for metric names
+METRIC_HEADER_ROWS = 3
+
 path_pdf = r"pdfs_prueba/HyperKG- Hyperbolic Knowledge Graph Embeddings for Knowledge Base Completion.pdf"
 
 
 
 #Only looks for the predefined set of metrics specified in METRICS_LIST
 def metric_extraction_from_table(html_str,lista_objetivo):
-    metricas_encontradas = set()
-
-    try:
-        dfs = pd.read_html(io.StringIO(html_str), header=[0, 1, 2])
-    except:
+    # html_str may also be an already built teu.TableGrid
+    grid = teu.as_table_grid(html_str)
+    if grid.cells.size == 0:
         return []
 
-    if not dfs: return []
-    df = dfs[0]
-
-    for col_tuple in df.columns:
-        texto_cabecera = " ".join([str(x) for x in col_tuple if "Unnamed" not in str(x) and str(x) != "nan"])
+    textos = set(grid.column_headers(METRIC_HEADER_ROWS))
+    textos.update(grid.stub_column(METRIC_HEADER_ROWS))
 
-        metrica = teu.normalizar_texto(texto_cabecera)
+    metricas_encontradas = set()
+    for texto in textos:
+        metrica = teu.normalizar_texto(texto)
         if metrica:
             metricas_encontradas.add(metrica)
 
-    try:
-        primera_columna = df.iloc[:, 0].astype(str).tolist()
-        for celda in primera_columna:
-            metrica = teu.normalizar_texto(celda)
-            if metrica:
-                metricas_encontradas.add(metrica)
-    except:
-        pass
-
     metricas_presentes = list(metricas_encontradas.intersection(set(lista_objetivo)))
 
     return metricas_presentes
 
-#Looks for the datasets in DATASET_LIST in the input HTML
+
+_vocabulary = None
+
+
+def get_vocabulary():
+    """
+    DATASET_LIST, METRICS_LIST and the dataset names in data/datasets.json
+    that are known datasets, compiled once into a single matcher.
+    """
+    global _vocabulary
+    if _vocabulary is None:
+        _vocabulary = voc.Vocabulary.from_sources(DATASET_LIST, METRICS_LIST)
+    return _vocabulary
+
+
+#Looks for the known datasets in the cell text of the input tables (HTML or teu.TableGrid)
 def search_datasets_in_tables_html(html_list):
-    possible_datasets = DATASET_LIST.copy()
-    found_datasets = []
+    vocabulary = get_vocabulary()
+    found_datasets = {}
     for html in html_list:
-        for dataset_name in possible_datasets:
-            clean_dataset_name = "".join(filter(str.isalnum, dataset_name))
-            regex_pattern = r"[\W_]*".join(re.escape(c) for c in clean_dataset_name)
-            final_pattern = r"\b" + regex_pattern
+        for dataset_name in vocabulary.scan_texts(teu.as_table_grid(html).unique_texts())["datasets"]:
+            found_datasets[dataset_name] = None
+
+    return list(found_datasets)
 
-            if re.search(final_pattern, html, re.IGNORECASE) and dataset_name not in found_datasets:
-                found_datasets.append(dataset_name)
 
+#Looks for the known datasets and metrics in a paper's full text, e.g. utils.tei_extraction.tei_to_full_raw_text
+def search_mentions_in_text(raw_text):
+    vocabulary = get_vocabulary()
+    return vocabulary.scan_texts([raw_text])
+
+
+def annotate_values(grid, extracted_data):
+    """
+    Adds the normalized "metric" and "dataset" of every value, from its column
+    context or, failing that, its row label. A value with no dataset of its
+    own gets the table's dataset when the table mentions only one.
+    """
+    vocabulary = get_vocabulary()
+    table_datasets = vocabulary.scan_texts(grid.unique_texts())["datasets"]
+    table_dataset = table_datasets[0] if len(table_datasets) == 1 else None
+
+    for item in extracted_data:
+        item["metric"] = teu.normalizar_texto(item["column"]) or teu.normalizar_texto(item["row"])
+        datasets = vocabulary.find_datasets(item["column"]) or vocabulary.find_datasets(item["row"])
+        item["dataset"] = datasets[0] if datasets else table_dataset
+    return extracted_data
 
-    found_datasets = []
-    search_datasets_in_tables_html()
-    return found_datasets
 
 #Extracts pairings model-metric-dataset from the table:
-def extract_values_from_paper(tables_json_route):
-    with open(tables_json_route, "r", encoding="utf-8") as j:
-        tables_json = json.load(j)
+def extract_values_from_paper(tables_json_route, output_path="values.json", store=None):
+    """
+    `tables_json_route` is a DeepDoctection output file or the output itself.
+    Writes the values to `output_path` (skipped if None) and, if a
+    results_store.ResultsStore is given, replaces this paper's rows in it.
+    """
+    if isinstance(tables_json_route, dict):
+        tables_json = tables_json_route
+    else:
+        with open(tables_json_route, "r", encoding="utf-8") as j:
+            tables_json = json.load(j)
 
     all_tables_data = []
     id = 0
-    for page_data in tables_json['results']:
-        for table in page_data['tables']:
-            try:
-                extracted_data = teu.extract_values_from_html_table(table['html'])
-                id += 1
-                table_object = {
-                    "id": id,
-                    "page": page_data['page'],
-                    "num_values": len(extracted_data),
-                    "data": extracted_data
-                }
-                all_tables_data.append(table_object)
-            except Exception as e:
-                print(f"   ⚠️ SALTANDO TABLA: Estructura errónea o compleja.")
-                print(f"      └── Causa: {e}")
+    with inst.span("tables.extract_values", paper=tables_json["file_name"]) as paper_span:
+        for page_data in tables_json['results']:
+            for table in page_data['tables']:
+                try:
+                    with inst.span("tables.extract_table", bytes=len(table['html']), page=page_data['page']):
+                        grid = teu.TableGrid.from_html(table['html'])
+                        extracted_data = annotate_values(grid, teu.extract_values_from_html_table(grid))
+                    id += 1
+                    table_object = {
+                        "id": id,
+                        "page": page_data['page'],
+                        "num_values": len(extracted_data),
+                        "data": extracted_data
+                    }
+                    all_tables_data.append(table_object)
+                    paper_span.add_bytes(len(table['html']))
+                    inst.count("tables_extracted_total")
+                    inst.count("values_extracted_total", len(extracted_data))
+                except Exception as e:
+                    # Estructura errónea o compleja: la tabla se salta
+                    inst.event("table_skipped", paper=tables_json["file_name"], page=page_data['page'],
+                               error=f"{type(e).__name__}: {e}")
     values_output_json = {
         "file_name": tables_json["file_name"],
         "total_num_tables": all_tables_data.__len__(),
         "table_values": all_tables_data
     }
 
-    with open("values.json", "w", encoding="utf-8") as f:
-        json.dump(values_output_json, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+    if output_path is not None:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(values_output_json, f, indent=4, ensure_ascii=False)
+    if store is not None:
+        store.add_values(values_output_json)
+    return values_output_json
+
+
+def extract_values_from_outputs(tables_json_routes, store):
+    """Loads many DeepDoctection outputs into one results store, one paper at a time."""
+    for tables_json_route in tables_json_routes:
+        values = extract_values_from_paper(tables_json_route, output_path=None, store=store)
+        print(f"{values['file_name']}: {values['total_num_tables']} tables stored")
+    return store
+
+
+def extract_values_from_cache(cache_dir, store=None, output_dir=None):
+    """
+    Re-runs the value extraction over every PDF in the DeepDoctection page
+    cache (see page_cache), without the analyzer. Values go to `store` and/or
+    one `<pdf stem>.json` per PDF in `output_dir`. Returns the number of PDFs.
+    """
+    cache = teu.page_cache(cache_dir)
+    if output_dir is not None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+    n_papers = 0
+    for digest, document in cache.documents():
+        tables_json = cache.tables_output(document)
+        tables_json["file_name"] = tables_json["file_name"] or digest
+        output_path = None
+        if output_dir is not None:
+            output_path = str(Path(output_dir) / f"{Path(tables_json['file_name']).stem}.json")
+        extract_values_from_paper(tables_json, output_path=output_path, store=store)
+        n_papers += 1
+    print(f"Values extracted from {n_papers} cached PDFs")
+    return n_papers
+
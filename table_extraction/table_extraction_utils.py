@@ -1,22 +1,46 @@
+import argparse
 import json
-import deepdoctection as dd
-import time
-import io
+import multiprocessing
+import os
+import sys
+import tempfile
 import re
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
+import numpy as np
+import page_cache as pc
+import table_prefilter as tpf
+# Metric patterns live in vocabulary.py; still reachable as teu.normalizar_texto etc.
+from vocabulary import PATRONES, REGEX_HITS, normalizar_texto
+
+try:
+    from utils import instrumentation as inst
+except ImportError:
+    # Repository root not on sys.path (run from table_extraction/): nothing is recorded
+    import instrumentation_stub as inst
 
 config_overwrite = ["USE_OCR=False", "USE_PDF_MINER=True"]
-analyzer = dd.get_dd_analyzer(config_overwrite=config_overwrite)
 
-PATRONES = {
-    "Accuracy": re.compile(r"\b(?:acc(?:uracy)?|c\.?a\.?)\b", re.IGNORECASE),
-    "MRR": re.compile(r"\b(?:mrr|mean\s+reciprocal\s+rank)\b", re.IGNORECASE),
-    "F1-Score": re.compile(r"\bf-?1(?:-?(?:score|measure))?\b", re.IGNORECASE),
+# deepdoctection (and its models) are only loaded when the analyzer is first needed
+_analyzer = None
 
-}
-REGEX_HITS = re.compile(r"\b(?:hits?|h)(?:\s*@\s*|\s+at\s+|\s*)(\d{1,3})\b", re.IGNORECASE)
+
+def get_analyzer():
+    """Devuelve el analizador de DeepDoctection, creado una sola vez por proceso."""
+    global _analyzer
+    if _analyzer is None:
+        import deepdoctection as dd
+        _analyzer = dd.get_dd_analyzer(config_overwrite=config_overwrite)
+    return _analyzer
+
+
+def __getattr__(name):
+    # Keeps `teu.analyzer` working without building it at import time
+    if name == "analyzer":
+        return get_analyzer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def read_table_output_json(path_json):
@@ -32,110 +56,352 @@ def read_table_output_json(path_json):
     return tables_html
 
 
-def normalizar_texto(texto):
-    """Convierte texto sucio ('H@ 10') en métrica canónica ('Hits@10')."""
-    texto = str(texto).strip()
-
-    match = REGEX_HITS.search(texto)
-    if match:
-        return f"Hits@{match.group(1)}"
-
-    for nombre_canonico, patron in PATRONES.items():
-        if patron.search(texto):
-            return nombre_canonico
+def page_cache(cache_dir):
+    """PageCache of `cache_dir` for the current analyzer configuration."""
+    return pc.PageCache(cache_dir, pc.analyzer_config(config_overwrite))
 
-    return None
 
-    # Pruebas\pdfs_prueba\
-
-
-def extract_table_deepdoctection(path_pdf):
-    start_time = time.time()
+def _table_bbox(table):
+    # [x1, y1, x2, y2] in page pixels; the accessor differs between deepdoctection versions
+    try:
+        bbox = table.bbox
+        return [float(v) for v in (bbox.to_list(mode="xyxy") if hasattr(bbox, "to_list") else bbox)]
+    except Exception:
+        return None
 
-    df = analyzer.analyze(path=path_pdf)
-    df.reset_state()
 
+def _collect_tables(df, pages=None):
+    # One entry per analyzed page, with or without tables
     results_data = []
 
     for dp in df:
-        print(f"\n--- Processing page {dp.page_number} ---")
-
-        if len(dp.tables) > 0:
-            print(f"{len(dp.tables)} tables found")
-        else:
-            print("No tables found")
+        page_number = pages[dp.page_number] if pages else dp.page_number + 1
+        inst.count("pages_analyzed_total")
+        inst.count("tables_found_total", len(dp.tables))
 
         table_content = []
         for table in dp.tables:
             table_content.append({
                 "csv": table.csv,
-                "html": table.html
+                "html": table.html,
+                "bbox": _table_bbox(table)
             })
 
-        if table_content:
-            page_data = {
-                "page": dp.page_number + 1,
-                "tables": table_content
-            }
-            results_data.append(page_data)
-
-    end_time = time.time()
-    total_time = end_time - start_time
-
-    print(f"\nTotal time: {total_time:.2f} seconds")
+        results_data.append({
+            "page": page_number,
+            "width": getattr(dp, "width", None),
+            "height": getattr(dp, "height", None),
+            "tables": table_content
+        })
+    return results_data
+
+
+def _analyze_pages(path_pdf, pages=None):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        analyzed_pdf = path_pdf
+        if pages is not None:
+            analyzed_pdf = tpf.write_page_subset(path_pdf, pages, os.path.join(tmp_dir, "candidate_pages.pdf"))
+        with inst.span("deepdoctection.analyze", pages=None if pages is None else len(pages)):
+            df = get_analyzer().analyze(path=analyzed_pdf)
+            df.reset_state()
+            return _collect_tables(df, pages)
+
+
+def _analyze_pages_cached(path_pdf, pages, cache):
+    # Only the pages missing from the cache go through the analyzer
+    digest = cache.digest(path_pdf)
+    wanted = list(pages) if pages is not None else list(range(1, cache.num_pages(digest, path_pdf) + 1))
+    found = cache.get(digest, wanted)
+    missing = [number for number in wanted if number not in found]
+    inst.count("page_cache_hits_total", len(found))
+    inst.count("page_cache_misses_total", len(missing))
+    if missing:
+        # The whole PDF is analyzed as is, without writing a page subset
+        analyzed = _analyze_pages(path_pdf, None if len(missing) == len(wanted) and pages is None else missing)
+        cache.put(digest, analyzed, file_name=str(path_pdf))
+        wanted_set = set(wanted)
+        found.update((entry["page"], entry) for entry in analyzed if entry["page"] in wanted_set)
+    return [found[number] for number in sorted(found)], len(wanted) - len(missing)
+
+
+def extract_table_deepdoctection(path_pdf, output_path="deepdoctection_output.json", pages=None, cache=None):
+    """
+    `pages` (1-based) restricts the analysis to those pages, e.g. the candidates
+    from `table_prefilter.candidate_pages`; page numbers in the output still
+    refer to the original PDF. With a `cache` (see `page_cache`) pages analyzed
+    before with the same configuration are read from disk.
+    """
+    cached_pages = None
+    with inst.span("deepdoctection.extract_tables", bytes=os.path.getsize(path_pdf), pdf=path_pdf) as span:
+        if pages is not None and not pages:
+            inst.event("pdf_skipped", pdf=path_pdf, reason="no candidate pages")
+            page_results = []
+        elif cache is not None:
+            page_results, cached_pages = _analyze_pages_cached(path_pdf, pages, cache)
+        else:
+            page_results = _analyze_pages(path_pdf, pages)
+        results_data = [{"page": p["page"], "tables": p["tables"]} for p in page_results if p["tables"]]
+        span.set(tables=sum(len(p["tables"]) for p in results_data), cached_pages=cached_pages)
 
     final_output = {
         "file_name": path_pdf,
-        "runtime_seconds": round(total_time, 2),
+        "runtime_seconds": round(span.wall_seconds, 2),
         "total_num_tables": sum(len(p["tables"]) for p in results_data),
         "results": results_data
     }
+    if pages is not None:
+        final_output["analyzed_pages"] = list(pages)
+    if cached_pages is not None:
+        final_output["cached_pages"] = cached_pages
 
-    with open("deepdoctection_output.json", "w", encoding="utf-8") as f:
-        json.dump(final_output, f, indent=4, ensure_ascii=False)
+    if output_path is not None:
+        write_json_atomic(output_path, final_output)
+        print(f"Data saved in '{output_path}'")
 
-    print("Data saved in 'deepdoctection_output.json'")
+    return final_output
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
-def html_to_matrix(html_str):
-    soup = BeautifulSoup(html_str, 'html.parser')
-    rows = soup.find_all('tr')
 
-    grid = {}
-    max_cols = 0
-    max_rows = len(rows)
+def list_pdfs(source):
+    """
+    PDFs to process from a directory, a download manifest (manifest.json written
+    by utils.pdf_downloader) or an explicit list of paths.
+    """
+    if isinstance(source, (list, tuple)):
+        return [str(p) for p in source]
+    source = Path(source)
+    if source.is_dir():
+        return sorted(str(p) for p in source.glob("*.pdf"))
+    with open(source, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return [entry["path"] for entry in manifest.values()]
 
-    # Processing
-    for r, row in enumerate(rows):
-        cells = row.find_all(['td', 'th'])
-        c_idx = 0
 
-        for cell in cells:
-            while (r, c_idx) in grid:
-                c_idx += 1
+def output_path_for(path_pdf, output_dir):
+    return str(Path(output_dir) / f"{Path(path_pdf).stem}.json")
 
-            text = cell.get_text(strip=True)
-            rowspan = int(cell.get('rowspan', 1))
-            colspan = int(cell.get('colspan', 1))
 
-            for i in range(rowspan):
-                for j in range(colspan):
-                    real_row = r + i
-                    real_column = c_idx + j
+def _init_worker():
+    # Each worker process builds its own analyzer once, before its first PDF
+    get_analyzer()
 
-                    grid[(real_row, real_column)] = text
-                    if real_column >= max_cols:
-                        max_cols = real_column + 1
 
-            c_idx += colspan
+_worker_caches = {}
 
-    # Turn dictionary into lists (matrix)
-    matrix = []
-    for r in range(max_rows):
-        current_row = []
-        for c in range(max_cols):
-            current_row.append(grid.get((r, c), ""))
-        matrix.append(current_row)
-    return matrix
+
+def _extract_in_worker(path_pdf, output_path, prefilter=False, cache_dir=None):
+    try:
+        pages = tpf.candidate_pages(path_pdf) if prefilter else None
+        if cache_dir is not None and cache_dir not in _worker_caches:
+            _worker_caches[cache_dir] = page_cache(cache_dir)
+        cache = _worker_caches.get(cache_dir)
+        return extract_table_deepdoctection(path_pdf, output_path=output_path, pages=pages, cache=cache), None
+    except Exception as e:
+        return {"file_name": path_pdf}, f"{type(e).__name__}: {e}"
+    finally:
+        # Pool workers exit without running atexit: write their counters to the trace now
+        inst.flush()
+
+
+def extract_tables_batch(source, output_dir="deepdoctection_outputs", workers=None, jsonl_path=None, skip_existing=True,
+                         prefilter=False, dedup=False, cache_dir=None):
+    """
+    Runs `extract_table_deepdoctection` over many PDFs on a process pool.
+
+    Writes one `<pdf stem>.json` per PDF into `output_dir`, or, if `jsonl_path`
+    is given, appends one line per PDF to that file instead. PDFs whose output
+    already exists are skipped. With `prefilter=True` only the candidate table
+    pages found by `table_prefilter` are analyzed. With `dedup=True` only the
+    canonical copy of each paper is processed (see utils.pdf_dedup). With a
+    `cache_dir` pages are read from and added to the page cache. Returns a
+    summary per processed PDF.
+    """
+    pdfs = list_pdfs(source)
+    if dedup:
+        from utils.pdf_dedup import PdfDeduplicator
+
+        canonical = PdfDeduplicator(workers=workers).canonical_paths(pdfs)
+        print(f"{len(pdfs) - len(canonical)} duplicate PDFs skipped")
+        pdfs = canonical
+
+    if jsonl_path is not None:
+        done = set()
+        if skip_existing and os.path.exists(jsonl_path):
+            with open(jsonl_path, "r", encoding="utf-8") as f:
+                done = {json.loads(line)["file_name"] for line in f if line.strip()}
+        jobs = [(p, None) for p in pdfs if p not in done]
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        jobs = [(p, output_path_for(p, output_dir)) for p in pdfs]
+        if skip_existing:
+            jobs = [(p, out) for p, out in jobs if not os.path.exists(out)]
+
+    print(f"{len(jobs)} PDFs to process ({len(pdfs) - len(jobs)} already done)")
+    summaries = []
+    # spawn: deepdoctection/torch state must not be forked into the workers
+    context = multiprocessing.get_context("spawn")
+    # With a page cache most PDFs may need no analysis: the analyzer is built on first use
+    initializer = _init_worker if cache_dir is None else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer) as pool:
+        futures = [pool.submit(_extract_in_worker, p, out, prefilter, cache_dir) for p, out in jobs]
+        jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path is not None else None
+        try:
+            for future in as_completed(futures):
+                output, error = future.result()
+                if error is None and jsonl is not None:
+                    jsonl.write(json.dumps(output, ensure_ascii=False) + "\n")
+                    jsonl.flush()
+                summary = {
+                    "file_name": output["file_name"],
+                    "runtime_seconds": output.get("runtime_seconds"),
+                    "total_num_tables": output.get("total_num_tables"),
+                    "error": error,
+                }
+                if error is None:
+                    print(f"{summary['file_name']}: {summary['total_num_tables']} tables in {summary['runtime_seconds']}s")
+                else:
+                    print(f"{summary['file_name']}: FAILED ({error})")
+                summaries.append(summary)
+        finally:
+            if jsonl is not None:
+                jsonl.close()
+    return summaries
+
+def _span(value):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _to_float_or_nan(text):
+    value = clean_and_convert_to_float(text)
+    return np.nan if value is None else value
+
+
+class TableGrid:
+    """
+    Tabla HTML parseada una sola vez.
+
+    `cells` es un array 2-D de str con rowspan/colspan ya expandidos;
+    `is_numeric` (bool) y `values` (float, NaN si la celda no es un número) se
+    calculan junto con él, una vez por texto distinto. Cabeceras, tuplas,
+    métricas y datasets se extraen de este mismo objeto.
+    """
+
+    def __init__(self, cells, is_numeric=None, values=None):
+        cells = np.asarray(cells, dtype=str)
+        if cells.ndim != 2:
+            cells = cells.reshape(len(cells), -1) if cells.size else np.empty((0, 0), dtype=str)
+        self.cells = cells
+
+        if is_numeric is None or values is None:
+            texts, inverse = np.unique(cells, return_inverse=True)
+            inverse = inverse.reshape(cells.shape)
+            is_numeric = np.array([is_value(t) for t in texts], dtype=bool)[inverse]
+            values = np.array([_to_float_or_nan(t) for t in texts], dtype=float)[inverse]
+        self.is_numeric = is_numeric
+        self.values = values
+
+    @classmethod
+    def from_html(cls, html_str):
+        try:
+            root = lxml.html.fromstring(html_str)
+        except (lxml.etree.ParserError, ValueError):
+            # HTML vacío o sin elementos
+            return cls(np.empty((0, 0), dtype=str))
+
+        rows = list(root.iter("tr"))
+        n_rows = len(rows)
+        n_cols = 0
+        # Por fila, columna -> texto de la celda que la ocupa
+        taken = [{} for _ in range(n_rows)]
+
+        for r, row in enumerate(rows):
+            c_idx = 0
+            for cell in row.iter("td", "th"):
+                while c_idx in taken[r]:
+                    c_idx += 1
+
+                text = "".join(t.strip() for t in cell.itertext())
+                rowspan = _span(cell.get("rowspan", 1))
+                colspan = _span(cell.get("colspan", 1))
+
+                for real_row in range(r, min(r + rowspan, n_rows)):
+                    for real_column in range(c_idx, c_idx + colspan):
+                        taken[real_row][real_column] = text
+
+                c_idx += colspan
+                n_cols = max(n_cols, c_idx)
+
+        cells = np.full((n_rows, n_cols), "", dtype=object)
+        for r, row_cells in enumerate(taken):
+            for c, text in row_cells.items():
+                cells[r, c] = text
+        return cls(cells)
+
+    @property
+    def n_rows(self):
+        return self.cells.shape[0]
+
+    @property
+    def n_cols(self):
+        return self.cells.shape[1]
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, rows):
+        """Sub-tabla con las filas `rows` (un slice), sin volver a parsear."""
+        return TableGrid(self.cells[rows], self.is_numeric[rows], self.values[rows])
+
+    def to_matrix(self):
+        return self.cells.tolist()
+
+    def unique_texts(self):
+        return [t for t in np.unique(self.cells).tolist() if t]
+
+    def header_row_count(self):
+        """
+        Índice de la primera fila de datos: más de la mitad de sus celdas
+        (sin contar la primera columna) son números y su primera celda difiere
+        de la esquina superior izquierda. 0 si no hay ninguna.
+        """
+        if self.n_rows == 0 or self.n_cols < 2:
+            return 0
+        numeric_fraction = self.is_numeric[:, 1:].mean(axis=1)
+        data_rows = np.flatnonzero((numeric_fraction > 0.5) & (self.cells[:, 0] != self.cells[0, 0]))
+        return int(data_rows[0]) if data_rows.size else 0
+
+    def column_headers(self, n_header_rows):
+        """Texto de cabecera de cada columna: sus celdas no vacías en las primeras filas."""
+        header = self.cells[:n_header_rows]
+        return [" ".join(t for t in column if t) for column in header.T.tolist()]
+
+    def stub_column(self, start=0):
+        """Primera columna a partir de la fila `start`."""
+        if self.n_cols == 0:
+            return []
+        return self.cells[start:, 0].tolist()
+
+
+def as_table_grid(table):
+    """Acepta HTML, una matriz (lista de filas) o una TableGrid ya construida."""
+    if isinstance(table, TableGrid):
+        return table
+    if isinstance(table, str):
+        return TableGrid.from_html(table)
+    return TableGrid(table)
+
+
+def html_to_matrix(html_str):
+    return TableGrid.from_html(html_str).to_matrix()
 
 
 def is_value(text):
@@ -156,74 +422,98 @@ def clean_and_convert_to_float(value_str):
 
 
 def split_header(matrix):
-    if not matrix: return [], []
-    stub_header = matrix[0][0]
-    split_idx = 0
-
-    for i, row in enumerate(matrix):
-        cells_to_evaluate = row[1:]
-        if not cells_to_evaluate: continue
-
-        cells_total = len(cells_to_evaluate)
-        num_count = sum(1 for c in cells_to_evaluate if is_value(c))
-        different_stub = (row[0] != stub_header)
-
-        if (num_count / cells_total) > 0.5 and different_stub:
-            split_idx = i
-            break
-
-    headers = matrix[:split_idx]
-    values = matrix[split_idx:]
-    return headers, values
-
-
-def extract_tuples(headers, values):
+    """
+    Separa filas de cabecera y filas de datos. Devuelve dos TableGrid si recibe
+    una TableGrid, o dos listas de filas si recibe una matriz.
+    """
+    grid = as_table_grid(matrix)
+    split_idx = grid.header_row_count()
+    headers, values = grid[:split_idx], grid[split_idx:]
+    if isinstance(matrix, TableGrid):
+        return headers, values
+    return headers.to_matrix(), values.to_matrix()
+
+
+def _column_contexts(headers):
     context_by_column = []
-    num_of_columns = len(headers[0])
-
-    for col_idx in range(1, num_of_columns):
+    for column in headers.cells.T[1:].tolist():
         linked_parts = []
         last_seen_value = ""
-
-        for header_row in headers:
-            current_value = header_row[col_idx]
+        for current_value in column:
             if current_value and current_value != last_seen_value:
                 linked_parts.append(current_value)
                 last_seen_value = current_value
+        context_by_column.append(" | ".join(linked_parts))
+    return context_by_column
 
-        final_context = " | ".join(linked_parts)
-        context_by_column.append(final_context)
 
-    tuples = []
+def _iter_tuples(headers, values):
+    # (fila, contexto de columna, texto, float o NaN) por cada celda con valor
+    if headers.n_rows == 0:
+        raise ValueError("No se encontraron filas de cabecera.")
+    context_by_column = _column_contexts(headers)
+
+    body = values.cells[:, 1:]
+    keep = ~np.isin(body, ["-", "–", ""])
+    for r, c in zip(*np.nonzero(keep)):
+        yield values.cells[r, 0], context_by_column[c], body[r, c], values.values[r, c + 1]
 
-    for value_row in values:
-        row_title = value_row[0]
-        all_values = value_row[1:]
-        for context, value in zip(context_by_column, all_values):
-            if value in ["-", "–", ""]:
-                continue
-            tuple = (row_title, context, value)
-            print(f"{tuple}")
-            tuples.append(tuple)
+
+def extract_tuples(headers, values, on_tuple=None):
+    """
+    (fila, contexto de columna, valor) por cada celda de datos. `on_tuple`, si
+    se da, se llama con cada tupla (p. ej. `on_tuple=print` para depurar).
+    """
+    tuples = []
+    for row_title, context, text, _ in _iter_tuples(as_table_grid(headers), as_table_grid(values)):
+        tuple = (str(row_title), context, str(text))
+        if on_tuple is not None:
+            on_tuple(tuple)
+        tuples.append(tuple)
 
     return tuples
 
 
-def extract_values_from_html_table(html):
-    matrix = html_to_matrix(html)
-    if not matrix:
+def extract_values_from_html_table(html, on_tuple=None):
+    grid = as_table_grid(html)
+    if grid.cells.size == 0:
         raise ValueError("La matriz generada está vacía (HTML sin estructura válida).")
-    headers, values = split_header(matrix)
-    if not values:
+    headers, values = split_header(grid)
+    if not len(values):
         raise ValueError("No se pudieron separar datos numéricos de las cabeceras.")
-    tuples = extract_tuples(headers, values)
     structured_data = []
 
-    for tuple in tuples:
+    for row_title, context, text, value in _iter_tuples(headers, values):
+        if on_tuple is not None:
+            on_tuple((str(row_title), context, str(text)))
         structured_data.append({
-            "row": tuple[0],
-            "column": tuple[1],
-            "value": clean_and_convert_to_float(tuple[2])
+            "row": str(row_title),
+            "column": context,
+            "value": None if np.isnan(value) else float(value)
         })
 
-    return structured_data
\ No newline at end of file
+    return structured_data
+
+
+if __name__ == "__main__":
+    # utils (instrumentation, pdf_dedup) lives in the repository root; spawned
+    # workers inherit sys.path
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from utils import instrumentation as inst
+
+    parser = argparse.ArgumentParser(description="Batch table extraction with DeepDoctection")
+    parser.add_argument("source", help="Directory of PDFs or download manifest.json")
+    parser.add_argument("-o", "--output-dir", default="deepdoctection_outputs")
+    parser.add_argument("--jsonl", help="Append all outputs to this JSONL file instead")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true", help="Re-process PDFs with existing output")
+    parser.add_argument("--prefilter", action="store_true", help="Only analyze candidate table pages")
+    parser.add_argument("--dedup", action="store_true", help="Skip duplicate copies of the same paper")
+    parser.add_argument("--page-cache", help="Cache directory of per-page analyzer output")
+    args = parser.parse_args()
+
+    extract_tables_batch(
+        args.source, args.output_dir, workers=args.workers,
+        jsonl_path=args.jsonl, skip_existing=not args.overwrite, prefilter=args.prefilter, dedup=args.dedup,
+        cache_dir=args.page_cache
+    )
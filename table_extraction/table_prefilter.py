@@ -0,0 +1,162 @@
+import argparse
+import json
+import re
+from pathlib import Path
+
+# "Table 3:", "Table 3.", "TABLE III" (alone on its line) at the start of a line:
+# a table caption, as opposed to a sentence such as "Table 3 shows ..."
+CAPTION_REGEX = re.compile(
+    r"^\s*(?:table|tab\.)\s*(?:\d+|[ivxlc]+)\s*(?:[:.|]|$)", re.IGNORECASE | re.MULTILINE
+)
+# A cell value: 35.5, 0,912, 89.2%, -1.3*, 315
+VALUE_REGEX = re.compile(r"^[-+±]?\d+(?:[.,]\d+)?[%*†‡]?$")
+DECIMAL_REGEX = re.compile(r"\d[.,]\d|%")
+
+# pdfminer emits table cells as short lines of values, other extractors emit whole
+# rows ("TransE 263 251 75.4 89.2"). A page with at least this many such numeric
+# rows (one value decimal) holds a dense numeric block. Requiring a decimal keeps
+# out line numbers, years and page ranges.
+NUMERIC_ROWS_PER_PAGE = 5
+# Pages where pdfminer finds less text than this (some Type1/CFF fonts) are
+# re-read with pypdf
+MIN_PAGE_CHARS = 300
+
+TEI_NS = {"tei": "http://www.tei-c.org/ns/1.0"}
+
+
+def page_texts(path_pdf):
+    """Text of every page, in order, using pdfminer's layout analysis."""
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    texts = [
+        "\n".join(element.get_text() for element in page_layout if isinstance(element, LTTextContainer))
+        for page_layout in extract_pages(str(path_pdf))
+    ]
+
+    sparse = [i for i, text in enumerate(texts) if len(text.strip()) < MIN_PAGE_CHARS]
+    if sparse:
+        from pypdf import PdfReader
+
+        reader = PdfReader(str(path_pdf))
+        for i in sparse:
+            texts[i] = reader.pages[i].extract_text() or texts[i]
+    return texts
+
+
+def is_numeric_row(line):
+    tokens = line.split()
+    values = [t for t in tokens if VALUE_REGEX.match(t)]
+    if not values or not any(DECIMAL_REGEX.search(t) for t in values):
+        return False
+    return len(values) == len(tokens) or (len(values) >= 3 and 2 * len(values) >= len(tokens))
+
+
+def is_table_page(text):
+    if CAPTION_REGEX.search(text):
+        return True
+    return sum(1 for line in text.splitlines() if is_numeric_row(line)) >= NUMERIC_ROWS_PER_PAGE
+
+
+def candidate_pages_from_text(path_pdf):
+    """
+    1-based numbers of the pages with a table caption or a dense block of
+    numeric rows, from a pdfminer text scan.
+    """
+    return [number for number, text in enumerate(page_texts(path_pdf), start=1) if is_table_page(text)]
+
+
+def candidate_pages_from_tei(tei_xml):
+    """
+    1-based page numbers of GROBID `<figure type="table">` elements. The TEI must
+    have been produced with `tei_coordinates=True` and "figure" in the
+    configured coordinates (see utils/grobid_config.json).
+    """
+    from lxml import etree
+
+    if isinstance(tei_xml, str):
+        tei_xml = tei_xml.encode()
+    root = etree.fromstring(tei_xml)
+    pages = set()
+    for figure in root.xpath('//tei:figure[@type="table"]', namespaces=TEI_NS):
+        # coords="page,x,y,w,h;page,x,y,w,h..."
+        for box in filter(None, (figure.get("coords") or "").split(";")):
+            pages.add(int(float(box.split(",")[0])))
+    return sorted(pages)
+
+
+def candidate_pages(path_pdf, tei_xml=None):
+    """Union of the TEI-based (when a TEI is given) and text-based candidates."""
+    pages = set(candidate_pages_from_text(path_pdf))
+    if tei_xml is not None:
+        pages.update(candidate_pages_from_tei(tei_xml))
+    return sorted(pages)
+
+
+def write_page_subset(path_pdf, pages, output_pdf):
+    """Writes a PDF containing only `pages` (1-based, in the given order)."""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(str(path_pdf))
+    writer = PdfWriter()
+    for number in pages:
+        writer.add_page(reader.pages[number - 1])
+    with open(output_pdf, "wb") as f:
+        writer.write(f)
+    return output_pdf
+
+
+def _normalize_title(title):
+    return "".join(c for c in title.lower() if c.isalnum())
+
+
+def prefilter_recall(pdf_dir, ground_truth_path):
+    """
+    Measures the table pages the text prefilter would lose on a ground-truth
+    set (table_extraction/pdfs_prueba), and how many pages it saves.
+    """
+    with open(ground_truth_path, "r", encoding="utf-8") as f:
+        documents = json.load(f)["documents"]
+    pdfs = {_normalize_title(p.stem): p for p in Path(pdf_dir).glob("*.pdf")}
+
+    report = {"documents": [], "expected_pages": 0, "found_pages": 0, "total_pages": 0, "candidate_pages": 0}
+    for doc in documents:
+        path_pdf = pdfs.get(_normalize_title(doc["paper_title"]))
+        if path_pdf is None:
+            continue
+        texts = page_texts(path_pdf)
+        candidates = {number for number, text in enumerate(texts, start=1) if is_table_page(text)}
+        expected = {table["page"] for table in doc["tables"]}
+        found = expected & candidates
+
+        report["documents"].append({
+            "paper_title": doc["paper_title"],
+            "num_pages": len(texts),
+            "expected_pages": sorted(expected),
+            "candidate_pages": sorted(candidates),
+            "missed_pages": sorted(expected - candidates),
+        })
+        report["expected_pages"] += len(expected)
+        report["found_pages"] += len(found)
+        report["total_pages"] += len(texts)
+        report["candidate_pages"] += len(candidates)
+
+    report["page_recall"] = report["found_pages"] / max(1, report["expected_pages"])
+    report["pages_skipped_fraction"] = 1 - report["candidate_pages"] / max(1, report["total_pages"])
+    return report
+
+
+if __name__ == "__main__":
+    here = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Recall of the table-page prefilter on a ground-truth set")
+    parser.add_argument("--pdf-dir", default=str(here / "pdfs_prueba"))
+    parser.add_argument("--ground-truth", default=str(here / "pdfs_prueba" / "ground_truth" / "ground_truth_kge.json"))
+    args = parser.parse_args()
+
+    report = prefilter_recall(args.pdf_dir, args.ground_truth)
+    for doc in report["documents"]:
+        print(f"{doc['paper_title'][:60]:<60} expected {doc['expected_pages']} "
+              f"candidates {doc['candidate_pages']} of {doc['num_pages']} missed {doc['missed_pages']}")
+    print(f"\nPage recall: {report['page_recall']:.2%}")
+    print(f"Pages skipped: {report['pages_skipped_fraction']:.2%} "
+          f"({report['candidate_pages']} of {report['total_pages']} analyzed)")
@@ -0,0 +1,214 @@
+import json
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+DATASETS_JSON = Path(__file__).resolve().parent.parent / "data" / "datasets.json"
+# Metadatos de Papers with Code: su campo "Datasets" es una lista revisada
+PAPERS_JSON = Path(__file__).resolve().parent.parent / "data" / "papers_data_original.json"
+
+PATRONES = {
+    "Accuracy": re.compile(r"\b(?:acc(?:uracy)?|c\.?a\.?)\b", re.IGNORECASE),
+    "MRR": re.compile(r"\b(?:mrr|mean\s+reciprocal\s+rank)\b", re.IGNORECASE),
+    "F1-Score": re.compile(r"\bf-?1(?:-?(?:score|measure))?\b", re.IGNORECASE),
+
+}
+REGEX_HITS = re.compile(r"\b(?:hits?|h)(?:\s*@\s*|\s+at\s+|\s*)(?P<k>\d{1,3})\b", re.IGNORECASE)
+
+# Todas las métricas en una sola alternancia; Hits@k va primero, igual que en normalizar_texto
+METRIC_REGEX = re.compile(
+    "|".join([f"(?P<hits>{REGEX_HITS.pattern})"]
+             + [f"(?P<m{i}>{patron.pattern})" for i, patron in enumerate(PATRONES.values())]),
+    re.IGNORECASE
+)
+_METRIC_GROUPS = {f"m{i}": nombre for i, nombre in enumerate(PATRONES)}
+_PRIORIDAD = {nombre: i for i, nombre in enumerate(PATRONES)}
+
+# Entre dos caracteres de un nombre de dataset se admite cualquier separador:
+# "FB15k" también encuentra "FB-15k", "fb_15k" o "FB 15K"
+SEPARATOR = r"[\W_]*"
+# Sufijos que acompañan a las menciones en data/datasets.json ("FB15k dataset")
+# Solo se memorizan textos cortos (celdas, cabeceras), no textos completos de papers
+MEMO_MAX_CHARS = 256
+_MENTION_SUFFIX = re.compile(
+    r"\s+(?:benchmarks?\s+)?(?:data\s*sets?|datasets?|data|benchmarks?|database|corpus|project|set)$",
+    re.IGNORECASE
+)
+
+
+def _metric_name(match):
+    # `match` viene de METRIC_REGEX o de una expresión que lo contiene
+    if match.group("hits") is not None:
+        return f"Hits@{match.group('k')}"
+    for group, nombre in _METRIC_GROUPS.items():
+        if match.group(group) is not None:
+            return nombre
+
+
+@lru_cache(maxsize=65536)
+def _normalizar(texto):
+    # Una sola pasada; se respeta la prioridad de antes: Hits@k y luego PATRONES en orden
+    metrica = None
+    for match in METRIC_REGEX.finditer(texto):
+        nombre = _metric_name(match)
+        if nombre.startswith("Hits@"):
+            return nombre
+        if metrica is None or _PRIORIDAD[nombre] < _PRIORIDAD[metrica]:
+            metrica = nombre
+    return metrica
+
+
+def normalizar_texto(texto):
+    """Convierte texto sucio ('H@ 10') en métrica canónica ('Hits@10')."""
+    return _normalizar(str(texto).strip())
+
+
+def dataset_key(name):
+    """Clave normalizada de un nombre de dataset: solo alfanuméricos, en minúsculas."""
+    return "".join(c for c in name.lower() if c.isalnum())
+
+
+def known_datasets_from_json(path=PAPERS_JSON):
+    """Nombres de dataset del campo "Datasets" de `data/papers_data_original.json`."""
+    with open(path, "r", encoding="utf-8") as f:
+        papers = json.load(f)
+    names = []
+    for paper in papers:
+        for entry in paper.get("Datasets") or []:
+            names += [entry] if isinstance(entry, str) else entry
+    return list(dict.fromkeys(names))
+
+
+def canonical_datasets_from_json(path=DATASETS_JSON, min_papers=2, known=None):
+    """
+    Nombres canónicos a partir de las menciones de `data/datasets.json`.
+
+    Las menciones son ruidosas ("WordSim- 353 dataset", "train and development"),
+    así que solo se conservan nombres de una palabra, que no estén en minúsculas
+    y que aparezcan en al menos `min_papers` papers. Se usa la grafía más común.
+    Con `known` solo se conservan además los que coinciden con uno de esos
+    nombres: las respuestas del modelo incluyen nombres de modelos
+    ("MANIFOLDE") que se repiten en varios papers.
+    """
+    known_keys = None if known is None else {dataset_key(name) for name in known}
+    with open(path, "r", encoding="utf-8") as f:
+        papers = json.load(f)
+
+    papers_by_key = defaultdict(set)
+    forms = defaultdict(Counter)
+    for paper, mentions in papers.items():
+        for mention in mentions:
+            name = re.sub(r"(\w)- (\w)", r"\1\2", mention).strip()
+            while True:
+                stripped = _MENTION_SUFFIX.sub("", name).strip()
+                if stripped == name:
+                    break
+                name = stripped
+            name = name.strip(" ()[],.;:")
+            key = dataset_key(name)
+            if len(key) >= 3 and (known_keys is None or key in known_keys):
+                papers_by_key[key].add(paper)
+                forms[key][name] += 1
+
+    names = []
+    for key, key_papers in papers_by_key.items():
+        name = forms[key].most_common(1)[0][0]
+        if len(key_papers) >= min_papers and " " not in name and not name.islower():
+            names.append(name)
+    return names
+
+
+def _trie_pattern(keys):
+    # Alternancia factorizada por prefijos: cada posición del texto se prueba
+    # contra un único árbol en lugar de contra cada nombre por separado
+    trie = {}
+    for key in keys:
+        node = trie
+        for c in key:
+            node = node.setdefault(c, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [re.escape(c) + continuation(child) for c, child in sorted(node.items()) if c]
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    def continuation(node):
+        if set(node) == {""}:
+            return ""
+        rest = SEPARATOR + emit(node)
+        # Opcional y voraz: si el nombre largo no encaja, queda el prefijo completo
+        return f"(?:{rest})?" if "" in node else rest
+
+    return emit(trie)
+
+
+class Vocabulary:
+    """
+    Datasets y métricas conocidos, compilados en una sola expresión regular.
+
+    `find_mentions` recorre un texto (una celda, una tabla o el texto completo
+    de un paper) una vez y devuelve todas las menciones con su nombre canónico.
+    El resultado por texto se memoriza, porque las mismas cabeceras se repiten
+    en muchas tablas.
+    """
+
+    def __init__(self, datasets=(), metrics=None):
+        # El primer nombre de cada clave es el canónico (p. ej. el de DATASET_LIST)
+        self.datasets = {}
+        for name in datasets:
+            key = dataset_key(name)
+            if key:
+                self.datasets.setdefault(key, name)
+        self.metrics = None if metrics is None else set(metrics)
+
+        alternatives = [f"(?P<metric>{METRIC_REGEX.pattern})"]
+        if self.datasets:
+            alternatives.insert(0, rf"(?P<dataset>\b{_trie_pattern(self.datasets)}(?![^\W_]))")
+        self.regex = re.compile("|".join(alternatives), re.IGNORECASE)
+        self._scan = lru_cache(maxsize=65536)(self._scan_text)
+
+    @classmethod
+    def from_sources(cls, dataset_list=(), metrics_list=None, datasets_json=DATASETS_JSON, min_papers=2,
+                     papers_json=PAPERS_JSON):
+        datasets = list(dataset_list)
+        if datasets_json is not None and Path(datasets_json).exists():
+            # Las menciones se filtran con los datasets de Papers with Code y los de `dataset_list`
+            known = None
+            if papers_json is not None and Path(papers_json).exists():
+                known = known_datasets_from_json(papers_json) + datasets
+            datasets += canonical_datasets_from_json(datasets_json, min_papers, known)
+        return cls(datasets, metrics_list)
+
+    def find_mentions(self, text):
+        """(tipo, nombre canónico, inicio, fin) de cada mención, en orden de aparición."""
+        return list(self._mentions(str(text)))
+
+    def find_datasets(self, text):
+        return list(dict.fromkeys(name for kind, name, _, _ in self._mentions(str(text)) if kind == "dataset"))
+
+    def find_metrics(self, text):
+        return list(dict.fromkeys(name for kind, name, _, _ in self._mentions(str(text)) if kind == "metric"))
+
+    def scan_texts(self, texts):
+        """Datasets y métricas mencionados en varios textos, p. ej. las celdas de una tabla."""
+        datasets, metrics = {}, {}
+        for text in texts:
+            for kind, name, _, _ in self._mentions(text):
+                (datasets if kind == "dataset" else metrics)[name] = None
+        return {"datasets": list(datasets), "metrics": list(metrics)}
+
+    def _mentions(self, text):
+        return self._scan(text) if len(text) <= MEMO_MAX_CHARS else self._scan_text(text)
+
+    def _scan_text(self, text):
+        mentions = []
+        for match in self.regex.finditer(text):
+            if match.lastgroup == "dataset":
+                kind, name = "dataset", self.datasets[dataset_key(match.group())]
+            else:
+                kind, name = "metric", _metric_name(match)
+                if self.metrics is not None and name not in self.metrics:
+                    continue
+            mentions.append((kind, name, match.start(), match.end()))
+        return tuple(mentions)
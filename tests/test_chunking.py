@@ -0,0 +1,41 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.chunking import TokenCounter, pack_sections
+
+
+def _random_sections(rng):
+    def word():
+        # Mostly short words, some very long ones (URLs, formulas, table rows)
+        return "".join(rng.choice("abcdefghij") for _ in range(rng.choice([1, 2, 3, 5, 8, 13, 40, 120])))
+
+    def paragraph():
+        # Long runs of words without sentence punctuation
+        return " ".join(word() for _ in range(rng.randint(1, 80))) + "."
+
+    return [
+        {"title": f"Section {i}", "paragraphs": [paragraph() for _ in range(rng.randint(1, 6))]}
+        for i in range(rng.randint(1, 6))
+    ]
+
+
+def test_pack_sections_respects_max_tokens_with_character_counts():
+    rng = random.Random(0)
+    counter = TokenCounter(len)
+    for _ in range(300):
+        max_tokens = rng.randint(40, 200)
+        sections = _random_sections(rng)
+        chunks = pack_sections(sections, counter, max_tokens=max_tokens)
+        assert chunks
+        for chunk in chunks:
+            assert chunk["tokens"] <= max_tokens
+            assert chunk["tokens"] == len(chunk["text"])
+
+
+def test_pack_sections_keeps_small_sections_whole():
+    sections = [{"title": "Intro", "paragraphs": ["One two.", "Three four."]}]
+    chunks = pack_sections(sections, TokenCounter(len), max_tokens=100)
+    assert chunks == [{"text": "## Intro\n\nOne two.\n\nThree four.", "tokens": 31, "sections": ["Intro"]}]
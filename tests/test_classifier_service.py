@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import LabelEncoder
+from sklearn.svm import LinearSVC
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.classifier_service import CALIBRATOR_NAME, ENCODER_NAME, MODEL_NAME, ClassifierService
+
+TOPICS = {
+    "Translational": ["translation", "relation vector", "head plus relation", "distance score"],
+    "Semantic matching": ["bilinear", "tensor factorization", "diagonal matrix", "trilinear product"],
+    "Neural network": ["convolution", "filters", "feature maps", "hidden layer"],
+}
+
+
+def papers(n, seed):
+    rng = np.random.default_rng(seed)
+    texts, labels = [], []
+    for label, words in TOPICS.items():
+        for _ in range(n):
+            picked = rng.choice(words, size=3)
+            texts.append(f"We embed entities with {' and '.join(picked)} on the benchmark.")
+            labels.append(label)
+    return texts, labels
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    texts, labels = papers(8, seed=0)
+    encoder = LabelEncoder().fit(labels)
+    model = make_pipeline(TfidfVectorizer(), LinearSVC()).fit(texts, encoder.transform(labels))
+    joblib.dump(model, tmp_path / MODEL_NAME)
+    joblib.dump(encoder, tmp_path / ENCODER_NAME)
+    return tmp_path
+
+
+@pytest.fixture
+def taxonomy(tmp_path):
+    path = tmp_path / "model_type.json"
+    categories = [*TOPICS, "Rule-based"]
+    path.write_text(json.dumps([{"category": c, "links": []} for c in categories]), encoding="utf-8")
+    return str(path)
+
+
+def test_feature_cache_returns_the_vectorizer_rows(model_dir, tmp_path):
+    texts, _ = papers(2, seed=1)
+    uncached = ClassifierService(model_dir, taxonomy_path=None)
+    service = ClassifierService(model_dir, cache_dir=tmp_path / "cache", taxonomy_path=None)
+
+    first = service.features(texts)
+    assert service.cache.stats() == {"hits": 0, "misses": len(set(texts))}
+    second = service.features(texts + texts[:2])
+    assert service.cache.stats()["hits"] == len(set(texts))
+    assert np.allclose(first.toarray(), uncached.features(texts).toarray())
+    assert np.allclose(second.toarray(), uncached.features(texts + texts[:2]).toarray())
+
+    # A retrained model gets its own cache directory
+    texts, labels = papers(8, seed=2)
+    retrained = make_pipeline(TfidfVectorizer(ngram_range=(1, 2)), LinearSVC())
+    joblib.dump(retrained.fit(texts, service.label_encoder.transform(labels)), model_dir / MODEL_NAME)
+    assert ClassifierService(model_dir, cache_dir=tmp_path / "cache").cache.cache_dir != service.cache.cache_dir
+
+
+def test_min_confidence_leaves_unsure_papers_unlabeled(model_dir, taxonomy):
+    texts, labels = papers(2, seed=3)
+    service = ClassifierService(model_dir, taxonomy_path=taxonomy)
+
+    results = service.classify(texts)
+    assert [r["label"] for r in results] == labels
+    assert all(not r["calibrated"] for r in results)
+    assert all(list(r["probabilities"]) == [*TOPICS, "Rule-based"] for r in results)
+    assert all(r["probabilities"]["Rule-based"] == 0.0 for r in results)
+
+    cut_off = sorted(r["probability"] for r in results)[len(results) // 2]
+    for result in service.classify(texts, min_confidence=cut_off):
+        assert (result["label"] is None) == (result["probability"] < cut_off)
+    service.min_confidence = 1.01
+    assert all(r["label"] is None for r in service.classify(texts))
+
+
+@pytest.mark.parametrize("cv", [None, 2])
+def test_calibrate_saves_a_calibrator_used_by_new_instances(model_dir, taxonomy, cv):
+    held_out, labels = papers(6, seed=4)
+    service = ClassifierService(model_dir, taxonomy_path=taxonomy)
+    service.calibrate(held_out, labels, cv=cv)
+    assert (model_dir / CALIBRATOR_NAME).exists()
+
+    texts, labels = papers(2, seed=5)
+    results = ClassifierService(model_dir, taxonomy_path=taxonomy).classify(texts)
+    assert all(r["calibrated"] for r in results)
+    assert [r["label"] for r in results] == labels
+    for result in results:
+        assert sum(result["probabilities"].values()) == pytest.approx(1.0)
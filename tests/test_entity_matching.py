@@ -0,0 +1,43 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+from rapidfuzz import fuzz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.entity_matching import cluster_fuzzy, deduplicate_fuzzy
+
+DATASETS_JSON = os.path.join(os.path.dirname(__file__), "..", "data", "datasets.json")
+
+
+def _notebook_deduplicate_fuzzy(names, threshold=80):
+    unique = []
+    for name in names:
+        if all(fuzz.ratio(name, existing) < threshold for existing in unique):
+            unique.append(name)
+    return unique
+
+
+def test_deduplicate_matches_notebook_on_datasets_json():
+    with open(DATASETS_JSON, "r", encoding="utf-8") as f:
+        names = [m for mentions in json.load(f).values() for m in mentions]
+    expected = _notebook_deduplicate_fuzzy(names)
+    assert len(expected) == 218
+    assert deduplicate_fuzzy(names) == expected
+    # Token blocking never compares these near-duplicates of kept names
+    assert len(deduplicate_fuzzy(names, blocking="tokens")) == 220
+
+
+@pytest.mark.parametrize("threshold", [50, 80, 95])
+def test_length_blocking_is_lossless(threshold):
+    rng = random.Random(threshold)
+    names = ["".join(rng.choice("ab ") for _ in range(rng.randint(0, 12))) for _ in range(300)]
+    assert deduplicate_fuzzy(names, threshold) == _notebook_deduplicate_fuzzy(names, threshold)
+
+
+def test_cluster_fuzzy_groups():
+    names = ["FB15k-237", "FB15K-237", "WN18RR", "FB15k-237", "WN18", "YAGO3-10"]
+    assert cluster_fuzzy(names) == [["FB15k-237", "FB15K-237", "FB15k-237"], ["WN18RR", "WN18"], ["YAGO3-10"]]
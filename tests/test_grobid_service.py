@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import utils.grobid_service
+from utils.grobid_service import GrobidService
+
+
+class _CurrentClient:
+    def __init__(self, config_path=None):
+        self.flags = None
+
+    def process_pdf(self, service, pdf_file, generate_ids=False, consolidate_header=True, consolidate_citations=False,
+                    include_raw_citations=False, include_raw_affiliations=False, tei_coordinates=False,
+                    segment_sentences=False):
+        self.flags = {"generate_ids": generate_ids, "consolidate_header": consolidate_header}
+        return pdf_file, 200, "<TEI/>"
+
+
+class _OldClient(_CurrentClient):
+    def process_pdf(self, service, pdf_file, generateIDs, consolidate_header, consolidate_citations,
+                    include_raw_citations, include_raw_affiliations, tei_coordinates, segment_sentences):
+        self.flags = {"generateIDs": generateIDs, "consolidate_header": consolidate_header}
+        return pdf_file, 200, "<TEI/>"
+
+
+@pytest.mark.parametrize("client, ids_flag", [(_CurrentClient, "generate_ids"), (_OldClient, "generateIDs")])
+def test_flags_follow_the_client_release(tmp_path, monkeypatch, client, ids_flag):
+    monkeypatch.setattr(utils.grobid_service, "GrobidClient", client)
+    pdf = tmp_path / "paper.pdf"
+    pdf.write_bytes(b"%PDF-1.4\n%%EOF\n")
+    service = GrobidService(config_path="unused.json")
+    assert service.process_full_text(str(pdf)) == "<TEI/>"
+    assert service.client.flags == {ids_flag: False, "consolidate_header": True}
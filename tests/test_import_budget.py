@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from import_budget import DEFAULT_BUDGET, LIGHT_MODULES, measure
+
+
+@pytest.mark.parametrize("module", LIGHT_MODULES)
+def test_import_budget(module):
+    result = measure(module)
+    assert "error" not in result, result.get("error")
+    assert not result["heavy"], f"{module} imports {', '.join(result['heavy'])}"
+    assert result["seconds"] <= DEFAULT_BUDGET
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import instrumentation as inst
+
+TOTALS = {
+    "counters": [
+        {"name": "bytes_downloaded", "labels": {}, "value": 1234567891},
+        {"name": "tokens", "labels": {"stage": "llm"}, "value": 1234567.25},
+    ],
+    "spans": {
+        "grobid": {"count": 3, "wall_seconds": 4321.123456, "cpu_seconds": 0.1, "bytes": 7654321},
+    },
+}
+
+
+def test_prometheus_values_keep_every_digit():
+    text = inst.prometheus_text(TOTALS)
+    prefix = inst.METRIC_PREFIX
+    assert f"{prefix}bytes_downloaded 1234567891\n" in text
+    assert f'{prefix}tokens{{stage="llm"}} 1234567.25\n' in text
+    assert f'{prefix}span_wall_seconds_total{{span="grobid"}} 4321.123456\n' in text
+    assert f'{prefix}span_bytes_total{{span="grobid"}} 7654321\n' in text
+    assert f'{prefix}span_count_total{{span="grobid"}} 3\n' in text
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from utils.llm_engine import QAEngine, _generated_token_count
+
+PAD, EOS = 0, 1
+
+
+class CharTokenizer:
+    """One token per ASCII character, enough for the engine's prompts."""
+
+    pad_token_id = None
+    eos_token_id = EOS
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False, **kwargs):
+        text = "".join(f"<{m['role']}>{m['content']}\n" for m in messages)
+        return text + "<assistant>" if add_generation_prompt else text
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": [min(ord(c), 127) + 2 for c in text]}
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return ["".join(chr(int(i) - 2) for i in seq if int(i) > EOS) for seq in sequences]
+
+
+def tiny_model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=130, hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+        num_key_value_heads=2, max_position_embeddings=512, eos_token_id=EOS, pad_token_id=PAD,
+    )
+    # float64 so that padding in different places can't flip a greedy choice
+    return transformers.LlamaForCausalLM(config).to(torch.float64)
+
+
+PAPERS = [
+    ("paper_a", ["A short chunk about FB15k-237.", "A second, somewhat longer chunk about WN18RR and YAGO3-10."]),
+    ("paper_b", ["Only one chunk here."]),
+]
+
+
+def answers(reuse_prefix):
+    engine = QAEngine(tiny_model(), CharTokenizer(), max_new_tokens=8, max_batch_size=4, reuse_prefix=reuse_prefix)
+    results = {r["paper_id"]: r["raw"] for r in engine.run(PAPERS)}
+    return results, engine.stats
+
+
+def test_prefix_reuse_matches_full_prompts():
+    reused, reused_stats = answers(reuse_prefix=True)
+    full, full_stats = answers(reuse_prefix=False)
+    assert reused_stats["reused_tokens"] > 0
+    assert full_stats["reused_tokens"] == 0
+    assert reused == full
+    assert reused_stats["generated_tokens"] == full_stats["generated_tokens"]
+
+
+def test_generated_tokens_count_eos_even_when_it_is_the_pad():
+    generated = torch.tensor([
+        [5, EOS, EOS, EOS],  # answer, EOS, then padding
+        [5, 6, 7, 8],        # hit max_new_tokens
+        [EOS, EOS, EOS, EOS],
+    ])
+    assert _generated_token_count(generated, [EOS]) == 2 + 4 + 1
+    assert _generated_token_count(generated, []) == 12
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+from pypdf import PdfWriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import pdf_dedup
+from utils.pdf_dedup import PdfDeduplicator
+
+
+def blank_pdf(path, title):
+    # Distinct titles give distinct bytes; the text comes from `texts`
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    writer.add_metadata({"/Title": title})
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def random_text(rng, n_words=300):
+    vocabulary = [f"word{i}" for i in range(2000)]
+    return " ".join(rng.choice(vocabulary, size=n_words))
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    rng = np.random.default_rng(0)
+    paper = random_text(rng).split()
+    revised = list(paper)
+    for i in rng.choice(len(paper), size=5, replace=False):
+        revised[i] = "changed"
+    paths = {
+        "preprint": blank_pdf(tmp_path / "2101.00001v1.pdf", "preprint"),
+        "published": blank_pdf(tmp_path / "published.pdf", "published"),
+        "other": blank_pdf(tmp_path / "other.pdf", "other"),
+        "short": blank_pdf(tmp_path / "short.pdf", "short"),
+    }
+    paths["copy"] = str(tmp_path / "published_copy.pdf")
+    shutil.copy(paths["published"], paths["copy"])
+    texts = {
+        paths["preprint"]: " ".join(paper),
+        paths["published"]: " ".join(revised),
+        paths["other"]: random_text(rng),
+        # Too short to be compared, however similar
+        paths["short"]: " ".join(paper[:20]),
+    }
+    return paths, texts
+
+
+def test_near_and_exact_duplicates_are_grouped(corpus):
+    paths, texts = corpus
+    groups = PdfDeduplicator(workers=1).find_duplicates(list(paths.values()), texts)
+
+    assert len(groups) == 1
+    group = groups[0]
+    # The proceedings version is kept over the arXiv-named preprint
+    assert group["canonical"] == paths["published"]
+    assert sorted(group["duplicates"]) == sorted([paths["preprint"], paths["copy"]])
+    assert group["similarity"][paths["copy"]] == 1.0
+    assert 0.5 <= group["similarity"][paths["preprint"]] < 1.0
+
+    canonical = PdfDeduplicator(workers=1).canonical_paths(list(paths.values()), texts)
+    assert canonical == [paths["published"], paths["other"], paths["short"]]
+
+
+def test_threshold_splits_the_near_duplicates(corpus):
+    paths, texts = corpus
+    groups = PdfDeduplicator(threshold=0.99, workers=1).find_duplicates(list(paths.values()), texts)
+    assert [g["duplicates"] for g in groups] == [[paths["copy"]]]
+
+
+def test_fingerprint_cache_is_dropped_when_settings_change(corpus, tmp_path, monkeypatch):
+    paths, _ = corpus
+    cache_dir = tmp_path / "cache"
+    read = []
+    fingerprint = pdf_dedup._fingerprint
+
+    def counting_fingerprint(path_pdf, *args):
+        read.append(path_pdf)
+        return fingerprint(path_pdf, *args)
+
+    monkeypatch.setattr(pdf_dedup, "_fingerprint", counting_fingerprint)
+
+    PdfDeduplicator(cache_dir=cache_dir, workers=1).fingerprints(paths.values())
+    # The byte-identical copy is read once
+    assert len(read) == len(paths) - 1
+
+    read.clear()
+    PdfDeduplicator(cache_dir=cache_dir, workers=1).fingerprints(paths.values())
+    assert read == []
+
+    for settings in ({"first_pages": 1}, {"shingle_words": 3}, {"num_perm": 64}, {"seed": 2}):
+        read.clear()
+        PdfDeduplicator(cache_dir=cache_dir, workers=1, **settings).fingerprints(paths.values())
+        assert len(read) == len(paths) - 1, settings
+        with open(cache_dir / "fingerprints.json", "r", encoding="utf-8") as f:
+            assert all(json.load(f)["settings"][k] == v for k, v in settings.items())
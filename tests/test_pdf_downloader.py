@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.pdf_downloader import PDFDownloader, filename_from_url
+
+
+class _PdfHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = f"%PDF-1.4 {self.path}\n%%EOF\n".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pdf_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PdfHandler)
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_filename_from_url_keeps_distinct_papers_apart():
+    assert filename_from_url("https://arxiv.org/pdf/1412.6575") == "1412.6575.pdf"
+    assert filename_from_url("https://aclanthology.org/D15-1031.pdf") == "D15-1031.pdf"
+    hal = [filename_from_url("https://inria.hal.science/hal-02281789/document"),
+           filename_from_url("https://imt.hal.science/hal-01699866/document")]
+    ojs = [filename_from_url("https://ojs.aaai.org/index.php/AAAI/article/view/8870/8729"),
+           filename_from_url("https://ojs.aaai.org/index.php/AAAI/article/download/8870/8729")]
+    assert hal[0] != hal[1] and ojs[0] != ojs[1]
+    assert filename_from_url("HTTPS://INRIA.hal.science/hal-02281789/document#page=2") == hal[0]
+
+
+def test_download_many_distinct_papers_get_their_own_file(tmp_path, pdf_server):
+    _, base = pdf_server
+    urls = [f"{base}/hal-02281789/document", f"{base}/hal-01699866/document"]
+    records = PDFDownloader(str(tmp_path)).download_many([(url, None) for url in urls])
+    assert [records[url]["status"] for url in urls] == ["complete", "complete"]
+    contents = [open(records[url]["path"], "rb").read() for url in urls]
+    assert b"hal-02281789" in contents[0] and b"hal-01699866" in contents[1]
+
+
+def test_download_many_rejects_duplicate_targets(tmp_path, pdf_server):
+    server, base = pdf_server
+    items = [(f"{base}/a.pdf", "same.pdf"), (f"{base}/b.pdf", "same.pdf"), (f"{base}/a.pdf#x", "same.pdf")]
+    records = PDFDownloader(str(tmp_path)).download_many(items)
+    assert records[f"{base}/a.pdf"]["status"] == "complete"
+    assert records[f"{base}/a.pdf#x"] is records[f"{base}/a.pdf"]
+    assert records[f"{base}/b.pdf"]["status"] == "failed"
+    assert server.paths == ["/a.pdf"]
+
+
+def test_download_does_not_skip_another_urls_file(tmp_path, pdf_server):
+    _, base = pdf_server
+    downloader = PDFDownloader(str(tmp_path))
+    assert downloader.download(f"{base}/a.pdf", "paper.pdf")["status"] == "complete"
+    assert downloader.download(f"{base}/a.pdf", "paper.pdf")["status"] == "skipped"
+    record = downloader.download(f"{base}/b.pdf", "paper.pdf")
+    assert record["status"] == "complete"
+    assert b"/b.pdf" in open(record["path"], "rb").read()
+    assert PDFDownloader(str(tmp_path)).manifest["paper.pdf"]["url"] == f"{base}/b.pdf"
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import utils.grobid_service
+from utils.pipeline import Pipeline, Stage, best_configuration_stages
+
+
+def test_failed_stage_is_retried_on_resume(tmp_path):
+    calls = []
+
+    def flaky(x):
+        calls.append(x)
+        if len(calls) == 1:
+            raise RuntimeError("busy")
+        return x * 2
+
+    stages = [Stage("double", flaky, ("x",))]
+    first = list(Pipeline(stages, str(tmp_path)).run([("p", {"x": 2})]))
+    assert "double" in first[0]["errors"]
+    second = list(Pipeline(stages, str(tmp_path)).run([("p", {"x": 2})]))
+    assert second[0]["outputs"]["double"] == 4 and second[0]["computed_stages"] == ["double"]
+    third = list(Pipeline(stages, str(tmp_path)).run([("p", {"x": 2})]))
+    assert third[0]["cached_stages"] == ["double"]
+
+
+def test_stage_config_is_part_of_the_version(tmp_path):
+    def scale(x):
+        return x
+
+    assert Stage("s", scale, ("x",), config={"factor": 1}).version != Stage("s", scale, ("x",), config={"factor": 2}).version
+    assert Stage("s", scale, ("x",), config={"factor": 1}).version == Stage("s", scale, ("x",), config={"factor": 1}).version
+
+
+class _BusyGrobid:
+    PROCESS_FLAGS = {}
+
+    def __init__(self, **kwargs):
+        pass
+
+    def process_many(self, pdf_paths, service, workers=1, **kwargs):
+        for pdf_path in pdf_paths:
+            yield {"pdf_path": pdf_path, "service": service, "status": 503, "tei": None,
+                   "error": "Service Unavailable"}
+
+
+def test_grobid_stages_fail_on_error_status(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.grobid_service, "GrobidService", _BusyGrobid)
+    stages = {s.name: s for s in best_configuration_stages(
+        grobid_config=str(tmp_path / "config.json"), download_dir=str(tmp_path / "pdfs"))}
+    for name in ("header_tei", "fulltext_tei"):
+        with pytest.raises(RuntimeError, match="status 503"):
+            stages[name].func({"path": "paper.pdf"})
+
+
+def test_grobid_config_changes_the_stage_version(tmp_path):
+    config = tmp_path / "config.json"
+    config.write_text('{"grobid_server": "http://localhost:8070"}')
+    before = {s.name: s.version for s in best_configuration_stages(str(config), download_dir=str(tmp_path / "pdfs"))}
+    config.write_text('{"grobid_server": "http://localhost:8071"}')
+    after = {s.name: s.version for s in best_configuration_stages(str(config), download_dir=str(tmp_path / "pdfs"))}
+    assert before["header_tei"] != after["header_tei"]
+    assert before["authors"] == after["authors"]
@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.pwc_service import PapersWithCodeClient
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b'{"a": 1}\n{"b": ', b'{"a": 1}\n'),
+    (b'{"a": 1}\n', b'{"a": 1}\n'),
+    (b'{"partial', b''),
+    # Last newline more than one read block before the end of the file
+    (b'x' * 200_000 + b'\n' + b'y' * 150_000, b'x' * 200_000 + b'\n'),
+])
+def test_repair_jsonl_drops_partial_last_line(tmp_path, data, expected):
+    path = tmp_path / "papers.jsonl"
+    path.write_bytes(data)
+    PapersWithCodeClient._repair_jsonl(str(path))
+    assert path.read_bytes() == expected
+
+
+class _PwcStub(ThreadingHTTPServer):
+    """Listing pages of PAGE_SIZE papers, per-paper datasets/tasks, and one 429 on the first listing call."""
+
+    PAPERS = [f"paper-{i}" for i in range(5)]
+    PAGE_SIZE = 3
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _PwcHandler)
+        self.requests = []
+        self.throttled = False
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/v1"
+
+
+class _PwcHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path))
+            throttle = not server.throttled
+            server.throttled = True
+        if throttle:
+            self.send_response(429)
+            self.send_header("Retry-After", "0.3")
+            self.end_headers()
+            return
+
+        parts = url.path.strip("/").split("/")
+        if parts[2:] == ["tasks", "kge", "papers"]:
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            start = (page - 1) * server.PAGE_SIZE
+            ids = server.PAPERS[start:start + server.PAGE_SIZE]
+            more = start + server.PAGE_SIZE < len(server.PAPERS)
+            body = {
+                "next": f"{server.base_url}/tasks/kge/papers/?page={page + 1}" if more else None,
+                "results": [{"id": i, "title": i.title(), "authors": ["A"], "url_pdf": None} for i in ids],
+            }
+        elif parts[2] == "papers":
+            # Later papers answer first, so the order must come from the listing
+            time.sleep(0.05 * (len(server.PAPERS) - int(parts[3].split("-")[1])))
+            body = {"results": [{"name": f"{parts[3]}-{parts[4]}", "id": parts[4]}]}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pwc_stub():
+    server = _PwcStub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(tmp_path, stub):
+    return PapersWithCodeClient("kge", data_dir=str(tmp_path), base_url=stub.base_url,
+                                requests_per_second=1000, workers=4)
+
+
+def test_fetch_papers_metadata_against_stub(tmp_path, pwc_stub):
+    papers = _client(tmp_path, pwc_stub).fetch_papers_metadata(limit=None)
+    assert [p["Title"] for p in papers] == [i.title() for i in _PwcStub.PAPERS]
+    assert papers[0]["Datasets"] == ["paper-0-datasets"]
+    assert papers[0]["Tasks id"] == ["tasks"]
+
+    # The 429 is retried after its Retry-After
+    (throttled_at, first_path), (retried_at, retried_path) = pwc_stub.requests[:2]
+    assert first_path == retried_path == "/api/v1/tasks/kge/papers/"
+    assert retried_at - throttled_at >= 0.25
+
+
+def test_fetch_papers_metadata_limit(tmp_path, pwc_stub):
+    papers = _client(tmp_path, pwc_stub).fetch_papers_metadata(limit=2)
+    assert [p["Title"] for p in papers] == ["Paper-0", "Paper-1"]
+    # Only the first listing page and the details of the first two papers
+    paths = [path for _, path in pwc_stub.requests]
+    assert not any("page=2" in path or "paper-2" in path for path in paths)
+
+
+def test_sync_papers_metadata_resumes(tmp_path, pwc_stub):
+    client = _client(tmp_path, pwc_stub)
+    assert client.sync_papers_metadata("papers.jsonl", limit=4) == 4
+    assert client.sync_papers_metadata("papers.jsonl") == 1
+    assert [r["Id"] for r in client.iter_jsonl("papers.jsonl")] == _PwcStub.PAPERS
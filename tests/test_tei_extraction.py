@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.tei_extraction import EmbeddingCache, rank_sections_corpus
+
+
+class BagOfCharsModel:
+    """Deterministic stand-in for a SentenceTransformer: letter counts."""
+
+    def encode(self, sentences, batch_size=64, convert_to_numpy=True, **kwargs):
+        embs = np.zeros((len(sentences), 26), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for c in sentence.lower():
+                if "a" <= c <= "z":
+                    embs[i, ord(c) - ord("a")] += 1
+        return embs
+
+
+PAPERS = [["Experiments", "Related Work", None], ["Results", "Experiments"], []]
+QUERIES = ["experimental results", "evaluation"]
+
+
+def test_rank_sections_corpus_without_cache():
+    ranked = rank_sections_corpus(PAPERS, QUERIES, BagOfCharsModel())
+    assert [len(r) for r in ranked] == [3, 2, 0]
+    assert {t for t, _ in ranked[0]} == {"Experiments", "Related Work", ""}
+    scores = [s for _, s in ranked[0]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_rank_sections_corpus_cache_matches_uncached():
+    model = BagOfCharsModel()
+    uncached = rank_sections_corpus(PAPERS, QUERIES, model, top_k=1)
+    cached = rank_sections_corpus(PAPERS, QUERIES, model, top_k=1, cache=EmbeddingCache("bag-of-chars"))
+    assert [[t for t, _ in r] for r in cached] == [[t for t, _ in r] for r in uncached]
+    for r_cached, r_uncached in zip(cached, uncached):
+        assert np.allclose([s for _, s in r_cached], [s for _, s in r_uncached])
+
+
+def test_rank_sections_corpus_empty_queries():
+    assert rank_sections_corpus(PAPERS, [], BagOfCharsModel()) == [[], [], []]
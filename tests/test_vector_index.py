@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.vector_index import ParagraphIndex
+
+
+def _unit(rng, n, dim=64):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_search_empty_index(tmp_path):
+    index = ParagraphIndex(str(tmp_path / "index"))
+    rng = np.random.default_rng(0)
+    assert index.search(_unit(rng, 2)) == [[], []]
+    assert index.search(_unit(rng, 1)[0]) == [[]]
+    assert index.search(["no model needed"]) == [[]]
+
+
+def test_search_finds_added_paragraph(tmp_path):
+    index = ParagraphIndex(str(tmp_path / "index"))
+    rng = np.random.default_rng(0)
+    vectors = _unit(rng, 3)
+    index.add("paper", [(0, 0), (0, 1), (1, 0)], vectors)
+    results = index.search(vectors[2:], k=1)
+    assert [(r["paper"], r["section"], r["paragraph"]) for r in results[0]] == [("paper", 1, 0)]
@@ -0,0 +1,30 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "table_extraction"))
+
+import vocabulary as voc
+
+MENTIONS = {
+    "paper_a": ["FB15k-237 dataset", "MANIFOLDE", "WN18RR"],
+    "paper_b": ["FB15K-237", "MANIFOLDE", "OpenKE code"],
+    "paper_c": ["WN18RR dataset"],
+}
+
+
+def test_canonical_datasets_filtered_by_known_names(tmp_path):
+    path = tmp_path / "datasets.json"
+    path.write_text(json.dumps(MENTIONS), encoding="utf-8")
+    assert sorted(voc.canonical_datasets_from_json(path)) == ["FB15k-237", "MANIFOLDE", "WN18RR"]
+    known = ["FB15k-237", "WN18RR", "YAGO3-10"]
+    assert sorted(voc.canonical_datasets_from_json(path, known=known)) == ["FB15k-237", "WN18RR"]
+
+
+def test_vocabulary_from_sources_skips_model_names(tmp_path):
+    datasets_path = tmp_path / "datasets.json"
+    datasets_path.write_text(json.dumps(MENTIONS), encoding="utf-8")
+    papers_path = tmp_path / "papers.json"
+    papers_path.write_text(json.dumps([{"Datasets": [["FB15k-237"]]}]), encoding="utf-8")
+    vocabulary = voc.Vocabulary.from_sources(["WN18RR"], datasets_json=datasets_path, papers_json=papers_path)
+    assert vocabulary.find_datasets("ManifoldE on FB15k-237 and WN18RR") == ["FB15k-237", "WN18RR"]
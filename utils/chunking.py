@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import re
+
+from . import instrumentation as inst
+from .tei_extraction import TEIDocument, rank_sections_by_semantic_similarity
+
+# Section-aware chunking of GROBID fulltext for LLM extraction. Replaces the
+# notebooks' `chunk_text(tei_to_full_raw_text(tei), tokenizer)`:
+#
+#     counter = TokenCounter(tokenizer, cache_dir=".token_counts")
+#     chunks = chunk_paper(tei, counter, max_tokens=max_context_tokens, model=sim_model)
+#     for chunk in chunks:
+#         chat = [..., {"role": "user", "content": f"Context chunk: {chunk['text']}"}, ...]
+#
+# Whole sections (or, when a section does not fit, whole paragraphs) are packed
+# into chunks of at most `max_tokens`, the sections most similar to the queries
+# first, and low-value sections (related work, acknowledgements...) are left out.
+
+DEFAULT_QUERIES = ["Experiments", "Evaluation", "Datasets", "Results"]
+# Sections skipped by default: they describe other papers or nothing at all
+LOW_VALUE_SECTIONS = re.compile(
+    r"related work|previous work|prior work|literature review|acknowledg|references|bibliography|"
+    r"author contributions?|funding|competing interests?|conflicts? of interest|ethic|broader impact",
+    re.IGNORECASE
+)
+SENTENCE_REGEX = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+SEPARATOR = "\n\n"
+
+
+class TokenCounter:
+    """
+    Token counts of text pieces for one tokenizer, cached by text hash.
+
+    Paragraphs repeat across runs (same paper, another question, another
+    budget), so every distinct text is tokenized only once; with `cache_dir`
+    the counts persist on disk. `tokenizer` is a Hugging Face tokenizer or any
+    callable returning the number of tokens of a string.
+    """
+
+    def __init__(self, tokenizer, cache_dir: str | None = None):
+        self.tokenizer = tokenizer
+        self.name = getattr(tokenizer, "name_or_path", None) or getattr(tokenizer, "__name__", type(tokenizer).__name__)
+        self.path = None
+        self._counts = {}
+        self._dirty = False
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            safe_name = re.sub(r"[^\w.-]+", "_", self.name)
+            self.path = os.path.join(cache_dir, f"{safe_name}.json")
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._counts = json.load(f)
+
+    def __len__(self):
+        return len(self._counts)
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def count(self, texts) -> list[int]:
+        """Token counts (without special tokens) of each text, tokenizing only unseen ones."""
+        keys = [self._key(t) for t in texts]
+        missing = {k: t for k, t in zip(keys, texts) if k not in self._counts}
+        inst.count("token_count_cache_hits_total", len(set(keys)) - len(missing))
+        if missing:
+            self._counts.update(zip(missing, self._tokenize(list(missing.values()))))
+            self._dirty = True
+        return [self._counts[k] for k in keys]
+
+    def _tokenize(self, texts) -> list[int]:
+        if not hasattr(self.tokenizer, "encode"):
+            return [int(self.tokenizer(t)) for t in texts]
+        with inst.span("chunking.tokenize", bytes=sum(len(t) for t in texts)):
+            try:
+                # Fast tokenizers encode a whole batch in one call
+                ids = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+            except TypeError:
+                ids = [self.tokenizer.encode(t, add_special_tokens=False) for t in texts]
+        return [len(i) for i in ids]
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._counts, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def paper_sections(tei, include_abstract: bool = True) -> list[dict]:
+    """
+    [{"title", "paragraphs"}] from `TEIDocument.flat_sections` (subsections
+    merged into their parent), with the abstract first.
+    """
+    doc = tei if isinstance(tei, TEIDocument) else TEIDocument(tei)
+    sections = []
+    if include_abstract and doc.abstract:
+        sections.append({"title": "Abstract", "paragraphs": [doc.abstract]})
+    for section in doc.flat_sections:
+        paragraphs = [p.strip() for p in section["text"].split(SEPARATOR) if p.strip()]
+        if paragraphs:
+            sections.append({"title": section["title"], "paragraphs": paragraphs})
+    return sections
+
+
+def order_sections(sections, queries=DEFAULT_QUERIES, model=None, skip=LOW_VALUE_SECTIONS, min_score=None):
+    """
+    Drops the sections whose title matches `skip` and, when a sentence model
+    is given, sorts the rest by their title's similarity to `queries`
+    (highest first, the abstract always first), dropping those below
+    `min_score`. Adds a "score" to each section (None without a model).
+    """
+    kept = [dict(s, score=None) for s in sections if not (skip and skip.search(s["title"] or ""))]
+    if model is None or not kept:
+        return kept
+
+    titles = [s["title"] or "" for s in kept]
+    scores = dict(rank_sections_by_semantic_similarity(titles, list(queries), model))
+    for section in kept:
+        section["score"] = scores.get(section["title"] or "")
+    if min_score is not None:
+        kept = [s for s in kept if s["title"] == "Abstract" or s["score"] is None or s["score"] >= min_score]
+    return sorted(kept, key=lambda s: (s["title"] != "Abstract", -(s["score"] or 0.0)))
+
+
+def _halve_to_fit(text: str, n: int, max_tokens: int, counter: TokenCounter) -> list[tuple[str, int]]:
+    # Halves `text` by words (a single word by characters) and re-counts each
+    # half until every part fits: token counts are not proportional to words
+    if n <= max_tokens:
+        return [(text, n)]
+    words = text.split()
+    if len(words) > 1:
+        halves = [" ".join(words[:len(words) // 2]), " ".join(words[len(words) // 2:])]
+    elif len(text) > 1:
+        halves = [text[:len(text) // 2], text[len(text) // 2:]]
+    else:
+        return [(text, n)]
+    return [part for half, m in zip(halves, counter.count(halves)) for part in _halve_to_fit(half, m, max_tokens, counter)]
+
+
+def _split_oversized(text: str, max_tokens: int, counter: TokenCounter) -> list[tuple[str, int]]:
+    # A paragraph longer than a whole chunk: cut at sentence boundaries, and a
+    # single overlong sentence into halves until they fit
+    sentences = SENTENCE_REGEX.split(text)
+    pieces = []
+    for sentence, n in zip(sentences, counter.count(sentences)):
+        pieces += _halve_to_fit(sentence, n, max_tokens, counter)
+
+    merged = []
+    text_parts, n_tokens = [], 0
+    space = counter.count([" "])[0]
+    for piece, n in pieces:
+        if text_parts and n_tokens + space + n > max_tokens:
+            merged.append((" ".join(text_parts), n_tokens))
+            text_parts, n_tokens = [], 0
+        n_tokens += (space if text_parts else 0) + n
+        text_parts.append(piece)
+    if text_parts:
+        merged.append((" ".join(text_parts), n_tokens))
+    return merged
+
+
+def pack_sections(sections, counter: TokenCounter, max_tokens: int = 8000, max_chunks: int | None = None) -> list[dict]:
+    """
+    Packs sections in the given order into chunks of at most `max_tokens`
+    tokens (as summed from the cached piece counts; leave a small margin for
+    merges across piece boundaries). A section that does not fit in what is
+    left of a chunk starts the next one if that keeps it whole and the
+    current chunk is at least half full; otherwise it is split between
+    paragraphs, with its heading repeated. Stops after `max_chunks` chunks.
+    Returns [{"text", "tokens", "sections"}].
+    """
+    headings = [f"## {s['title']}" if s["title"] else "##" for s in sections]
+    all_paragraphs = [p for s in sections for p in s["paragraphs"]]
+    separator_tokens = counter.count([SEPARATOR])[0]
+    heading_tokens = counter.count(headings)
+    paragraph_tokens = iter(counter.count(all_paragraphs))
+
+    chunks = []
+    parts, n_tokens, titles = [], 0, []
+
+    def close_chunk():
+        nonlocal parts, n_tokens, titles
+        if parts:
+            chunks.append({"text": SEPARATOR.join(parts), "tokens": n_tokens, "sections": titles})
+        parts, n_tokens, titles = [], 0, []
+
+    def add(text, tokens):
+        nonlocal n_tokens
+        n_tokens += (separator_tokens if parts else 0) + tokens
+        parts.append(text)
+
+    for section, heading, heading_n in zip(sections, headings, heading_tokens):
+        pieces = []
+        for paragraph in section["paragraphs"]:
+            n = next(paragraph_tokens)
+            if heading_n + separator_tokens + n > max_tokens:
+                pieces += _split_oversized(paragraph, max_tokens - heading_n - separator_tokens, counter)
+            else:
+                pieces.append((paragraph, n))
+
+        section_tokens = heading_n + sum(n + separator_tokens for _, n in pieces)
+        if parts and n_tokens + separator_tokens + section_tokens > max_tokens \
+                and section_tokens <= max_tokens and 2 * n_tokens >= max_tokens:
+            close_chunk()
+            if max_chunks is not None and len(chunks) >= max_chunks:
+                return chunks
+
+        open_heading = False
+        for text, n in pieces:
+            needed = n + separator_tokens + (0 if open_heading else heading_n + separator_tokens * bool(parts))
+            if parts and n_tokens + needed > max_tokens:
+                close_chunk()
+                if max_chunks is not None and len(chunks) >= max_chunks:
+                    return chunks
+                open_heading = False
+            if not open_heading:
+                add(heading, heading_n)
+                titles.append(section["title"])
+                open_heading = True
+            add(text, n)
+    close_chunk()
+    return chunks[:max_chunks] if max_chunks is not None else chunks
+
+
+def chunk_paper(
+    tei,
+    counter: TokenCounter,
+    max_tokens: int = 8000,
+    queries=DEFAULT_QUERIES,
+    model=None,
+    skip=LOW_VALUE_SECTIONS,
+    min_score: float | None = None,
+    max_chunks: int | None = None,
+    include_abstract: bool = True
+) -> list[dict]:
+    """
+    Chunks a paper's TEI (or TEIDocument) for LLM prompts: sections minus the
+    low-value ones, most relevant first when a sentence `model` is given,
+    packed into chunks of at most `max_tokens`. Each chunk is
+    {"text", "tokens", "sections"}.
+    """
+    with inst.span("chunking.chunk_paper") as span:
+        sections = order_sections(paper_sections(tei, include_abstract), queries, model, skip, min_score)
+        chunks = pack_sections(sections, counter, max_tokens, max_chunks)
+        span.set(sections=len(sections), chunks=len(chunks), tokens=sum(c["tokens"] for c in chunks))
+    counter.save()
+    return chunks
@@ -0,0 +1,273 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+from . import instrumentation as inst
+from .hashing import file_sha256
+from .pdf_downloader import filename_from_url, legacy_filename_from_url, normalize_url
+
+MODEL_NAME = "clasificador_textos_v1.pkl"
+ENCODER_NAME = "label_encoder.pkl"
+CALIBRATOR_NAME = "calibrator.pkl"
+DEFAULT_TAXONOMY = "data/model_type.json"
+
+
+def load_taxonomy(path: str = DEFAULT_TAXONOMY) -> list[str]:
+    """Model-type categories, in the order of `data/model_type.json`."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [entry["category"] for entry in json.load(f)]
+
+
+def labeled_pdfs(taxonomy_path: str = DEFAULT_TAXONOMY, pdf_dir: str = "data/pdf_files") -> list[tuple[str, str]]:
+    """(local PDF path, category) for every taxonomy link downloaded into `pdf_dir`."""
+    with open(taxonomy_path, "r", encoding="utf-8") as f:
+        taxonomy = json.load(f)
+    # Files downloaded under the old names still count when no other link shares the name
+    urls = {normalize_url(url) for entry in taxonomy for url in entry["links"]}
+    legacy_names = Counter(legacy_filename_from_url(url) for url in urls)
+    pairs = []
+    for entry in taxonomy:
+        for url in entry["links"]:
+            path = os.path.join(pdf_dir, filename_from_url(url))
+            legacy_name = legacy_filename_from_url(url)
+            if not os.path.exists(path) and legacy_names[legacy_name] == 1:
+                path = os.path.join(pdf_dir, legacy_name)
+            if os.path.exists(path):
+                pairs.append((path, entry["category"]))
+    return pairs
+
+
+class FeatureCache:
+    """
+    Sparse feature rows on disk, one `.npz` per text, keyed by the SHA-256 of
+    the text. The directory is specific to one vectorizer (see
+    ClassifierService), so a retrained model never reads stale features.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = str(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key: str):
+        from scipy import sparse
+
+        try:
+            row = sparse.load_npz(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return row
+
+    def put(self, key: str, row):
+        from scipy import sparse
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        sparse.save_npz(tmp_path, row.tocsr())
+        os.replace(tmp_path, path)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class ClassifierService:
+    """
+    The model-type classifier of `classification_model/` (a TF-IDF +
+    LinearSVC pipeline and its LabelEncoder), loaded once per process.
+
+    Papers are classified in batches; the vectorizer output of every text is
+    cached by text hash when `cache_dir` is given, so re-scoring the corpus
+    (new confidence threshold, new calibration) only runs the final
+    estimator. Probabilities come from a calibrator fitted with `calibrate`
+    if one was saved next to the model, from the estimator's own
+    `predict_proba` otherwise, and as a last resort from a softmax of its
+    decision scores (reported with "calibrated": False).
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        model_dir: str = "classification_model",
+        cache_dir: str | None = None,
+        taxonomy_path: str | None = DEFAULT_TAXONOMY,
+        min_confidence: float | None = None
+    ):
+        import joblib
+
+        self.model_dir = str(model_dir)
+        self.model = joblib.load(os.path.join(self.model_dir, MODEL_NAME))
+        self.label_encoder = joblib.load(os.path.join(self.model_dir, ENCODER_NAME))
+        # Every step but the last turns text into features
+        self.vectorizer = self.model[:-1]
+        self.estimator = self.model[-1]
+        self.classes = [str(c) for c in self.label_encoder.inverse_transform(self.estimator.classes_)]
+        self.min_confidence = min_confidence
+
+        calibrator_path = os.path.join(self.model_dir, CALIBRATOR_NAME)
+        self.calibrator = joblib.load(calibrator_path) if os.path.exists(calibrator_path) else None
+
+        self.taxonomy = load_taxonomy(taxonomy_path) if taxonomy_path else list(self.classes)
+        unknown = [c for c in self.classes if c not in self.taxonomy]
+        if unknown:
+            print(f"Classifier labels not in the taxonomy: {unknown}")
+
+        self.cache = None
+        if cache_dir is not None:
+            fingerprint = file_sha256(os.path.join(self.model_dir, MODEL_NAME))[:16]
+            self.cache = FeatureCache(os.path.join(cache_dir, fingerprint))
+
+    @classmethod
+    def get(cls, model_dir: str = "classification_model", **kwargs) -> "ClassifierService":
+        """The shared instance for `model_dir` in this process, created on first use."""
+        key = (os.path.abspath(model_dir), tuple(sorted(kwargs.items())))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(model_dir, **kwargs)
+            return cls._instances[key]
+
+    def features(self, texts):
+        """Sparse feature matrix of `texts`, vectorizing only texts not in the cache."""
+        from scipy import sparse
+
+        texts = list(texts)
+        if self.cache is None:
+            with inst.span("classifier.vectorize", bytes=sum(len(t) for t in texts)):
+                return self.vectorizer.transform(texts)
+
+        keys = [self.cache.key(t) for t in texts]
+        rows = {}
+        for key in dict.fromkeys(keys):
+            row = self.cache.get(key)
+            if row is not None:
+                rows[key] = row
+        missing = {k: t for k, t in zip(keys, texts) if k not in rows}
+        inst.count("classifier_feature_cache_hits_total", len(rows))
+        if missing:
+            with inst.span("classifier.vectorize", bytes=sum(len(t) for t in missing.values())):
+                # One transform call for the whole batch of new texts
+                new_rows = self.vectorizer.transform(list(missing.values())).tocsr()
+            for i, key in enumerate(missing):
+                rows[key] = new_rows[i]
+                self.cache.put(key, new_rows[i])
+        return sparse.vstack([rows[k] for k in keys], format="csr")
+
+    def probabilities(self, features) -> tuple[np.ndarray, bool]:
+        """(n_texts x classes) probabilities in `self.classes` order, and whether they are calibrated."""
+        if self.calibrator is not None:
+            return self.calibrator.predict_proba(features), True
+        if hasattr(self.estimator, "predict_proba"):
+            return self.estimator.predict_proba(features), True
+        scores = self.estimator.decision_function(features)
+        if scores.ndim == 1:
+            scores = np.column_stack([-scores, scores])
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return scores / scores.sum(axis=1, keepdims=True), False
+
+    def classify(self, texts, min_confidence: float | None = None) -> list[dict]:
+        """
+        Classifies many texts at once. For each text:
+            {"label", "probability", "probabilities": {category: p}, "calibrated"}
+        with every taxonomy category in "probabilities". "label" is None when
+        the top probability is below `min_confidence` (the instance default
+        if not given).
+        """
+        min_confidence = self.min_confidence if min_confidence is None else min_confidence
+        texts = list(texts)
+        if not texts:
+            return []
+        with inst.span("classifier.classify", papers=len(texts)):
+            probabilities, calibrated = self.probabilities(self.features(texts))
+        inst.count("classifier_papers_total", len(texts))
+
+        results = []
+        for row in probabilities:
+            by_category = dict.fromkeys(self.taxonomy, 0.0)
+            by_category.update((c, float(p)) for c, p in zip(self.classes, row))
+            best = int(np.argmax(row))
+            confident = min_confidence is None or row[best] >= min_confidence
+            results.append({
+                "label": self.classes[best] if confident else None,
+                "probability": float(row[best]),
+                "probabilities": by_category,
+                "calibrated": calibrated,
+            })
+        return results
+
+    def calibrate(self, texts, labels, method: str = "sigmoid", cv: int | None = None, save: bool = True):
+        """
+        Fits a probability calibrator and saves it next to the model. With
+        `cv=None` the trained estimator is kept as is and the texts must be
+        held out from its training data; with `cv=k` (for the training papers
+        themselves) k copies of the estimator are refitted and calibrated on
+        the remaining folds.
+        """
+        import joblib
+        from sklearn.base import clone
+        from sklearn.calibration import CalibratedClassifierCV
+        from sklearn.frozen import FrozenEstimator
+
+        features = self.features(texts)
+        y = self.label_encoder.transform(list(labels))
+        estimator = FrozenEstimator(self.estimator) if cv is None else clone(self.estimator)
+        self.calibrator = CalibratedClassifierCV(estimator, method=method, cv=cv).fit(features, y)
+        if save:
+            joblib.dump(self.calibrator, os.path.join(self.model_dir, CALIBRATOR_NAME))
+        return self.calibrator
+
+
+def main():
+    from .grobid_service import GrobidService
+    from .tei_extraction import TEIDocument
+
+    parser = argparse.ArgumentParser(description="Classify papers by model type")
+    parser.add_argument("pdfs", nargs="*", help="PDFs to classify")
+    parser.add_argument("--model-dir", default="classification_model")
+    parser.add_argument("--cache-dir", default=".classifier_cache", help="Feature cache")
+    parser.add_argument("--tei-cache-dir", default=".pipeline_cache/tei")
+    parser.add_argument("--grobid-config", default="./Grobid/config.json")
+    parser.add_argument("--taxonomy", default=DEFAULT_TAXONOMY)
+    parser.add_argument("--min-confidence", type=float)
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Fit the calibrator on the taxonomy's papers found in --pdf-dir")
+    parser.add_argument("--pdf-dir", default="data/pdf_files")
+    args = parser.parse_args()
+
+    service = ClassifierService(args.model_dir, args.cache_dir, args.taxonomy, args.min_confidence)
+    grobid = GrobidService(config_path=args.grobid_config, cache_dir=args.tei_cache_dir)
+
+    def raw_texts(pdf_paths):
+        return [TEIDocument(grobid.process_full_text(p)).raw_text for p in pdf_paths]
+
+    if args.calibrate:
+        # The taxonomy papers are the classifier's training data: calibrate out of fold
+        pairs = labeled_pdfs(args.taxonomy, args.pdf_dir)
+        service.calibrate(raw_texts([p for p, _ in pairs]), [label for _, label in pairs], cv=5)
+        print(f"Calibrator fitted on {len(pairs)} papers and saved in '{args.model_dir}'")
+
+    for pdf_path, result in zip(args.pdfs, service.classify(raw_texts(args.pdfs))):
+        print(f"{pdf_path}: {result['label']} ({result['probability']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
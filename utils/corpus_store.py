@@ -0,0 +1,203 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+
+from .tei_extraction import TEIDocument
+
+# File layout:
+#   [UTF-8 text blob][int64 (offset, length) span table][JSON catalog][footer]
+# The catalog maps each paper id to span indices for its abstract, raw text,
+# sections and paragraphs. Paragraphs of a section are written contiguously,
+# separated by a blank line, so a whole section is also a single span.
+MAGIC = b"GKCORPUS"
+VERSION = 1
+FOOTER = struct.Struct("<8sI4xqqqq")
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+class CorpusStoreWriter:
+    """
+    Writes the output of the `utils.tei_extraction` views for many papers into
+    a single store file readable with `CorpusStore`.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self._blob = open(self._tmp_path, "wb")
+        self._offset = 0
+        self._spans = array("q")
+        self._papers = {}
+
+    def add(self, paper_id: str, tei):
+        """
+        Adds one paper from its TEI XML string (or an already parsed TEIDocument).
+        """
+        if paper_id in self._papers:
+            raise ValueError(f"Paper {paper_id!r} already added")
+        doc = tei if isinstance(tei, TEIDocument) else TEIDocument(tei)
+
+        sections = []
+        for section in doc.sections:
+            start = self._offset
+            paragraphs = []
+            for i, paragraph in enumerate(section["paragraphs"]):
+                if i:
+                    self._write(PARAGRAPH_SEPARATOR)
+                paragraphs.append(self._add_text(paragraph))
+            sections.append({
+                "title": section["title"],
+                "span": self._add_span(start, self._offset - start),
+                "paragraphs": paragraphs,
+            })
+
+        self._papers[paper_id] = {
+            "abstract": self._add_text(doc.abstract),
+            "raw_text": self._add_text(doc.raw_text),
+            "raw_text_without_references": self._add_text(doc.raw_text_without_references),
+            "sections": sections,
+            "flat_sections": [
+                {"title": s["title"], "span": self._add_text(s["text"])}
+                for s in doc.flat_sections
+            ],
+        }
+
+    def close(self):
+        if self._blob.closed:
+            return
+        blob_len = self._offset
+        self._blob.write(self._spans.tobytes())
+        catalog = json.dumps({"papers": self._papers}, ensure_ascii=False).encode("utf-8")
+        catalog_offset = blob_len + len(self._spans) * self._spans.itemsize
+        self._blob.write(catalog)
+        self._blob.write(FOOTER.pack(
+            MAGIC, VERSION, blob_len, len(self._spans) // 2, catalog_offset, len(catalog)
+        ))
+        self._blob.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._blob.close()
+            os.remove(self._tmp_path)
+
+    def _write(self, text: str):
+        data = text.encode("utf-8")
+        self._blob.write(data)
+        self._offset += len(data)
+
+    def _add_text(self, text: str) -> int:
+        start = self._offset
+        self._write(text or "")
+        return self._add_span(start, self._offset - start)
+
+    def _add_span(self, offset: int, length: int) -> int:
+        self._spans.append(offset)
+        self._spans.append(length)
+        return len(self._spans) // 2 - 1
+
+
+class CorpusStore:
+    """
+    Read-only, memory-mapped view of a corpus store file.
+
+    Text accessors return zero-copy `memoryview` slices of the mapped file; use
+    `bytes(view).decode()` (or `CorpusStore.text`) when a str is needed. Pages
+    are shared by the OS, so many worker processes can open the same store
+    without each holding its own copy of the corpus.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, version, blob_len, n_spans, catalog_offset, catalog_len = FOOTER.unpack(
+            self._view[-FOOTER.size:]
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a corpus store (version {VERSION})")
+
+        self._blob = self._view[:blob_len]
+        self._spans = self._view[blob_len:blob_len + n_spans * 16].cast("q")
+        catalog = bytes(self._view[catalog_offset:catalog_offset + catalog_len])
+        self._papers = json.loads(catalog.decode("utf-8"))["papers"]
+
+    @staticmethod
+    def text(view: memoryview) -> str:
+        return str(view, "utf-8")
+
+    def paper_ids(self) -> list[str]:
+        return list(self._papers)
+
+    def __contains__(self, paper_id) -> bool:
+        return paper_id in self._papers
+
+    def __len__(self) -> int:
+        return len(self._papers)
+
+    def abstract(self, paper_id: str) -> memoryview:
+        return self._span(self._papers[paper_id]["abstract"])
+
+    def raw_text(self, paper_id: str, remove_ref: bool = False) -> memoryview:
+        key = "raw_text_without_references" if remove_ref else "raw_text"
+        return self._span(self._papers[paper_id][key])
+
+    def section_titles(self, paper_id: str) -> list[str | None]:
+        return [s["title"] for s in self._papers[paper_id]["sections"]]
+
+    def section(self, paper_id: str, section: int) -> memoryview:
+        """
+        Whole section text, paragraphs separated by a blank line.
+        """
+        return self._span(self._papers[paper_id]["sections"][section]["span"])
+
+    def paragraphs(self, paper_id: str, section: int) -> list[memoryview]:
+        return [self._span(i) for i in self._papers[paper_id]["sections"][section]["paragraphs"]]
+
+    def paragraph(self, paper_id: str, section: int, paragraph: int) -> memoryview:
+        return self._span(self._papers[paper_id]["sections"][section]["paragraphs"][paragraph])
+
+    def flat_sections(self, paper_id: str) -> list[tuple[str, memoryview]]:
+        """
+        Same sections as `extract_flat_sections_with_subtext`, as (title, text) pairs.
+        """
+        return [(s["title"], self._span(s["span"])) for s in self._papers[paper_id]["flat_sections"]]
+
+    def close(self):
+        self._spans.release()
+        self._blob.release()
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            # Slices still referenced by the caller keep the mapping alive
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _span(self, index: int) -> memoryview:
+        offset = self._spans[2 * index]
+        return self._blob[offset:offset + self._spans[2 * index + 1]]
+
+
+def build_corpus_store(path: str, papers) -> str:
+    """
+    Writes a store from an iterable of (paper_id, tei_xml) pairs.
+    """
+    with CorpusStoreWriter(path) as writer:
+        for paper_id, tei in papers:
+            writer.add(paper_id, tei)
+    return path
@@ -0,0 +1,219 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+DEFAULT_THRESHOLD = 80
+# Words too common in dataset/task names to be a useful blocking key
+STOP_TOKENS = {"the", "and", "for", "with", "data", "dataset", "datasets", "set", "sets", "benchmark", "task"}
+
+
+def normalize_name(text: str) -> str:
+    """
+    Lower-case, non-alphanumerics replaced by spaces, trimmed (rapidfuzz's
+    default_process).
+    """
+    return default_process(str(text))
+
+
+def token_keys(text: str) -> set[str]:
+    """
+    Blocking keys for dataset and task names: the 4-character prefix of every
+    significant token, and the first and last 3 characters of the whole name
+    with separators removed. "FB15k-237", "FB-15k" and "fb15k" share a block,
+    and so do names differing only at one end ("MNED" and "NED").
+    """
+    tokens = normalize_name(text).split()
+    keys = {f"t:{t[:4]}" for t in tokens if len(t) >= 3 and t not in STOP_TOKENS}
+    squashed = "".join(tokens)
+    if squashed:
+        keys.add(f"p:{squashed[:3]}")
+        keys.add(f"s:{squashed[-3:]}")
+    return keys
+
+
+def initials_keys(text: str) -> set[str]:
+    """
+    Blocking keys for person names: the surname, and the first and last
+    initials, so "Thomas N. Kipf", "T. Kipf" and "Kipf" share a block.
+    """
+    tokens = normalize_name(text).split()
+    if not tokens:
+        return set()
+    keys = {f"s:{tokens[-1]}"}
+    if len(tokens) > 1:
+        keys.add(f"i:{tokens[0][0]}{tokens[-1][0]}")
+    return keys
+
+
+def length_keys(text: str, threshold: float = DEFAULT_THRESHOLD) -> set[str]:
+    """
+    Blocking keys that never separate a pair scoring at least `threshold`
+    with fuzz.ratio: that needs the longer name to be at most
+    (200 - threshold) / threshold times as long as the shorter one, so names
+    are bucketed by the log of their length in that base and every name is
+    in its bucket and the next one.
+    """
+    if threshold <= 0:
+        return {"l:all"}
+    # Slightly wider buckets: a pair right at the bound never lands two buckets apart
+    base = max((200 - threshold) / threshold, 1.0) * 1.001
+    bucket = math.floor(math.log(len(text), base)) if text else -1
+    return {f"l:{bucket}", f"l:{bucket + 1}"}
+
+
+BLOCKING = {"length": length_keys, "tokens": token_keys, "initials": initials_keys}
+
+
+def _key_function(blocking: str, threshold: float):
+    if blocking == "length":
+        return lambda text: length_keys(text, threshold)
+    return BLOCKING[blocking]
+
+
+def _blocks(keys_a, keys_b=None):
+    # key -> (indices in a, indices in b); only keys present on both sides
+    index = defaultdict(lambda: ([], []))
+    for i, keys in enumerate(keys_a):
+        for key in keys:
+            index[key][0].append(i)
+    for j, keys in enumerate(keys_a if keys_b is None else keys_b):
+        for key in keys:
+            if key in index:
+                index[key][1].append(j)
+    return [(a, b) for a, b in index.values() if a and b]
+
+
+def _blocked_scores(a, b, keys_a, keys_b, scorer, threshold, workers, same=False):
+    """
+    {(i, j): score} for the pairs of `a` x `b` sharing a blocking key and
+    scoring at least `threshold`. Each block is scored with one batched
+    `process.cdist` call.
+    """
+    scores = {}
+    for rows, cols in _blocks(keys_a, None if same else keys_b):
+        matrix = process.cdist(
+            [a[i] for i in rows], [b[j] for j in cols],
+            scorer=scorer, score_cutoff=threshold, workers=workers
+        )
+        for r, c in zip(*np.nonzero(matrix >= threshold)):
+            i, j = rows[r], cols[c]
+            if same and i >= j:
+                continue
+            scores[(i, j)] = max(scores.get((i, j), 0), float(matrix[r, c]))
+    return scores
+
+
+def cluster_fuzzy(
+    names,
+    threshold: float = DEFAULT_THRESHOLD,
+    scorer=fuzz.ratio,
+    blocking: str = "length",
+    workers: int = 1
+) -> list[list[str]]:
+    """
+    Greedy clustering in input order: a name starts a new cluster unless it
+    scores at least `threshold` against the first name (representative) of an
+    existing cluster, in which case it joins the first such cluster. Names
+    are only compared within blocking groups (see BLOCKING). The default
+    "length" blocking loses no pair for fuzz.ratio; "tokens" and "initials"
+    compare fewer pairs but never merge a similar pair sharing no key (on
+    data/datasets.json, "tokens" keeps 220 names instead of 218).
+    """
+    names = list(names)
+    # Exact repeats never change the outcome: score each distinct name once
+    unique = list(dict.fromkeys(names))
+    make_keys = _key_function(blocking, threshold)
+    keys = [make_keys(n) for n in unique]
+    similar = defaultdict(set)
+    for i, j in _blocked_scores(unique, unique, keys, keys, scorer, threshold, workers, same=True):
+        similar[j].add(i)
+
+    cluster_of = {}
+    clusters = {}
+    for j, name in enumerate(unique):
+        representative = next((i for i in sorted(similar[j]) if i in clusters), j)
+        cluster_of[name] = representative
+        clusters.setdefault(representative, [])
+    for name in names:
+        clusters[cluster_of[name]].append(name)
+    return list(clusters.values())
+
+
+def deduplicate_fuzzy(
+    names,
+    threshold: float = DEFAULT_THRESHOLD,
+    scorer=fuzz.ratio,
+    blocking: str = "length",
+    workers: int = 1
+) -> list[str]:
+    """
+    Drop-in for the notebooks' `deduplicate_fuzzy` (keep a name unless it is
+    similar to one already kept), without the pairwise Python loop. With the
+    default "length" blocking and scorer the result is the same; other
+    blockings can keep near-duplicates that share no blocking key.
+    """
+    return [cluster[0] for cluster in cluster_fuzzy(names, threshold, scorer, blocking, workers)]
+
+
+def _prf(tp: int, n_pred: int, n_ref: int) -> dict:
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_ref if n_ref else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"tp": tp, "fp": n_pred - tp, "fn": n_ref - tp, "precision": precision, "recall": recall, "f1": f1}
+
+
+def score_corpus(
+    predictions,
+    references,
+    threshold: float = DEFAULT_THRESHOLD,
+    scorer=fuzz.token_sort_ratio,
+    processor=normalize_name,
+    blocking: str = "tokens",
+    workers: int = -1
+) -> dict:
+    """
+    Scores a list of predicted name lists against the reference lists of the
+    same papers (e.g. GROBID authors vs PapersWithCode "Authors", or
+    LLM-extracted datasets vs "Datasets").
+
+    Within each paper, predictions and references are matched one-to-one,
+    best score first, when they score at least `threshold`. All papers are
+    blocked together (by paper and blocking key) so the whole corpus is one
+    call. Returns per-paper and micro/macro-averaged precision, recall, F1.
+    """
+    if len(predictions) != len(references):
+        raise ValueError("predictions and references must have one list per paper")
+    make_keys = _key_function(blocking, threshold)
+
+    pred_flat, pred_paper, ref_flat, ref_paper = [], [], [], []
+    for paper, (preds, refs) in enumerate(zip(predictions, references)):
+        pred_flat += list(preds)
+        pred_paper += [paper] * len(preds)
+        ref_flat += list(refs)
+        ref_paper += [paper] * len(refs)
+
+    pred_norm = [processor(p) for p in pred_flat]
+    ref_norm = [processor(r) for r in ref_flat]
+    # Keys are prefixed with the paper so blocks never mix papers
+    pred_keys = [{(paper, key) for key in make_keys(p)} for p, paper in zip(pred_norm, pred_paper)]
+    ref_keys = [{(paper, key) for key in make_keys(r)} for r, paper in zip(ref_norm, ref_paper)]
+    scores = _blocked_scores(pred_norm, ref_norm, pred_keys, ref_keys, scorer, threshold, workers)
+
+    tp = [0] * len(predictions)
+    used_pred, used_ref = set(), set()
+    for (i, j), _ in sorted(scores.items(), key=lambda item: -item[1]):
+        if i not in used_pred and j not in used_ref:
+            used_pred.add(i)
+            used_ref.add(j)
+            tp[pred_paper[i]] += 1
+
+    papers = [_prf(tp[k], len(predictions[k]), len(references[k])) for k in range(len(predictions))]
+    micro = _prf(sum(tp), len(pred_flat), len(ref_flat))
+    macro = {
+        metric: float(np.mean([p[metric] for p in papers])) if papers else 0.0
+        for metric in ("precision", "recall", "f1")
+    }
+    return {"papers": papers, "micro": micro, "macro": macro}
@@ -1,60 +1,184 @@
+import inspect
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 from grobid_client.grobid_client import GrobidClient
-from bs4 import BeautifulSoup
+
+from . import instrumentation as inst
+from .tei_cache import TEICache
+from .tei_extraction import TEIDocument
 
 class GrobidService:
-    def __init__(self, config_path: str = "./Grobid/config.json"):
-        self.client = GrobidClient(config_path=config_path)
+    # Flags passed to client.process_pdf; they are also part of the cache key
+    PROCESS_FLAGS = {
+        "generateIDs": False,
+        "consolidate_header": True,
+        "consolidate_citations": False,
+        "include_raw_citations": False,
+        "include_raw_affiliations": False,
+        "segment_sentences": False,
+        "tei_coordinates": False,
+    }
+    # Statuses GROBID answers with when all its workers are busy
+    BUSY_STATUSES = (429, 503)
+    # Flag names of older grobid_client releases -> current ones
+    FLAG_ALIASES = {"generateIDs": "generate_ids"}
+
+    def __init__(
+        self,
+        config_path: str = "./Grobid/config.json",
+        cache_dir: str | None = None,
+        max_cache_bytes: int = 1024 * 1024 * 1024,
+        cache_only: bool = False
+    ):
+        """
+        If `cache_dir` is given, TEI responses are cached on disk keyed by PDF
+        content, service and flags. With `cache_only=True` GROBID is never
+        called (nor contacted at start-up) and a cache miss raises LookupError.
+        """
+        if cache_only and cache_dir is None:
+            raise ValueError("cache_only=True requires a cache_dir")
+        self.cache = TEICache(cache_dir, max_cache_bytes) if cache_dir else None
+        self.cache_only = cache_only
+        self.client = None if cache_only else GrobidClient(config_path=config_path)
+        self._client_flags = {}
+        if self.client is not None:
+            # grobid_client renamed generateIDs to generate_ids; pass whichever this release accepts
+            accepted = inspect.signature(self.client.process_pdf).parameters
+            self._client_flags = {
+                old: new for old, new in self.FLAG_ALIASES.items() if old not in accepted and new in accepted
+            }
+
+    def process(self, service: str, pdf_path: str, **flags) -> str:
+        """
+        Calls the given GROBID service on the PDF and returns the TEI XML,
+        going through the TEI cache when one is configured.
+        """
+        _, tei, _ = self._call(service, pdf_path, flags)
+        return tei
+
+    def process_many(
+        self,
+        pdf_paths,
+        service: str = "processFulltextDocument",
+        workers: int = 4,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        **flags
+    ):
+        """
+        Processes many PDFs concurrently and yields one result dict per file as
+        soon as it finishes (not in input order):
+            {"pdf_path", "service", "status", "tei", "cached", "attempts", "error"}
+        At most `workers` requests are in flight; further paths are only pulled
+        from `pdf_paths` as earlier ones complete, so it can be a lazy iterator.
+        Busy responses (503/429) are retried with exponential backoff.
+        """
+        paths = iter(pdf_paths)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+
+            def submit_next():
+                for pdf_path in paths:
+                    pending.add(pool.submit(
+                        self._call_with_retry, service, str(pdf_path), flags, max_retries, backoff
+                    ))
+                    return
+
+            for _ in range(workers):
+                submit_next()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    submit_next()
+                    yield future.result()
+
+    def _call_with_retry(self, service, pdf_path, flags, max_retries, backoff) -> dict:
+        result = {
+            "pdf_path": pdf_path,
+            "service": service,
+            "status": None,
+            "tei": None,
+            "cached": False,
+            "attempts": 0,
+            "error": None,
+        }
+        for attempt in range(max_retries + 1):
+            result["attempts"] = attempt + 1
+            try:
+                status, tei, cached = self._call(service, pdf_path, flags)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                return result
+
+            result.update(status=status, cached=cached)
+            if status == 200:
+                result["tei"] = tei
+                return result
+            if status not in self.BUSY_STATUSES or attempt == max_retries:
+                result["error"] = tei or f"GROBID returned status {status}"
+                return result
+            inst.count("grobid_retries_total", service=service, status=status)
+            time.sleep(min(backoff * 2 ** attempt, 60) * random.uniform(0.5, 1.5))
+        return result
+
+    def _call(self, service: str, pdf_path: str, flags: dict) -> tuple[int, str, bool]:
+        """
+        Returns (status, tei, cached). Only successful responses are cached.
+        """
+        flags = {**self.PROCESS_FLAGS, **flags}
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(pdf_path, service, flags)
+            tei = self.cache.get(key)
+            if tei is not None:
+                inst.count("tei_cache_hits_total", service=service)
+                return 200, tei, True
+            inst.count("tei_cache_misses_total", service=service)
+            if self.cache_only:
+                raise LookupError(f"No cached TEI for {pdf_path} ({service})")
+
+        with inst.span(f"grobid.{service}", bytes=os.path.getsize(pdf_path)) as span:
+            _, status, tei = self.client.process_pdf(
+                service=service,
+                pdf_file=pdf_path,
+                **{self._client_flags.get(name, name): value for name, value in flags.items()}
+            )
+            span.set(status=status)
+        inst.count("grobid_calls_total", service=service, status=status)
+        if key is not None and status == 200 and tei:
+            self.cache.put(key, tei)
+        return status, tei, False
 
     def process_header(self, pdf_path: str) -> str:
         """
         Calls GROBID to process the PDF header and returns the TEI XML.
         """
-        _, status, tei = self.client.process_pdf(
-            service="processHeaderDocument",
-            pdf_file=pdf_path,
-            generateIDs=False,
-            consolidate_header=True,
-            consolidate_citations=False,
-            include_raw_citations=False,
-            include_raw_affiliations=False,
-            segment_sentences=False,
-            tei_coordinates=False
-        )
-        return tei
+        return self.process("processHeaderDocument", pdf_path)
 
     def process_full_text(self, pdf_path: str) -> str:
         """
         Calls GROBID to process the PDF text and returns the TEI XML.
         """
-        _, status, tei = self.client.process_pdf(
-            service="processFulltextDocument",
-            pdf_file=pdf_path,
-            generateIDs=False,
-            consolidate_header=True,
-            consolidate_citations=False,
-            include_raw_citations=False,
-            include_raw_affiliations=False,
-            segment_sentences=False,
-            tei_coordinates=False
-        )
-        return tei
+        return self.process("processFulltextDocument", pdf_path)
+
+    def cache_stats(self) -> dict | None:
+        """
+        Returns the TEI cache hit/miss counters, or None if caching is disabled.
+        """
+        return self.cache.stats() if self.cache is not None else None
 
     def extract_authors(self, tei_xml: str) -> list[str]:
         """
-        Parses TEI XML and extracts a list of author full names.
-        """
-        soup = BeautifulSoup(tei_xml, "lxml-xml")
-        names = []
-        for author in soup.find_all("author"):
-            pers = author.find("persName")
-            if not pers:
-                continue
-            parts = [fn.get_text(strip=True) for fn in pers.find_all("forename")]
-            if pers.surname:
-                parts.append(pers.surname.get_text(strip=True))
-            if parts:
-                names.append(" ".join(parts))
-        return names
+        Parses TEI XML (or reuses an already parsed TEIDocument) and extracts
+        a list of author full names.
+        """
+        doc = tei_xml if isinstance(tei_xml, TEIDocument) else TEIDocument(tei_xml)
+        return list(doc.authors)
 
     def extract_authors_from_pdf(self, pdf_path: str) -> list[str]:
         """
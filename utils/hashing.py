@@ -0,0 +1,13 @@
+import hashlib
+
+# Content hashes shared by the downloader, the caches and the pipeline, so a
+# PDF hashed by one of them is recognised by the others.
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 hex digest of a file's content, read in 1 MiB blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
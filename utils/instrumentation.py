@@ -0,0 +1,369 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import itertools
+import json
+import math
+import os
+import re
+import threading
+import time
+
+# Per-stage timing and counters for corpus runs:
+#
+#     from utils import instrumentation as inst
+#     inst.configure(trace_path="trace.jsonl", prometheus_path="metrics.prom")
+#     with inst.span("grobid.processFulltextDocument", bytes=os.path.getsize(pdf)):
+#         ...
+#     inst.count("grobid_calls_total", service=service, status=status)
+#
+# Spans nest, and record wall time, CPU time (of the calling thread) and bytes
+# processed. Totals per span name and counters are always kept in memory; with a
+# trace path every finished span is also appended to a JSONL file, and with a
+# Prometheus path the totals are written as a node_exporter textfile at exit.
+#
+#     python -m utils.instrumentation trace.jsonl [--prometheus metrics.prom]
+#
+# summarizes a trace, including the spans of worker processes.
+
+# Spawned worker processes inherit the trace file through the environment
+TRACE_ENV = "KGE_TRACE_PATH"
+METRIC_PREFIX = "kge_"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """
+    A running span. Returned by `span()`; `add_bytes` and `set` can be called
+    while it runs.
+    """
+
+    def __init__(self, name: str, parent, n_bytes: int | None, attrs: dict):
+        self.name = name
+        self.id = next(_span_ids)
+        self.parent_id = parent.id if parent is not None else None
+        self.bytes = n_bytes or 0
+        self.attrs = attrs
+        self.start = time.time()
+        self.wall_seconds = None
+        self.cpu_seconds = None
+
+    def add_bytes(self, n_bytes: int):
+        self.bytes += n_bytes
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Recorder:
+    """
+    Counters, span totals and the optional trace file of one process.
+    """
+
+    def __init__(self):
+        self.trace_path = None
+        self.prometheus_path = None
+        self.counters = {}
+        self.spans = {}
+        self._trace = None
+        self._lock = threading.Lock()
+
+    def configure(self, trace_path: str | None = None, prometheus_path: str | None = None):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+            self.trace_path = str(trace_path) if trace_path else None
+            self.prometheus_path = str(prometheus_path) if prometheus_path else None
+            if self.trace_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+                self._trace = open(self.trace_path, "a", encoding="utf-8")
+
+    def count(self, name: str, value: float = 1, labels: dict | None = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def finish(self, span: Span):
+        with self._lock:
+            totals = self.spans.setdefault(span.name, {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "bytes": 0})
+            totals["count"] += 1
+            totals["wall_seconds"] += span.wall_seconds
+            totals["cpu_seconds"] += span.cpu_seconds
+            totals["bytes"] += span.bytes
+        if self._trace is not None:
+            self.write({
+                "type": "span",
+                "name": span.name,
+                "id": span.id,
+                "parent": span.parent_id,
+                "start": round(span.start, 6),
+                "wall_seconds": round(span.wall_seconds, 6),
+                "cpu_seconds": round(span.cpu_seconds, 6),
+                "bytes": span.bytes,
+                "attrs": span.attrs,
+            })
+
+    def write(self, record: dict):
+        record = {**record, "pid": os.getpid(), "thread": threading.current_thread().name}
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._trace is not None:
+                # One write per line keeps lines whole when processes share the file
+                self._trace.write(line)
+                self._trace.flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "spans": {name: dict(totals) for name, totals in self.spans.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.spans = {}
+
+    def flush(self):
+        """Writes this process's totals to the trace and the Prometheus textfile."""
+        if self._trace is not None:
+            self.write({"type": "totals", **self.snapshot()})
+        if self.prometheus_path:
+            write_prometheus(self.prometheus_path, self.snapshot())
+
+    def close(self):
+        self.flush()
+        self.configure()
+
+
+_recorder = Recorder()
+atexit.register(_recorder.close)
+if os.environ.get(TRACE_ENV):
+    _recorder.configure(trace_path=os.environ[TRACE_ENV])
+
+
+def configure(trace_path: str | None = None, prometheus_path: str | None = None):
+    """
+    Starts writing spans to `trace_path` (JSONL, appended) and, at exit or on
+    `flush()`, the totals to `prometheus_path`. Processes spawned afterwards
+    append their spans to the same trace. Calling it with no arguments stops
+    writing; in-memory totals are kept either way.
+    """
+    _recorder.configure(trace_path, prometheus_path)
+    if trace_path:
+        os.environ[TRACE_ENV] = os.path.abspath(trace_path)
+    else:
+        os.environ.pop(TRACE_ENV, None)
+
+
+def flush():
+    """Writes the totals so far without waiting for the process to exit."""
+    _recorder.flush()
+
+
+class span:
+    """
+    Context manager timing a block as a named span, nested under the span
+    active in the same thread (or task):
+
+        with span("tables.extract_values", bytes=len(html)) as s:
+            s.set(page=3)
+
+    Works as a decorator too (see `timed`).
+    """
+
+    def __init__(self, name: str, bytes: int | None = None, **attrs):
+        self.name = name
+        self.bytes = bytes
+        self.attrs = attrs
+
+    def __enter__(self) -> Span:
+        self._span = Span(self.name, _current_span.get(), self.bytes, dict(self.attrs))
+        self._token = _current_span.set(self._span)
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        current = self._span
+        current.wall_seconds = time.perf_counter() - self._wall
+        current.cpu_seconds = time.thread_time() - self._cpu
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            current.attrs["error"] = exc_type.__name__
+        _recorder.finish(current)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, self.bytes, **self.attrs):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def timed(name: str | None = None):
+    """Decorator: every call of the function is a span (named after it by default)."""
+    def decorator(func):
+        return span(name or f"{func.__module__}.{func.__qualname__}")(func)
+    return decorator
+
+
+def count(name: str, value: float = 1, **labels):
+    """Adds `value` to the counter `name` with the given labels."""
+    _recorder.count(name, value, labels)
+
+
+def event(name: str, **attrs):
+    """A point-in-time trace record (e.g. a skipped table), counted as `<name>_total`."""
+    _recorder.count(f"{name}_total")
+    parent = _current_span.get()
+    _recorder.write({
+        "type": "event",
+        "name": name,
+        "parent": parent.id if parent is not None else None,
+        "time": round(time.time(), 6),
+        "attrs": attrs,
+    })
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def snapshot() -> dict:
+    """In-memory counters and span totals of this process."""
+    return _recorder.snapshot()
+
+
+def reset():
+    _recorder.reset()
+
+
+def _metric_name(name: str) -> str:
+    return METRIC_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{re.sub(r"[^a-zA-Z0-9_]", "_", str(k))}="{_label_value(v)}"' for k, v in sorted(labels.items()))
+    return "{" + ",".join(pairs) + "}"
+
+
+def _sample_value(value) -> str:
+    # Exact integers for counts; repr keeps every digit of a float, `:g` only six
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def prometheus_text(totals: dict) -> str:
+    """Prometheus exposition text for a `snapshot()` (or `summarize_trace()`) result."""
+    lines = []
+    by_name = {}
+    for counter in totals["counters"]:
+        by_name.setdefault(_metric_name(counter["name"]), []).append(counter)
+    for metric, counters in sorted(by_name.items()):
+        lines.append(f"# TYPE {metric} counter")
+        for counter in counters:
+            lines.append(f"{metric}{_labels(counter['labels'])} {_sample_value(counter['value'])}")
+
+    span_metrics = [
+        ("span_count_total", "count"),
+        ("span_wall_seconds_total", "wall_seconds"),
+        ("span_cpu_seconds_total", "cpu_seconds"),
+        ("span_bytes_total", "bytes"),
+    ]
+    for metric, field in span_metrics:
+        lines.append(f"# TYPE {METRIC_PREFIX}{metric} counter")
+        for name, span_totals in sorted(totals["spans"].items()):
+            lines.append(f"{METRIC_PREFIX}{metric}{_labels({'span': name})} {_sample_value(span_totals[field])}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, totals: dict | None = None):
+    """Writes the totals (this process's by default) as a node_exporter textfile."""
+    text = prometheus_text(totals if totals is not None else snapshot())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # The textfile collector must never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def summarize_trace(trace_path: str) -> dict:
+    """
+    Span totals of a whole trace (every process that wrote to it) plus the
+    counters of the latest totals record of each process, in the same shape
+    as `snapshot()`.
+    """
+    spans = {}
+    latest_totals = {}
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record["type"] == "span":
+                totals = spans.setdefault(record["name"], {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "bytes": 0})
+                totals["count"] += 1
+                totals["wall_seconds"] += record["wall_seconds"]
+                totals["cpu_seconds"] += record["cpu_seconds"]
+                totals["bytes"] += record["bytes"]
+            elif record["type"] == "totals":
+                latest_totals[record["pid"]] = record["counters"]
+
+    counters = {}
+    for process_counters in latest_totals.values():
+        for counter in process_counters:
+            key = (counter["name"], tuple(sorted(counter["labels"].items())))
+            counters[key] = counters.get(key, 0) + counter["value"]
+    return {
+        "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters.items()],
+        "spans": spans,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a JSONL trace")
+    parser.add_argument("trace")
+    parser.add_argument("--prometheus", help="Also write the totals as a Prometheus textfile")
+    args = parser.parse_args()
+
+    totals = summarize_trace(args.trace)
+    print(f"{'span':<45}{'count':>8}{'wall s':>10}{'cpu s':>10}{'MB':>10}")
+    for name, t in sorted(totals["spans"].items(), key=lambda item: -item[1]["wall_seconds"]):
+        print(f"{name[:44]:<45}{t['count']:>8}{t['wall_seconds']:>10.2f}{t['cpu_seconds']:>10.2f}{t['bytes'] / 2 ** 20:>10.1f}")
+    if totals["counters"]:
+        print()
+        for counter in sorted(totals["counters"], key=lambda c: (c["name"], sorted(c["labels"].items()))):
+            labels = ", ".join(f"{k}={v}" for k, v in sorted(counter["labels"].items()))
+            print(f"{counter['name']}{f' ({labels})' if labels else ''}: {_sample_value(counter['value'])}")
+    if args.prometheus:
+        write_prometheus(args.prometheus, totals)
+        print(f"\nPrometheus textfile written to '{args.prometheus}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import argparse
+import ast
+import json
+import re
+import time
+from collections import defaultdict
+from itertools import islice
+from pathlib import Path
+
+from . import instrumentation as inst
+from .entity_matching import deduplicate_fuzzy
+
+# Batched question answering over paper chunks (the notebooks' `process_paper`
+# loop), for CPU inference with small models such as Qwen/Qwen3-1.7B:
+#
+#     engine = QAEngine.from_pretrained("Qwen/Qwen3-1.7B")
+#     papers = ((paper_id, [c["text"] for c in chunk_paper(tei, counter)]) for paper_id, tei in teis)
+#     for result in engine.run(papers, DEFAULT_QUESTIONS):
+#         result["answers"]["datasets"]
+#
+# Every (paper, chunk, question) is a job. The questions about one chunk share
+# the chat prefix holding the chunk, so that prefix is run through the model
+# once and its KV cache is repeated for each question; only the question
+# suffixes and the answers are computed per job. Chunks of similar length are
+# grouped into padded batches, and each paper is yielded as soon as all its
+# jobs are answered.
+#
+#     python -m utils.llm_engine --model Qwen/Qwen3-1.7B --tei-dir teis --limit 5
+#
+# measures throughput (with --no-prefix-reuse for the one-prompt-per-job baseline).
+
+SYSTEM_PROMPT = (
+    "You are an assistant for question-answering tasks. Use only the provided context information to form your response."
+)
+ANSWER_FORMAT = (
+    "Give back the answer only and only in a correct Python list format, for example: ['A','B']. "
+    "If you don't know the answer, just return an empty list."
+)
+DEFAULT_QUESTIONS = {
+    "datasets": "What are the name of datasets used in the paper?",
+    "tasks": "What are the tasks that the model is trained for?",
+    "authors": "Who are the authors of the paper?",
+}
+# Questions only asked about a paper's first chunk
+FIRST_CHUNK_ONLY = ("authors",)
+
+THINK_REGEX = re.compile(r"<think>.*?</think>", re.DOTALL)
+LIST_REGEX = re.compile(r"\[.*?\]", re.DOTALL)
+
+
+def build_chat(chunk: str, question: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context chunk: {chunk}"},
+        {"role": "user", "content": f"Now, given this question: {question}. {ANSWER_FORMAT}"},
+    ]
+
+
+def parse_list_answer(text: str) -> list[str]:
+    """The first Python list in a model answer (thinking removed), or [] if there is none."""
+    text = THINK_REGEX.sub("", text)
+    for match in LIST_REGEX.finditer(text):
+        try:
+            value = ast.literal_eval(match.group(0))
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(value, (list, tuple)):
+            return [str(v).strip() for v in value if str(v).strip()]
+    return []
+
+
+def _common_prefix_length(sequences) -> int:
+    first = sequences[0]
+    n = min(len(s) for s in sequences)
+    for other in sequences[1:]:
+        i = 0
+        while i < n and other[i] == first[i]:
+            i += 1
+        n = i
+    return n
+
+
+def _generated_token_count(generated, eos_token_ids) -> int:
+    """
+    Tokens `generate()` produced in `generated` (the output after the
+    prompt): each row up to and including its first EOS. What follows is
+    padding added once the row finished, which can't be told from the tokens
+    alone when the pad token is the EOS token.
+    """
+    import torch
+
+    if not eos_token_ids:
+        return generated.numel()
+    is_eos = torch.isin(generated, torch.tensor(eos_token_ids, device=generated.device)).long()
+    return int((is_eos.cumsum(-1) - is_eos == 0).sum())
+
+
+class QAEngine:
+    """
+    Answers questions about paper chunks with a Hugging Face causal LM.
+
+    `max_batch_size` bounds the rows (jobs) per batch and `max_batch_tokens`
+    the padded rows x (prompt + max_new_tokens) of a batch, which is what
+    bounds the KV-cache memory. With `reuse_prefix=False` every job is a full
+    prompt, batched by length, which is the baseline to compare against.
+    Decoding is greedy unless `generation_kwargs` say otherwise.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_new_tokens: int = 512,
+        max_batch_size: int = 8,
+        max_batch_tokens: int = 32768,
+        reuse_prefix: bool = True,
+        chat_template_kwargs: dict | None = None,
+        generation_kwargs: dict | None = None
+    ):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.reuse_prefix = reuse_prefix
+        # Qwen3 templates: no thinking block, the answer list comes straight away
+        self.chat_template_kwargs = {"enable_thinking": False, **(chat_template_kwargs or {})}
+        self.generation_kwargs = {"do_sample": False, **(generation_kwargs or {})}
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        eos = self.generation_kwargs.get("eos_token_id", getattr(model.generation_config, "eos_token_id", None))
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = [eos] if isinstance(eos, int) else list(eos or [])
+        self.stats = {"jobs": 0, "batches": 0, "prompt_tokens": 0, "prefill_tokens": 0, "reused_tokens": 0,
+                      "generated_tokens": 0, "seconds": 0.0}
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, device: str = "cpu", torch_dtype=None, **kwargs):
+        """Loads model and tokenizer; on CPU the model runs in float32 unless `torch_dtype` is given."""
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if torch_dtype is None:
+            torch_dtype = torch.float32 if device == "cpu" else "auto"
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch_dtype).to(device)
+        return cls(model, tokenizer, **kwargs)
+
+    def _prompt_ids(self, chunk: str, question: str) -> list[int]:
+        prompt = self.tokenizer.apply_chat_template(
+            build_chat(chunk, question), tokenize=False, add_generation_prompt=True, **self.chat_template_kwargs
+        )
+        return self.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+
+    def _groups(self, papers, questions, first_chunk_only):
+        # One group per (paper, chunk): its questions' prompt ids, split into
+        # the shared prefix and the per-question suffixes
+        groups = []
+        for paper_id, chunks in papers:
+            for chunk_index, chunk in enumerate(chunks):
+                keys = [k for k in questions if chunk_index == 0 or k not in first_chunk_only]
+                if not keys:
+                    continue
+                ids = [self._prompt_ids(chunk, questions[k]) for k in keys]
+                # Every suffix keeps at least one token for generate() to feed
+                n = min(_common_prefix_length(ids), min(len(i) for i in ids) - 1) if self.reuse_prefix else 0
+                groups.append({
+                    "paper_id": paper_id,
+                    "chunk": chunk_index,
+                    "keys": keys,
+                    "prefix": ids[0][:n],
+                    "suffixes": [i[n:] for i in ids],
+                })
+        return groups
+
+    def _batches(self, groups):
+        # Sorted by length so padding stays small; a group is never split
+        groups = sorted(groups, key=lambda g: len(g["prefix"]) + max(len(s) for s in g["suffixes"]))
+        batch, rows, longest = [], 0, 0
+        for group in groups:
+            length = len(group["prefix"]) + max(len(s) for s in group["suffixes"]) + self.max_new_tokens
+            n_rows = len(group["suffixes"])
+            new_longest = max(longest, length)
+            if batch and (rows + n_rows > self.max_batch_size or (rows + n_rows) * new_longest > self.max_batch_tokens):
+                yield batch
+                batch, rows, new_longest = [], 0, length
+            batch.append(group)
+            rows += n_rows
+            longest = new_longest
+        if batch:
+            yield batch
+
+    def _generate_batch(self, batch) -> list[list[str]]:
+        """Generates the answers of every question of every group in the batch."""
+        import torch
+
+        device = self.model.device
+        pad = self.pad_token_id
+        prefix_len = max(len(g["prefix"]) for g in batch)
+        suffix_len = max(len(s) for g in batch for s in g["suffixes"])
+        row_group = [gi for gi, g in enumerate(batch) for _ in g["suffixes"]]
+
+        input_ids, attention_mask = [], []
+        for gi, group in enumerate(batch):
+            prefix_pad = prefix_len - len(group["prefix"])
+            for suffix in group["suffixes"]:
+                # Padding goes before the prefix and between prefix and suffix
+                suffix_pad = suffix_len - len(suffix)
+                input_ids.append([pad] * prefix_pad + group["prefix"] + [pad] * suffix_pad + suffix)
+                attention_mask.append([0] * prefix_pad + [1] * len(group["prefix"]) + [0] * suffix_pad + [1] * len(suffix))
+        input_ids = torch.tensor(input_ids, device=device)
+        attention_mask = torch.tensor(attention_mask, device=device)
+
+        generate_kwargs = {}
+        if prefix_len:
+            # The shared prefixes, once per group, then repeated for each question
+            prefix_ids = torch.stack([input_ids[row_group.index(gi), :prefix_len] for gi in range(len(batch))])
+            prefix_mask = torch.stack([attention_mask[row_group.index(gi), :prefix_len] for gi in range(len(batch))])
+            position_ids = (prefix_mask.cumsum(-1) - 1).clamp(min=0)
+            with inst.span("llm.prefill", groups=len(batch), tokens=int(prefix_mask.sum())):
+                cache = self.model(
+                    input_ids=prefix_ids, attention_mask=prefix_mask, position_ids=position_ids, use_cache=True
+                ).past_key_values
+            cache.reorder_cache(torch.tensor(row_group, device=device))
+            generate_kwargs["past_key_values"] = cache
+            self.stats["prefill_tokens"] += int(prefix_mask.sum())
+            self.stats["reused_tokens"] += sum(len(g["prefix"]) * (len(g["suffixes"]) - 1) for g in batch)
+
+        with inst.span("llm.generate", rows=len(row_group), prompt_length=prefix_len + suffix_len):
+            output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=self.max_new_tokens,
+                pad_token_id=pad,
+                **generate_kwargs,
+                **self.generation_kwargs,
+            )
+        generated = output[:, input_ids.shape[1]:]
+        self.stats["generated_tokens"] += _generated_token_count(generated, self.eos_token_ids)
+        texts = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+        answers = [[] for _ in batch]
+        for gi, text in zip(row_group, texts):
+            answers[gi].append(text)
+        return answers
+
+    def run(self, papers, questions: dict = DEFAULT_QUESTIONS, first_chunk_only=FIRST_CHUNK_ONLY, window: int = 8):
+        """
+        `papers` is an iterable of (paper_id, chunk texts). Yields per paper,
+        as soon as all its jobs are answered:
+            {"paper_id", "answers": {key: merged list}, "chunk_answers": {key: [list per chunk]},
+             "raw": {key: [text per chunk]}}
+        Papers are taken `window` at a time, so batches mix the chunks of a
+        few papers without holding back the first results until the end.
+        Chunk answers are merged with `deduplicate_fuzzy`.
+        """
+        import torch
+
+        papers = iter(papers)
+        while True:
+            window_papers = list(islice(papers, window))
+            if not window_papers:
+                return
+            order = [paper_id for paper_id, _ in window_papers]
+            with inst.span("llm.tokenize", papers=len(window_papers)):
+                groups = self._groups(window_papers, questions, first_chunk_only)
+            pending = defaultdict(int)
+            for group in groups:
+                pending[group["paper_id"]] += 1
+            raw = {paper_id: defaultdict(dict) for paper_id in order}
+
+            # Papers without chunks are done straight away
+            for paper_id in order:
+                if not pending[paper_id]:
+                    yield self._paper_result(paper_id, raw[paper_id])
+
+            for batch in self._batches(groups):
+                start = time.perf_counter()
+                with torch.inference_mode():
+                    answers = self._generate_batch(batch)
+                self.stats["seconds"] += time.perf_counter() - start
+                self.stats["batches"] += 1
+                for group, texts in zip(batch, answers):
+                    self.stats["jobs"] += len(texts)
+                    self.stats["prompt_tokens"] += sum(len(group["prefix"]) + len(s) for s in group["suffixes"])
+                    for key, text in zip(group["keys"], texts):
+                        raw[group["paper_id"]][key][group["chunk"]] = text
+                    pending[group["paper_id"]] -= 1
+                    if not pending[group["paper_id"]]:
+                        yield self._paper_result(group["paper_id"], raw[group["paper_id"]])
+
+    @staticmethod
+    def _paper_result(paper_id, raw_by_key) -> dict:
+        raw = {key: [texts[i] for i in sorted(texts)] for key, texts in raw_by_key.items()}
+        chunk_answers = {key: [parse_list_answer(t) for t in texts] for key, texts in raw.items()}
+        answers = {
+            key: deduplicate_fuzzy([a for chunk in lists for a in chunk], threshold=80)
+            for key, lists in chunk_answers.items()
+        }
+        inst.count("llm_papers_answered_total")
+        return {"paper_id": paper_id, "answers": answers, "chunk_answers": chunk_answers, "raw": raw}
+
+    def throughput(self) -> dict:
+        seconds = self.stats["seconds"] or float("nan")
+        return {
+            **self.stats,
+            "jobs_per_second": self.stats["jobs"] / seconds,
+            "generated_tokens_per_second": self.stats["generated_tokens"] / seconds,
+            "prompt_tokens_per_second": self.stats["prompt_tokens"] / seconds,
+        }
+
+
+def main():
+    from .chunking import TokenCounter, chunk_paper
+
+    parser = argparse.ArgumentParser(description="Measure batched QA throughput over GROBID TEI files")
+    parser.add_argument("--model", default="Qwen/Qwen3-1.7B")
+    parser.add_argument("--tei-dir", required=True, help="Directory of *.tei.xml / *.xml files")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=4096, help="Token budget per chunk")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--no-prefix-reuse", action="store_true")
+    parser.add_argument("-o", "--output", help="Write the answers per paper as JSON Lines")
+    args = parser.parse_args()
+
+    engine = QAEngine.from_pretrained(
+        args.model, max_new_tokens=args.max_new_tokens, max_batch_size=args.batch_size,
+        reuse_prefix=not args.no_prefix_reuse
+    )
+    counter = TokenCounter(engine.tokenizer)
+    tei_paths = sorted(Path(args.tei_dir).glob("*.xml"))[:args.limit]
+    papers = (
+        (path.name, [c["text"] for c in chunk_paper(path.read_bytes(), counter, max_tokens=args.max_tokens)])
+        for path in tei_paths
+    )
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        for result in engine.run(papers):
+            print(f"{result['paper_id']}: {json.dumps(result['answers'], ensure_ascii=False)}")
+            if out is not None:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+    print(json.dumps(engine.throughput(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import argparse
+import json
+import logging
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import instrumentation as inst
+from .hashing import file_sha256
+
+# Duplicate detection over the PDF corpus, run before GROBID, DeepDoctection
+# and the LLM see any paper:
+#
+#     python -m utils.pdf_dedup data/pdf_files -o data/pdf_duplicates.json
+#
+# The same paper often comes in twice (arXiv preprint and proceedings version)
+# under different filenames. Byte-identical copies share a SHA-256; near
+# duplicates are found with MinHash signatures of the word shingles of their
+# first pages (or of the GROBID title + abstract), bucketed by LSH bands so
+# each PDF is only compared with the PDFs it shares a bucket with, never with
+# the whole corpus. Candidate pairs are confirmed by their estimated Jaccard
+# similarity and every group keeps one canonical copy.
+
+NUM_PERM = 128
+BANDS = 32
+SHINGLE_WORDS = 5
+FIRST_PAGES = 2
+# Estimated Jaccard similarity of the shingles above which two PDFs are the same paper.
+# Preprint and camera-ready first pages differ in headers, footnotes and line breaks
+THRESHOLD = 0.5
+# Texts shorter than this (scanned PDFs, extraction failures) only dedupe by hash
+MIN_WORDS = 50
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_REGEX = re.compile(r"[^\W_]+")
+ARXIV_NAME_REGEX = re.compile(r"^\d{4}\.\d{4,5}(v\d+)?\.pdf$", re.IGNORECASE)
+
+
+def first_pages_text(path_pdf: str, pages: int = FIRST_PAGES) -> tuple[str, int]:
+    """(text of the first `pages` pages, total page count) read with pypdf."""
+    from pypdf import PdfReader
+
+    # Font and xref warnings of damaged PDFs are not actionable here
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    reader = PdfReader(str(path_pdf))
+    texts = [page.extract_text() or "" for page in reader.pages[:pages]]
+    return "\n".join(texts), len(reader.pages)
+
+
+def tei_title_abstract(tei) -> str:
+    """Title and abstract of a GROBID TEI (e.g. `process_header` output) as one text."""
+    from .tei_extraction import TEIDocument
+
+    doc = tei if isinstance(tei, TEIDocument) else TEIDocument(tei)
+    return "\n".join(t for t in (doc.title, doc.abstract) if t)
+
+
+def shingles(text: str, k: int = SHINGLE_WORDS) -> np.ndarray:
+    """Distinct 32-bit hashes of the k-word shingles of `text` (case and punctuation ignored)."""
+    words = WORD_REGEX.findall(text.lower())
+    if len(words) < k:
+        words = words and [" ".join(words)]
+        k = 1
+    hashes = {zlib.crc32(" ".join(words[i:i + k]).encode("utf-8")) for i in range(len(words) - k + 1)}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+class MinHasher:
+    """
+    MinHash signatures of `num_perm` universal hash permutations
+    ((a * x + b) mod p), computed for all permutations at once with numpy.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.seed = seed
+        # a, b < 2**28 keep a * x + b below 2**64 for 32-bit x
+        self.a = rng.integers(1, 1 << 28, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 28, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=1)
+
+    @staticmethod
+    def jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        """Estimated Jaccard similarity: the fraction of equal signature slots."""
+        return float(np.mean(sig_a == sig_b))
+
+
+class LSHIndex:
+    """
+    Locality-sensitive hashing of MinHash signatures: each signature is cut
+    into `bands` bands and two items are candidates when any band matches.
+    With r = num_perm / bands rows per band, pairs above a Jaccard similarity
+    of about (1 / bands) ** (1 / r) collide with high probability.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets = {}
+
+    def insert(self, key, signature: np.ndarray) -> set:
+        """Adds `key` and returns the keys already sharing a bucket with it."""
+        candidates = set()
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            bucket = self._buckets.setdefault((band, chunk), [])
+            candidates.update(bucket)
+            bucket.append(key)
+        return candidates
+
+
+class _UnionFind:
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x, y):
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x != root_y:
+            self.parent[max(root_x, root_y)] = min(root_x, root_y)
+
+
+def prefer_published(info: dict) -> tuple:
+    """
+    Default canonical copy of a group: the proceedings (non-arXiv-named)
+    version, then the longest one, then the first path.
+    """
+    is_arxiv = bool(ARXIV_NAME_REGEX.match(os.path.basename(info["path"])))
+    return is_arxiv, -(info["pages"] or 0), info["path"]
+
+
+def _fingerprint(path_pdf: str, digest: str, pages: int, k: int, num_perm: int, seed: int) -> dict:
+    info = {"path": path_pdf, "sha256": digest, "pages": None, "words": 0, "signature": None, "error": None}
+    try:
+        text, info["pages"] = first_pages_text(path_pdf, pages)
+    except Exception as e:
+        info["error"] = f"{type(e).__name__}: {e}"
+        return info
+    info["words"] = len(WORD_REGEX.findall(text))
+    info["signature"] = MinHasher(num_perm, seed).signature(shingles(text, k)).tolist()
+    return info
+
+
+class PdfDeduplicator:
+    """
+    Finds exact and near-duplicate PDFs and picks one canonical copy of each
+    paper.
+
+    Fingerprints (SHA-256, page count and MinHash signature of the first
+    pages) are cached by content hash in `<cache_dir>/fingerprints.json` when
+    `cache_dir` is given, so re-running over a grown corpus only reads the new
+    PDFs. `texts` may map paths to a text to fingerprint instead of their
+    first pages, e.g. `tei_title_abstract` of their GROBID header.
+    `prefer` sorts the members of a group; the first one is kept.
+    """
+
+    def __init__(
+        self,
+        threshold: float = THRESHOLD,
+        num_perm: int = NUM_PERM,
+        bands: int = BANDS,
+        shingle_words: int = SHINGLE_WORDS,
+        first_pages: int = FIRST_PAGES,
+        cache_dir: str | None = None,
+        workers: int | None = None,
+        prefer=prefer_published,
+        seed: int = 1
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_words = shingle_words
+        self.first_pages = first_pages
+        self.workers = workers
+        self.prefer = prefer
+        self.seed = seed
+        self.hasher = MinHasher(num_perm, seed)
+        self.cache_path = None
+        self._cache = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.cache_path = os.path.join(cache_dir, "fingerprints.json")
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("settings") == self._settings():
+                    self._cache = cached["fingerprints"]
+
+    def _settings(self) -> dict:
+        return {"num_perm": self.num_perm, "seed": self.seed, "shingle_words": self.shingle_words,
+                "first_pages": self.first_pages}
+
+    def fingerprints(self, paths) -> list[dict]:
+        """{"path", "sha256", "pages", "words", "signature", "error"} of each PDF, in order."""
+        paths = [str(p) for p in paths]
+        with inst.span("dedup.hash", pdfs=len(paths)):
+            digests = [file_sha256(p) for p in paths]
+
+        # One read per distinct content, whatever the number of copies
+        missing = {d: p for p, d in zip(paths, digests) if d not in self._cache}
+        inst.count("dedup_fingerprint_cache_hits_total", len(set(digests)) - len(missing))
+        if missing:
+            with inst.span("dedup.fingerprint", pdfs=len(missing)):
+                args = (self.first_pages, self.shingle_words, self.num_perm, self.seed)
+                if self.workers == 1 or len(missing) == 1:
+                    computed = [_fingerprint(p, d, *args) for d, p in missing.items()]
+                else:
+                    with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                        computed = list(pool.map(_fingerprint, missing.values(), missing.keys(),
+                                                 *[[a] * len(missing) for a in args], chunksize=8))
+            for info in computed:
+                self._cache[info["sha256"]] = {k: info[k] for k in ("pages", "words", "signature", "error")}
+            self._save()
+
+        return [{"path": p, "sha256": d, **self._cache[d]} for p, d in zip(paths, digests)]
+
+    def find_duplicates(self, paths, texts: dict | None = None) -> list[dict]:
+        """
+        Groups of copies of the same paper, each
+            {"canonical": path, "duplicates": [path, ...], "similarity": {path: jaccard}}
+        with "similarity" 1.0 for byte-identical copies. PDFs without a
+        duplicate are not listed.
+        """
+        infos = self.fingerprints(paths)
+        if texts:
+            for info in infos:
+                text = texts.get(info["path"])
+                if text is not None:
+                    info["words"] = len(WORD_REGEX.findall(text))
+                    info["signature"] = self.hasher.signature(shingles(text, self.shingle_words)).tolist()
+
+        groups = _UnionFind()
+        similarity = {}
+        by_digest = {}
+        for i, info in enumerate(infos):
+            first = by_digest.setdefault(info["sha256"], i)
+            if first != i:
+                groups.union(first, i)
+                similarity[(first, i)] = 1.0
+
+        lsh = LSHIndex(self.num_perm, self.bands)
+        signatures = {}
+        with inst.span("dedup.lsh", pdfs=len(infos)):
+            for i in by_digest.values():
+                info = infos[i]
+                if info["signature"] is None or info["words"] < MIN_WORDS:
+                    continue
+                signatures[i] = np.asarray(info["signature"], dtype=np.uint64)
+                for j in lsh.insert(i, signatures[i]):
+                    if groups.find(i) == groups.find(j):
+                        continue
+                    score = MinHasher.jaccard(signatures[i], signatures[j])
+                    inst.count("dedup_candidate_pairs_total")
+                    if score >= self.threshold:
+                        groups.union(j, i)
+                        similarity[(j, i)] = score
+
+        members = {}
+        for i in range(len(infos)):
+            members.setdefault(groups.find(i), []).append(i)
+
+        result = []
+        for indices in members.values():
+            if len(indices) < 2:
+                continue
+            indices.sort(key=lambda i: self.prefer(infos[i]))
+            canonical = indices[0]
+            scores = {}
+            for j in indices[1:]:
+                score = similarity.get((min(canonical, j), max(canonical, j)))
+                if score is None:
+                    # Joined through another member: compare with the canonical copy directly
+                    same_file = infos[j]["sha256"] == infos[canonical]["sha256"]
+                    sig_a, sig_b = signatures.get(canonical), signatures.get(j)
+                    score = 1.0 if same_file else (MinHasher.jaccard(sig_a, sig_b) if sig_a is not None and sig_b is not None else None)
+                scores[infos[j]["path"]] = score
+            result.append({
+                "canonical": infos[canonical]["path"],
+                "duplicates": [infos[j]["path"] for j in indices[1:]],
+                "similarity": scores,
+            })
+        inst.count("dedup_duplicates_total", sum(len(g["duplicates"]) for g in result))
+        return sorted(result, key=lambda g: g["canonical"])
+
+    def canonical_paths(self, paths, texts: dict | None = None) -> list[str]:
+        """`paths` without the non-canonical copies, in the original order."""
+        paths = [str(p) for p in paths]
+        dropped = {d for group in self.find_duplicates(paths, texts) for d in group["duplicates"]}
+        return [p for p in paths if p not in dropped]
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": self._settings(), "fingerprints": self._cache}, f)
+        os.replace(tmp_path, self.cache_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate papers among PDFs")
+    parser.add_argument("sources", nargs="+", help="PDF files or directories")
+    parser.add_argument("-o", "--output", help="Write the duplicate groups to this JSON file")
+    parser.add_argument("--cache-dir", default=".dedup_cache", help="Fingerprint cache")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--first-pages", type=int, default=FIRST_PAGES)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    paths = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            paths += sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(".pdf"))
+        else:
+            paths.append(source)
+
+    dedup = PdfDeduplicator(args.threshold, first_pages=args.first_pages, cache_dir=args.cache_dir, workers=args.workers)
+    groups = dedup.find_duplicates(paths)
+    for group in groups:
+        print(group["canonical"])
+        for path in group["duplicates"]:
+            score = group["similarity"][path]
+            print(f"    duplicate {path} ({'n/a' if score is None else f'{score:.2f}'})")
+    print(f"{sum(len(g['duplicates']) for g in groups)} duplicates of {len(groups)} papers among {len(paths)} PDFs")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(groups, f, indent=4, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .hashing import file_sha256
+
+MANIFEST_NAME = "manifest.json"
+# Last URL segments that only name a paper together with the rest of the URL
+# (".../hal-02281789/document", ".../article/view/8870/8729")
+GENERIC_NAME = re.compile(r"\d+|document|download|view|file|fulltext|content|pdf", re.IGNORECASE)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form used to dedupe URLs: trimmed, lower-case scheme and host,
+    no fragment.
+    """
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+
+def legacy_filename_from_url(url: str) -> str:
+    """
+    File name used before `filename_from_url` hashed generic names; only
+    unambiguous if no other URL of the corpus has the same one.
+    """
+    name = os.path.basename(urlsplit(url).path.rstrip("/")) or "document"
+    return name if name.lower().endswith(".pdf") else f"{name}.pdf"
+
+
+def filename_from_url(url: str) -> str:
+    """
+    Local file name for a PDF URL: its last path segment, plus a short hash of
+    the normalized URL when that segment is generic, so that different URLs
+    ending in "document" or in the same number get different files.
+    """
+    name = os.path.basename(urlsplit(url).path.rstrip("/")) or "document"
+    if name.lower().endswith(".pdf"):
+        return name
+    if GENERIC_NAME.fullmatch(name):
+        name = f"{name}-{hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()[:8]}"
+    return f"{name}.pdf"
+
+
+def pdf_sources_from_index_csv(path: str) -> list[tuple[str, str]]:
+    """
+    (url, filename) pairs from `data/index.csv`.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [(row["url"], os.path.basename(row["filename"])) for row in csv.DictReader(f)]
+
+
+def pdf_sources_from_model_type_json(path: str) -> list[tuple[str, str]]:
+    """
+    (url, filename) pairs from `data/model_type.json`.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        categories = json.load(f)
+    return [(url, filename_from_url(url)) for category in categories for url in category["links"]]
+
+
+def _looks_complete_pdf(path: str) -> bool:
+    # A complete PDF ends with an %%EOF marker near the end of the file
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 2048))
+        return b"%%EOF" in f.read()
+
+
+class PDFDownloader:
+    """
+    Downloads PDFs into `dest_dir` with a bounded worker pool and a limit on
+    concurrent requests per host.
+
+    Files are downloaded to `<name>.part` (resumed with an HTTP Range request
+    if a previous run was interrupted) and atomically renamed when complete.
+    A manifest (`manifest.json` in `dest_dir`) records url, size and SHA-256 of
+    every complete file; later runs skip files that still match it and later
+    pipeline stages can rely on it to know which local files are usable.
+    """
+
+    def __init__(
+        self,
+        dest_dir: str,
+        workers: int = 8,
+        per_host: int = 2,
+        manifest_path: str | None = None,
+        session: requests.Session | None = None,
+        timeout: float = 60,
+        max_retries: int = 3
+    ):
+        self.dest_dir = str(dest_dir)
+        os.makedirs(self.dest_dir, exist_ok=True)
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.manifest_path = manifest_path or os.path.join(self.dest_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+
+    def download_many(self, items) -> dict[str, dict]:
+        """
+        Downloads every (url, filename) pair, once per distinct URL, and
+        returns {url: record} for all given URLs (duplicates share a record).
+        A record has the manifest fields plus "status": complete, skipped or failed.
+        A URL whose file name is already the target of another URL in `items`
+        is not downloaded and fails.
+        """
+        unique = {}
+        for url, filename in items:
+            unique.setdefault(normalize_url(url), (url, filename or filename_from_url(url)))
+
+        records = {}
+        targets = {}
+        for key, (url, filename) in list(unique.items()):
+            first = targets.setdefault(filename, url)
+            if first != url:
+                error = f"{filename} is also the target of {first}"
+                print(f"Failed to download {url}: {error}")
+                records[key] = {"url": url, "path": os.path.join(self.dest_dir, filename), "status": "failed",
+                                "error": error}
+                del unique[key]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            records.update(zip(unique, pool.map(lambda item: self.download(*item), unique.values())))
+
+        return {url: records[normalize_url(url)] for url, _ in items}
+
+    def download(self, url: str, filename: str | None = None) -> dict:
+        filename = filename or filename_from_url(url)
+        path = os.path.join(self.dest_dir, filename)
+
+        if self._is_complete(filename, path, url):
+            return {**self.manifest[filename], "status": "skipped"}
+
+        with self._host_slot(url):
+            for attempt in range(self.max_retries + 1):
+                try:
+                    size, digest = self._fetch(url, path)
+                    break
+                except (requests.RequestException, OSError) as e:
+                    error = f"{type(e).__name__}: {e}"
+            else:
+                print(f"Failed to download {url}: {error}")
+                return {"url": url, "path": path, "status": "failed", "error": error}
+
+        record = {"url": url, "path": path, "size": size, "sha256": digest}
+        with self._lock:
+            self.manifest[filename] = record
+            self._save_manifest()
+        print(f"Downloaded: {path}")
+        return {**record, "status": "complete"}
+
+    def completed_files(self) -> list[str]:
+        """
+        Paths of all files recorded as complete in the manifest.
+        """
+        return [entry["path"] for entry in self.manifest.values()]
+
+    def _is_complete(self, filename: str, path: str, url: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        entry = self.manifest.get(filename)
+        if entry is not None:
+            if entry["url"] is not None and normalize_url(entry["url"]) != normalize_url(url):
+                # Another URL's file: download this one in its place
+                return False
+            return entry["size"] == os.path.getsize(path) and entry["sha256"] == file_sha256(path)
+
+        # File from before the manifest existed: adopt it if it is a whole PDF
+        if _looks_complete_pdf(path):
+            with self._lock:
+                self.manifest[filename] = {
+                    "url": None, "path": path, "size": os.path.getsize(path), "sha256": file_sha256(path)
+                }
+                self._save_manifest()
+            return True
+        return False
+
+    def _fetch(self, url: str, path: str) -> tuple[int, str]:
+        part_path = f"{path}.part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # Nothing left to fetch (or a stale .part): restart from scratch
+                os.remove(part_path)
+                return self._fetch(url, path)
+            response.raise_for_status()
+
+            resumed = offset and response.status_code == 206
+            h = hashlib.sha256()
+            if resumed:
+                with open(part_path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        h.update(block)
+            else:
+                offset = 0
+
+            # Content-Length counts encoded bytes, so only trust it for identity encoding
+            expected = response.headers.get("Content-Length")
+            if expected is None or response.headers.get("Content-Encoding"):
+                expected = None
+            else:
+                expected = offset + int(expected)
+
+            with open(part_path, "ab" if resumed else "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    h.update(chunk)
+
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            raise OSError(f"incomplete download ({size} of {expected} bytes)")
+        os.replace(part_path, path)
+        return size, h.hexdigest()
+
+    def _host_slot(self, url: str) -> threading.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
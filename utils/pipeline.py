@@ -0,0 +1,466 @@
+import argparse
+import csv
+import hashlib
+import inspect
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from . import instrumentation as inst
+from .hashing import file_sha256
+from .pdf_downloader import PDFDownloader, filename_from_url
+
+# Stage-graph runner for the paper pipeline (the flow of
+# experiment_notebooks/pipeline_notebook.ipynb):
+#
+#     python -m utils.pipeline data/index.csv --output-dir generatedJSON
+#
+# Stage outputs are cached on disk by a hash of the stage's code and of its
+# input values, so a crashed run resumes from the last completed stage of every
+# paper and changing one stage only recomputes it and the stages depending on it.
+DEFAULT_POOLS = {"download": 8, "rsef": 2, "grobid": 4, "cpu": os.cpu_count() or 1}
+
+
+def _hash_value(value) -> str:
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Stage:
+    """
+    One step of the pipeline: `func(**inputs)` returns a JSON-serializable
+    output stored under `name`.
+
+    `version` identifies the stage's code for caching; by default it is a hash
+    of the function's source, so editing the function invalidates its cached
+    outputs (and, through the input hashes, those of every dependent stage).
+    `config` holds the JSON-serializable settings the function reads from its
+    closure (service config, model files, thresholds...); it is hashed into
+    the version, so changing it invalidates the cached outputs too.
+    """
+
+    def __init__(self, name: str, func, inputs=(), pool: str = "cpu", version: str | None = None,
+                 config: dict | None = None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.pool = pool
+        if version is None:
+            try:
+                version = hashlib.sha256(inspect.getsource(func).encode("utf-8")).hexdigest()[:16]
+            except (OSError, TypeError):
+                version = getattr(func, "__qualname__", name)
+        if config is not None:
+            version = f"{version}-{_hash_value(config)[:16]}"
+        self.version = version
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs}, pool={self.pool!r})"
+
+
+class StageCache:
+    """
+    Stage outputs on disk, one JSON file per (stage, version, input hashes) key.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = str(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, stage: Stage, input_hashes: dict) -> str:
+        return _hash_value({"stage": stage.name, "version": stage.version, "inputs": input_hashes})
+
+    def get(self, stage: Stage, key: str):
+        """Returns (found, output)."""
+        try:
+            with open(self._path(stage, key), "r", encoding="utf-8") as f:
+                return True, json.load(f)["output"]
+        except FileNotFoundError:
+            return False, None
+
+    def put(self, stage: Stage, key: str, output):
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stage": stage.name, "version": stage.version, "output": output}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _path(self, stage: Stage, key: str) -> str:
+        return os.path.join(self.cache_dir, stage.name, key[:2], f"{key}.json")
+
+
+class _PaperRun:
+    # Outputs (and their hashes) of one paper, and which stages are still open
+    def __init__(self, paper_id, record, stages):
+        self.paper_id = paper_id
+        self.values = dict(record)
+        self.hashes = {}
+        self.open = {stage.name for stage in stages}
+        self.running = set()
+        self.errors = {}
+
+    def value_hash(self, name):
+        if name not in self.hashes:
+            self.hashes[name] = _hash_value(self.values.get(name))
+        return self.hashes[name]
+
+
+class Pipeline:
+    """
+    Runs a list of stages over many papers.
+
+    Each stage runs in its named worker pool, so GROBID-bound, network-bound
+    and CPU-bound stages get separate concurrency limits, while independent
+    stages of a paper and different papers run in parallel. Stages must be
+    listed after the stages they take as inputs.
+
+    `pools` maps pool names to their number of worker threads. `max_papers`
+    bounds how many papers are in flight at once (papers are pulled lazily
+    from the input iterable).
+    """
+
+    def __init__(self, stages, cache_dir: str, pools: dict | None = None, max_papers: int | None = None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = list(self.stages)
+        self.cache = StageCache(cache_dir)
+        self.pools = {**DEFAULT_POOLS, **(pools or {})}
+        self.max_papers = max_papers or 2 * sum(self.pools.values())
+        seen = set()
+        for stage in stages:
+            if stage.pool not in self.pools:
+                raise ValueError(f"Stage {stage.name!r} uses unknown pool {stage.pool!r}")
+            later = [i for i in stage.inputs if i in self.stages and i not in seen]
+            if later:
+                raise ValueError(f"Stage {stage.name!r} must come after its inputs {later}")
+            seen.add(stage.name)
+
+    def run(self, papers):
+        """
+        `papers` is an iterable of (paper_id, record) pairs, where the record
+        dict supplies every input that is not a stage. Yields, as each paper
+        finishes, a dict {"paper_id", "outputs", "errors", "cached_stages",
+        "computed_stages"}; a failed stage's dependents are skipped and listed
+        in "errors" too.
+        """
+        papers = iter(papers)
+        executors = {name: ThreadPoolExecutor(max_workers=n) for name, n in self.pools.items()}
+        in_flight = {}
+        futures = {}
+        stats = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(in_flight) < self.max_papers:
+                    item = next(papers, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    paper_id, record = item
+                    run = in_flight[paper_id] = _PaperRun(paper_id, record, self.stages.values())
+                    stats[paper_id] = {"cached_stages": [], "computed_stages": []}
+
+                for run in list(in_flight.values()):
+                    self._schedule(run, executors, futures, stats[run.paper_id])
+                    if not run.open and not run.running:
+                        del in_flight[run.paper_id]
+                        yield self._result(run, stats.pop(run.paper_id))
+
+                if not futures:
+                    if exhausted and not in_flight:
+                        break
+                    continue
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    run, stage, key = futures.pop(future)
+                    run.running.discard(stage.name)
+                    try:
+                        output = future.result()
+                    except Exception as e:
+                        run.errors[stage.name] = f"{type(e).__name__}: {e}"
+                        inst.count("stage_failures_total", stage=stage.name)
+                        print(f"{run.paper_id}: stage {stage.name} failed ({run.errors[stage.name]})")
+                        continue
+                    self.cache.put(stage, key, output)
+                    run.values[stage.name] = output
+                    stats[run.paper_id]["computed_stages"].append(stage.name)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _schedule(self, run, executors, futures, stats):
+        progress = True
+        while progress:
+            progress = False
+            for name in self.order:
+                if name not in run.open:
+                    continue
+                stage = self.stages[name]
+                blocked = [i for i in stage.inputs if i in self.stages and (i in run.open or i in run.running)]
+                if blocked:
+                    continue
+                failed = [i for i in stage.inputs if i in run.errors]
+                run.open.discard(name)
+                progress = True
+                if failed:
+                    run.errors[name] = f"skipped: {', '.join(failed)} failed"
+                    continue
+
+                key = self.cache.key(stage, {i: run.value_hash(i) for i in stage.inputs})
+                found, output = self.cache.get(stage, key)
+                if found:
+                    run.values[name] = output
+                    stats["cached_stages"].append(name)
+                    inst.count("stage_cache_hits_total", stage=name)
+                    continue
+
+                kwargs = {i: run.values.get(i) for i in stage.inputs}
+                run.running.add(name)
+                futures[executors[stage.pool].submit(self._run_stage, stage, run.paper_id, kwargs)] = (run, stage, key)
+
+    @staticmethod
+    def _run_stage(stage, paper_id, kwargs):
+        with inst.span(f"stage.{stage.name}", paper=paper_id, pool=stage.pool):
+            return stage.func(**kwargs)
+
+    def _result(self, run, stats):
+        return {
+            "paper_id": run.paper_id,
+            "outputs": {name: run.values[name] for name in self.order if name in run.values},
+            "errors": run.errors,
+            **stats,
+        }
+
+
+# Stages of the "best configuration" pipeline
+
+def run_rsef(pdf_url: str, output_dir: str) -> dict:
+    """
+    Runs `rsef assess` on the paper URL and returns title, DOI, publication
+    date and implementation URLs from its url_search_output.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=output_dir) as out:
+        subprocess.run(["rsef", "assess", "-i", pdf_url, "-o", out, "-U"], capture_output=True, text=True, check=True)
+        with open(os.path.join(out, "url_search_output.json"), "r", encoding="utf-8") as j:
+            rsef_output = json.load(j)["RSEF Output"][0]
+    return {
+        "title": rsef_output["title"],
+        "doi": rsef_output["doi"],
+        "publication_date": rsef_output["publication_date"],
+        "implementation_urls": [
+            item["identifier"] for item in rsef_output["implementation_urls"] or [] if "identifier" in item
+        ],
+    }
+
+
+def best_configuration_stages(
+    grobid_config: str = "./Grobid/config.json",
+    classifier_dir: str = "classification_model",
+    download_dir: str = "pipeline_pdfs",
+    rsef_dir: str = "rsef_output",
+    grobid_cache_dir: str | None = None,
+    classifier_cache_dir: str | None = None
+) -> list[Stage]:
+    """
+    Download, rsef, GROBID header and full text, abstract/raw text, model-type
+    classification and JSON assembly. Paper records need "pdf_url" and may
+    give a local "pdf_path" instead of downloading.
+    """
+    from .tei_extraction import TEIDocument
+
+    shared = {}
+    lock = threading.Lock()
+
+    def grobid():
+        with lock:
+            if "grobid" not in shared:
+                from .grobid_service import GrobidService
+                shared["grobid"] = GrobidService(config_path=grobid_config, cache_dir=grobid_cache_dir)
+            return shared["grobid"]
+
+    def classifier():
+        from .classifier_service import ClassifierService
+        return ClassifierService.get(classifier_dir, cache_dir=classifier_cache_dir)
+
+    downloader = PDFDownloader(download_dir)
+
+    def pdf(pdf_url, pdf_path):
+        if pdf_path:
+            return {"path": str(pdf_path), "sha256": file_sha256(pdf_path)}
+        record = downloader.download(pdf_url, filename_from_url(pdf_url))
+        if record["status"] == "failed":
+            raise OSError(record["error"])
+        return {"path": record["path"], "sha256": record["sha256"]}
+
+    def rsef(pdf_url):
+        return run_rsef(pdf_url, rsef_dir)
+
+    def grobid_tei(service, pdf):
+        # A failed call must fail the stage: its error body is not a TEI to cache
+        result = next(grobid().process_many([pdf["path"]], service, workers=1))
+        if result["status"] != 200:
+            raise RuntimeError(f"GROBID {service} returned status {result['status']}: {result['error']}")
+        return result["tei"]
+
+    def header_tei(pdf):
+        return grobid_tei("processHeaderDocument", pdf)
+
+    def fulltext_tei(pdf):
+        return grobid_tei("processFulltextDocument", pdf)
+
+    def authors(header_tei):
+        return list(TEIDocument(header_tei).authors)
+
+    def text(fulltext_tei):
+        doc = TEIDocument(fulltext_tei)
+        return {"abstract": doc.abstract, "raw_text": doc.raw_text}
+
+    def model_class(text):
+        return classifier().classify([text["raw_text"]])[0]
+
+    def record(pdf_url, rsef, authors, text, model_class):
+        return {
+            "paper_title": rsef["title"],
+            "paper_url": pdf_url,
+            "class": model_class["label"],
+            "class_probabilities": model_class["probabilities"],
+            "authors": authors,
+            "abstract": text["abstract"],
+            "implementation_url": rsef["implementation_urls"],
+            "publication_date": rsef["publication_date"],
+            "paper_doi": rsef["doi"],
+        }
+
+    from .classifier_service import CALIBRATOR_NAME, ENCODER_NAME, MODEL_NAME
+    from .grobid_service import GrobidService
+
+    # Closure settings that change stage outputs; part of the stage versions
+    grobid_settings = {"config": _file_digest(grobid_config), "flags": GrobidService.PROCESS_FLAGS}
+    classifier_settings = {
+        name: _file_digest(os.path.join(classifier_dir, name)) for name in (MODEL_NAME, ENCODER_NAME, CALIBRATOR_NAME)
+    }
+    return [
+        Stage("pdf", pdf, ("pdf_url", "pdf_path"), pool="download", config={"download_dir": download_dir}),
+        Stage("rsef", rsef, ("pdf_url",), pool="rsef"),
+        Stage("header_tei", header_tei, ("pdf",), pool="grobid", config=grobid_settings),
+        Stage("fulltext_tei", fulltext_tei, ("pdf",), pool="grobid", config=grobid_settings),
+        Stage("authors", authors, ("header_tei",)),
+        Stage("text", text, ("fulltext_tei",)),
+        Stage("model_class", model_class, ("text",), config=classifier_settings),
+        Stage("record", record, ("pdf_url", "rsef", "authors", "text", "model_class")),
+    ]
+
+
+def papers_from_source(source: str, pdf_dir: str | None = None):
+    """
+    (paper_id, record) pairs from data/index.csv (url, filename columns) or a
+    text file with one PDF URL per line. PDFs already in `pdf_dir` (e.g.
+    data/pdf_files) are given as the record's "pdf_path".
+    """
+    def paper(filename, url):
+        record = {"pdf_url": url}
+        if pdf_dir is not None and os.path.exists(os.path.join(pdf_dir, filename)):
+            record["pdf_path"] = os.path.join(pdf_dir, filename)
+        return Path(filename).stem, record
+
+    if source.endswith(".csv"):
+        with open(source, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield paper(os.path.basename(row["filename"]), row["url"])
+        return
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            url = line.strip()
+            if url and not url.startswith("#"):
+                yield paper(filename_from_url(url), url)
+
+
+def drop_duplicate_papers(papers, deduplicator):
+    """
+    The (paper_id, record) pairs minus the papers whose local "pdf_path" is a
+    non-canonical copy of another paper's PDF (see utils.pdf_dedup). Papers
+    without a local PDF are kept.
+    """
+    papers = list(papers)
+    paths = [record["pdf_path"] for _, record in papers if record.get("pdf_path")]
+    dropped = {}
+    for group in deduplicator.find_duplicates(paths):
+        for path in group["duplicates"]:
+            dropped[path] = group["canonical"]
+    kept = set()
+    for paper_id, record in papers:
+        path = record.get("pdf_path")
+        # Two records of the same file keep only the first
+        canonical = dropped.get(path) or (path if path in kept else None)
+        if canonical is not None:
+            print(f"{paper_id}: skipped, duplicate of {canonical}")
+            continue
+        if path:
+            kept.add(path)
+        yield paper_id, record
+
+
+def _file_digest(path: str) -> str | None:
+    return file_sha256(path) if os.path.exists(path) else None
+
+
+def _write_json_atomic(path: str, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the paper pipeline over a corpus")
+    parser.add_argument("source", help="data/index.csv or a file with one PDF URL per line")
+    parser.add_argument("-o", "--output-dir", default="generatedJSON")
+    parser.add_argument("--cache-dir", default=".pipeline_cache")
+    parser.add_argument("--grobid-config", default="./Grobid/config.json")
+    parser.add_argument("--classifier-dir", default="classification_model")
+    parser.add_argument("--download-dir", default="pipeline_pdfs")
+    parser.add_argument("--rsef-dir", default="rsef_output")
+    parser.add_argument("--pdf-dir", help="Use the PDFs already in this directory instead of downloading them")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Skip papers whose PDF in --pdf-dir is a copy of another paper's")
+    for pool, workers in DEFAULT_POOLS.items():
+        parser.add_argument(f"--{pool}-workers", type=int, default=workers)
+    parser.add_argument("--trace", help="Append per-stage spans to this JSONL file")
+    parser.add_argument("--metrics", help="Write counters and span totals as a Prometheus textfile")
+    args = parser.parse_args(argv)
+    if args.trace or args.metrics:
+        inst.configure(trace_path=args.trace, prometheus_path=args.metrics)
+
+    stages = best_configuration_stages(
+        args.grobid_config, args.classifier_dir, args.download_dir, args.rsef_dir,
+        grobid_cache_dir=os.path.join(args.cache_dir, "tei"),
+        classifier_cache_dir=os.path.join(args.cache_dir, "features")
+    )
+    pools = {pool: getattr(args, f"{pool}_workers") for pool in DEFAULT_POOLS}
+    pipeline = Pipeline(stages, os.path.join(args.cache_dir, "stages"), pools=pools)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    failed = 0
+    papers = papers_from_source(args.source, args.pdf_dir)
+    if args.dedup:
+        from .pdf_dedup import PdfDeduplicator
+        papers = drop_duplicate_papers(papers, PdfDeduplicator(cache_dir=os.path.join(args.cache_dir, "dedup")))
+    for result in pipeline.run(papers):
+        if "record" in result["outputs"]:
+            _write_json_atomic(os.path.join(args.output_dir, f"{result['paper_id']}.json"), result["outputs"]["record"])
+            print(f"{result['paper_id']}: done ({len(result['computed_stages'])} stages computed, "
+                  f"{len(result['cached_stages'])} cached)")
+        else:
+            failed += 1
+            print(f"{result['paper_id']}: FAILED {result['errors']}")
+    return failed
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if main() else 0)
@@ -1,73 +1,170 @@
 import os
 import time
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from . import instrumentation as inst
+from .pdf_downloader import PDFDownloader
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: allows `rate` calls per second on average, with
+    bursts of up to `burst` calls.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _retry_after_seconds(value: str | None) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
 
 class PapersWithCodeClient:
     BASE_URL = "https://paperswithcode.com/api/v1"
 
-    def __init__(self, task_slug: str, data_dir: str = "data"):
+    def __init__(
+        self,
+        task_slug: str,
+        data_dir: str = "data",
+        base_url: str | None = None,
+        requests_per_second: float = 5.0,
+        workers: int = 8,
+        max_retries: int = 5,
+        timeout: float = 30
+    ):
+        """
+        `base_url` can point to a local stub server. All HTTP calls share one
+        pooled session and are throttled by a token bucket of
+        `requests_per_second`; per-paper dataset/task lookups run on `workers`
+        threads.
+        """
         self.task_slug = task_slug
         self.data_dir = data_dir
-        self.papers_url = f"{self.BASE_URL}/tasks/{task_slug}/papers/"
+        self.base_url = (base_url or self.BASE_URL).rstrip("/")
+        self.papers_url = f"{self.base_url}/tasks/{task_slug}/papers/"
         self.pdf_folder = os.path.join(data_dir, "papers_pdfs")
         os.makedirs(self.pdf_folder, exist_ok=True)
 
+        self.workers = workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(requests_per_second, burst=max(1, workers))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
     def fetch_json(self, url: str):
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error fetching {url}: {e}")
-            return None
+        for attempt in range(self.max_retries + 1):
+            with inst.span("pwc.rate_limit_wait"):
+                self.rate_limiter.acquire()
+            try:
+                with inst.span("pwc.fetch_json") as span:
+                    response = self.session.get(url, timeout=self.timeout)
+                    span.set(status=response.status_code)
+                    span.add_bytes(len(response.content))
+                inst.count("http_requests_total", client="pwc", status=response.status_code)
+                if response.status_code == 429 and attempt < self.max_retries:
+                    inst.count("http_retries_total", client="pwc", status=429)
+                    wait = _retry_after_seconds(response.headers.get("Retry-After"))
+                    time.sleep(wait if wait is not None else min(2 ** attempt, 60))
+                    continue
+                response.raise_for_status()
+                return response.json()
+            except requests.RequestException as e:
+                inst.count("http_errors_total", client="pwc", error=type(e).__name__)
+                print(f"Error fetching {url}: {e}")
+                return None
+        return None
+
+    def fetch_paper_details(self, paper: dict) -> dict:
+        """
+        Builds the metadata entry for one paper of a listing page, including
+        its datasets and tasks (two more API calls).
+        """
+        entry = {
+            "Title": paper["title"],
+            "Authors": ", ".join(paper["authors"]),
+            "Abstract": paper.get("abstract", "No abstract available"),
+            "PDF URL": paper["url_pdf"],
+            "Datasets": [],
+            "Tasks": [],
+            "Tasks id": [],
+        }
+
+        paper_slug = paper["id"]
 
+        # Fetch datasets
+        dataset_url = f"{self.base_url}/papers/{paper_slug}/datasets/"
+        dataset_data = self.fetch_json(dataset_url)
+        if dataset_data:
+            entry["Datasets"] = [d["name"] for d in dataset_data["results"]]
+
+        # Fetch tasks
+        task_url = f"{self.base_url}/papers/{paper_slug}/tasks/"
+        task_data = self.fetch_json(task_url)
+        if task_data:
+            entry["Tasks"] = [t["name"] for t in task_data["results"]]
+            entry["Tasks id"] = [t["id"] for t in task_data["results"]]
+
+        return entry
+
+    @inst.timed("pwc.fetch_papers_metadata")
     def fetch_papers_metadata(self, limit: int | None) -> list[dict]:
         url = self.papers_url
         papers_list = []
-        
-        while url:
-            response = self.fetch_json(url)
-            if not response:
-                break
-
-            results = response["results"]
-            for paper in results:
-                entry = {
-                    "Title": paper["title"],
-                    "Authors": ", ".join(paper["authors"]),
-                    "Abstract": paper.get("abstract", "No abstract available"),
-                    "PDF URL": paper["url_pdf"],
-                    "Datasets": [],
-                    "Tasks": [],
-                    "Tasks id": [],
-                }
-
-                paper_slug = paper["id"]
-
-                # Fetch datasets
-                dataset_url = f"{self.BASE_URL}/papers/{paper_slug}/datasets/"
-                dataset_data = self.fetch_json(dataset_url)
-                if dataset_data:
-                    entry["Datasets"] = [d["name"] for d in dataset_data["results"]]
-
-                # Fetch tasks
-                task_url = f"{self.BASE_URL}/papers/{paper_slug}/tasks/"
-                # print(task_url)
-                task_data = self.fetch_json(task_url)
-                # print(task_data)
-                if task_data:
-                    entry["Tasks"] = [t["name"] for t in task_data["results"]]
-                    entry["Tasks id"] = [t["id"] for t in task_data["results"]]
-
-                papers_list.append(entry)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while url:
+                response = self.fetch_json(url)
+                if not response:
+                    break
+
+                results = response["results"]
+                if limit is not None:
+                    results = results[:limit - len(papers_list)]
+
+                # Lookups run concurrently; map keeps the listing order
+                papers_list.extend(pool.map(self.fetch_paper_details, results))
 
                 if limit is not None and len(papers_list) >= limit:
                     return papers_list[:limit]
 
-                time.sleep(1)  # avoid rate-limiting
-
-            url = response.get("next")
+                url = response.get("next")
 
         return papers_list
 
@@ -82,31 +179,140 @@ class PapersWithCodeClient:
         with open(filepath, "r", encoding="utf-8") as f:
             return json.load(f)
 
-    def download_pdf(self, pdf_url: str, title: str) -> str | None:
+    @inst.timed("pwc.sync_papers_metadata")
+    def sync_papers_metadata(self, filename: str = "papers_data.jsonl", limit: int | None = None) -> int:
+        """
+        Incrementally harvests the task's papers into a JSON Lines file.
+
+        Each record is appended (with its PwC "Id") as soon as its lookups
+        finish, papers already in the file are skipped, and the next page to
+        fetch is checkpointed after every page, so an interrupted sync resumes
+        where it stopped. Once the listing has been fully walked, the next sync
+        starts again from page one but only fetches details for new papers.
+        Returns the number of records added (at most `limit`).
+        """
+        filepath = os.path.join(self.data_dir, filename)
+        checkpoint_path = f"{filepath}.checkpoint.json"
+        self._repair_jsonl(filepath)
+        known_ids = {record["Id"] for record in self.iter_jsonl(filename) if "Id" in record}
+
+        checkpoint = {}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        url = checkpoint.get("next_url") or self.papers_url
+
+        added = 0
+        with open(filepath, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while url:
+                response = self.fetch_json(url)
+                if not response:
+                    break
+
+                new_papers = [p for p in response["results"] if p["id"] not in known_ids]
+                if limit is not None:
+                    new_papers = new_papers[:limit - added]
+
+                for paper, entry in zip(new_papers, pool.map(self.fetch_paper_details, new_papers)):
+                    entry["Id"] = paper["id"]
+                    out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    out.flush()
+                    known_ids.add(paper["id"])
+                    added += 1
+                    checkpoint["last_paper_id"] = paper["id"]
+
+                if limit is not None and added >= limit:
+                    # The current page may still hold unseen papers: resume on it
+                    checkpoint["next_url"] = url
+                    url = None
+                else:
+                    url = response.get("next")
+                    checkpoint["next_url"] = url
+
+                os.fsync(out.fileno())
+                self._save_checkpoint(checkpoint_path, checkpoint)
+
+        print(f"Added {added} papers to {filepath}")
+        return added
+
+    def iter_jsonl(self, filename: str):
+        """
+        Streams the records of a JSON Lines file one at a time. A truncated
+        last line (from an interrupted write) is ignored.
+        """
+        filepath = os.path.join(self.data_dir, filename)
+        if not os.path.exists(filepath):
+            return
+        with open(filepath, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    if line.endswith("\n"):
+                        raise
+
+    def save_jsonl(self, data, filename: str):
+        filepath = os.path.join(self.data_dir, filename)
+        with open(filepath, "w", encoding="utf-8") as f:
+            for record in data:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"Saved data to {filepath}")
+
+    @staticmethod
+    def _repair_jsonl(filepath: str):
+        # Drop a partially written last line so new records start on a fresh line
+        if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+            return
+        with open(filepath, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            # Read backwards in blocks up to the last newline, not the whole file
+            while end > 0:
+                start = max(0, end - 64 * 1024)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            f.truncate(end)
+
+    @staticmethod
+    def _save_checkpoint(path: str, checkpoint: dict):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def pdf_downloader(self, **kwargs) -> PDFDownloader:
+        return PDFDownloader(self.pdf_folder, session=self.session, timeout=self.timeout, **kwargs)
+
+    @staticmethod
+    def pdf_filename(title: str) -> str:
         safe_title = title.replace(" ", "_").replace("/", "_")
-        filename = os.path.join(self.pdf_folder, f"{safe_title}.pdf")
-
-        try:
-            response = requests.get(pdf_url, stream=True)
-            response.raise_for_status()
-            with open(filename, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"Downloaded: {filename}")
-            return filename
-        except requests.RequestException as e:
-            print(f"Failed to download {title}: {e}")
-            return None
-
-    def download_all_pdfs(self, papers_list: list[dict]) -> list[dict]:
+        return f"{safe_title}.pdf"
+
+    def download_pdf(self, pdf_url: str, title: str) -> str | None:
+        record = self.pdf_downloader().download(pdf_url, self.pdf_filename(title))
+        return record["path"] if record["status"] != "failed" else None
+
+    def download_all_pdfs(self, papers_list: list[dict], workers: int = 8, per_host: int = 2) -> list[dict]:
+        """
+        Downloads the PDFs of all papers in parallel (identical URLs only once),
+        skipping files already complete on disk, and sets "Local PDF Path".
+        """
+        items = []
         for paper in papers_list:
             pdf_url = paper.get("PDF URL")
-            title = paper["Title"]
-
             if pdf_url and pdf_url.startswith("http"):
-                pdf_path = self.download_pdf(pdf_url, title)
-                paper["Local PDF Path"] = pdf_path if pdf_path else None
+                items.append((pdf_url, self.pdf_filename(paper["Title"])))
             else:
-                print(f"No valid PDF URL for: {title}")
-                paper["Local PDF Path"] = None
+                print(f"No valid PDF URL for: {paper['Title']}")
+
+        records = self.pdf_downloader(workers=workers, per_host=per_host).download_many(items)
+
+        for paper in papers_list:
+            record = records.get(paper.get("PDF URL"))
+            paper["Local PDF Path"] = record["path"] if record and record["status"] != "failed" else None
         return papers_list
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+
+from .hashing import file_sha256
+
+
+class TEICache:
+    """
+    On-disk cache of GROBID TEI responses.
+
+    Entries are keyed by the SHA-256 of the PDF content plus the GROBID service
+    name and the flags passed to `client.process_pdf`, so renaming or moving a
+    PDF still hits the cache while changing any processing flag does not.
+    The total size is bounded; the least recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pdf_hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def pdf_hash(self, pdf_path: str) -> str:
+        """
+        Returns the SHA-256 of the PDF content, memoized by path, size and mtime.
+        """
+        st = os.stat(pdf_path)
+        memo_key = (os.path.abspath(pdf_path), st.st_size, st.st_mtime_ns)
+        digest = self._pdf_hashes.get(memo_key)
+        if digest is None:
+            digest = file_sha256(pdf_path)
+            self._pdf_hashes[memo_key] = digest
+        return digest
+
+    def key(self, pdf_path: str, service: str, flags: dict) -> str:
+        payload = json.dumps(
+            {"pdf": self.pdf_hash(pdf_path), "service": service, "flags": flags},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                tei = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return tei
+
+    def put(self, key: str, tei: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(tei)
+
+        with self._lock:
+            if os.path.exists(path):
+                self._total_bytes -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._total_bytes += os.path.getsize(path)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.tei.xml")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tei.xml"):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    yield path, st.st_mtime_ns, st.st_size
+
+    def _evict(self):
+        # Oldest access first, until we are back under the bound
+        for path, _, size in sorted(self._entries(), key=lambda e: e[1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._total_bytes -= size
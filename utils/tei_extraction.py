@@ -1,75 +1,359 @@
 from lxml import etree
-from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer, util
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
+import numpy as np
+import os
 import re
 
-def extract_sections_fulltext(tei_xml_str):
-    ns = {'tei': 'http://www.tei-c.org/ns/1.0'}
-    root = etree.fromstring(tei_xml_str.encode())
-
-    divs = root.xpath('//tei:text/tei:body/tei:div', namespaces=ns)
-    sections = []
-
-    for div in divs:
-        head_el = div.find('tei:head', namespaces=ns)
-        title = head_el.text.strip() if head_el is not None and head_el.text else None
-
-        # All <p> elements (deep search in case nested <div>s)
-        paragraphs = []
-        for p in div.xpath('.//tei:p', namespaces=ns):
-            # Option 1: plain text with references inlined
-            para_text = ''.join(p.itertext()).strip()
-            if para_text:
-                paragraphs.append(para_text)
-
-            # Option 2 (alternative): include inline XML tags (uncomment if needed)
-            # para_text = etree.tostring(p, encoding=str, method='xml')
-            # paragraphs.append(para_text)
-
-        if title or paragraphs:
-            sections.append({
-                "title": title,
-                "paragraphs": paragraphs
-            })
-    return sections
+from . import instrumentation as inst
 
-def extract_abstract(tei_xml_str):
-    ns = {'tei': 'http://www.tei-c.org/ns/1.0'}  # TEI uses XML namespaces
-    root = etree.fromstring(tei_xml_str.encode())
+TEI_NS = 'http://www.tei-c.org/ns/1.0'
+DEFAULT_SENTENCE_MODEL = 'all-mpnet-base-v2'
 
-    # Corrected XPath to include <div> between <abstract> and <p>
-    abstract_paragraphs = root.xpath('//tei:abstract/tei:div/tei:p', namespaces=ns)
-    
-    # Join all paragraph texts, stripping whitespace
-    abstract_text = '\n'.join(p.text.strip() for p in abstract_paragraphs if p.text)
+# "torch": fp32 PyTorch; "int8": Linear layers dynamically quantized to int8;
+# "onnx": ONNX Runtime (SentenceTransformer's onnx backend, needs optimum[onnxruntime])
+ENCODER_BACKENDS = ("torch", "int8", "onnx")
 
-    return abstract_text
+# sentence_transformers (and torch) are only imported when a model is first needed
+_sentence_models = {}
 
-def tei_to_full_raw_text(tei_xml: str, remove_ref = None) -> str:
-    
-    # Extract *all* human‐readable text from a GROBID TEI string,
-    # preserving document order (header, abstract, body, references…).
 
-    # 1) parse as XML
-    soup = BeautifulSoup(tei_xml, "lxml-xml")
-    # 2) remove the references section
-    if remove_ref:
-        # Remove <ref> elements
+def get_sentence_model(model_name: str = DEFAULT_SENTENCE_MODEL, backend: str | None = None):
+    """
+    Returns the SentenceTransformer for `model_name`, created once per process,
+    or with a `backend` (see ENCODER_BACKENDS) the SentenceEncoder for it.
+    Both can be passed as `model` to the ranking and embedding functions.
+    """
+    key = model_name if backend is None else (model_name, backend)
+    model = _sentence_models.get(key)
+    if model is None:
+        if backend is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+        else:
+            model = SentenceEncoder(model_name, backend)
+        _sentence_models[key] = model
+    return model
+
+
+class SentenceEncoder:
+    """
+    CPU inference for a sentence-transformers model with a choice of backend
+    (ENCODER_BACKENDS).
+
+    `encode` takes the same arguments as SentenceTransformer.encode. Texts are
+    tokenized on a thread pool, sorted by token count and batched, so every
+    batch is padded only to its own longest text. `onnx_file` selects a file
+    of the model repository's onnx/ folder, e.g. "onnx/model_qint8_avx2.onnx".
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_SENTENCE_MODEL,
+        backend: str = "int8",
+        tokenizer_workers: int | None = None,
+        onnx_file: str | None = None,
+        num_threads: int | None = None
+    ):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}")
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.backend = backend
+        if backend == "onnx":
+            model_kwargs = {"file_name": onnx_file} if onnx_file else None
+            model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+        else:
+            model = SentenceTransformer(model_name, device="cpu")
+            if backend == "int8":
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model.eval()
+        self.tokenizer = model.tokenizer
+        self.max_seq_length = model.max_seq_length
+        self.do_lower_case = getattr(model[0], "do_lower_case", False)
+        self.tokenizer_workers = tokenizer_workers or min(8, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.tokenizer_workers)
+
+    def __repr__(self):
+        return f"SentenceEncoder({self.model_name!r}, backend={self.backend!r})"
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def _tokenize(self, texts):
+        # Same preprocessing as sentence_transformers.models.Transformer.tokenize, without padding
+        texts = [str(t).strip() for t in texts]
+        if self.do_lower_case:
+            texts = [t.lower() for t in texts]
+        return self.tokenizer(texts, truncation=True, max_length=self.max_seq_length, padding=False)
+
+    def tokenize(self, texts) -> dict:
+        """Unpadded token ids (and attention masks) of `texts`, tokenized in parallel chunks."""
+        texts = list(texts)
+        size = max(1, -(-len(texts) // self.tokenizer_workers))
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        encoded = {}
+        # Fast (Rust) tokenizers release the GIL while encoding a batch
+        for features in self._pool.map(self._tokenize, chunks):
+            for key, values in features.items():
+                encoded.setdefault(key, []).extend(values)
+        return encoded
+
+    def encode(
+        self,
+        sentences,
+        batch_size: int = 64,
+        convert_to_numpy: bool = True,
+        convert_to_tensor: bool = False,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ):
+        import torch
+
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size, convert_to_numpy, convert_to_tensor, normalize_embeddings)[0]
+        sentences = list(sentences)
+        embeddings = np.zeros((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if sentences:
+            with inst.span("tei.encoder.tokenize", texts=len(sentences)):
+                encoded = self.tokenize(sentences)
+            lengths = np.array([len(ids) for ids in encoded["input_ids"]])
+            order = np.argsort(-lengths, kind="stable")
+            pad_ids = {"input_ids": self.tokenizer.pad_token_id or 0}
+            with inst.span("tei.encoder.forward", texts=len(sentences), backend=self.backend), torch.inference_mode():
+                for start in range(0, len(order), batch_size):
+                    batch = order[start:start + batch_size]
+                    # Right padding to the longest text of the batch
+                    width = int(lengths[batch].max())
+                    features = {}
+                    for key, values in encoded.items():
+                        padded = np.full((len(batch), width), pad_ids.get(key, 0), dtype=np.int64)
+                        for row, i in enumerate(batch):
+                            padded[row, :len(values[i])] = values[i]
+                        features[key] = torch.from_numpy(padded)
+                    output = self.model(features)["sentence_embedding"]
+                    embeddings[batch] = output.float().cpu().numpy()
+            inst.count("encoder_sentences_total", len(sentences), backend=self.backend)
+
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if convert_to_tensor:
+            return torch.from_numpy(embeddings)
+        return embeddings
+
+
+class TEIDocument:
+    """
+    A GROBID TEI document parsed once with lxml.
+
+    Every view (sections, flat sections, abstract, raw text, authors) is computed
+    on first access and memoized, so a paper pays a single XML parse no matter
+    how many of them are used. The returned lists are shared between calls and
+    should not be mutated.
+    """
+    ns = {'tei': TEI_NS}
+
+    def __init__(self, tei_xml):
+        if isinstance(tei_xml, str):
+            tei_xml = tei_xml.encode()
+        with inst.span("tei.parse", bytes=len(tei_xml)):
+            self.root = etree.fromstring(tei_xml)
+        inst.count("tei_documents_parsed_total")
+
+    @cached_property
+    def body_divs(self):
+        return self.root.xpath('//tei:text/tei:body/tei:div', namespaces=self.ns)
+
+    @cached_property
+    def sections(self):
+        sections = []
+
+        for div in self.body_divs:
+            head_el = div.find('tei:head', namespaces=self.ns)
+            title = head_el.text.strip() if head_el is not None and head_el.text else None
+
+            # All <p> elements (deep search in case nested <div>s)
+            paragraphs = []
+            for p in div.xpath('.//tei:p', namespaces=self.ns):
+                # Option 1: plain text with references inlined
+                para_text = ''.join(p.itertext()).strip()
+                if para_text:
+                    paragraphs.append(para_text)
+
+                # Option 2 (alternative): include inline XML tags (uncomment if needed)
+                # para_text = etree.tostring(p, encoding=str, method='xml')
+                # paragraphs.append(para_text)
+
+            if title or paragraphs:
+                sections.append({
+                    "title": title,
+                    "paragraphs": paragraphs
+                })
+        return sections
+
+    @cached_property
+    def flat_sections(self):
+        section_map = {}
+        top_sections = []
+        last_section_num = None  # Track most recent valid section
+
+        for div in self.body_divs:
+            head = div.find('tei:head', namespaces=self.ns)
+            if head is None or not head.text:
+                continue
+
+            title = head.text.strip()
+            n_attr = head.get('n')
+            section_num = n_attr.strip() if n_attr else None
+
+            # Get all paragraph text in this <div>
+            paragraphs = [
+                ''.join(p.itertext()).strip()
+                for p in div.xpath('.//tei:p', namespaces=self.ns)
+                if p.text or len(p)
+            ]
+            text = '\n\n'.join(paragraphs)
+
+            if section_num and re.fullmatch(r'\d+', section_num):
+                # It's a top-level section
+                section_entry = {
+                    "title": title,
+                    "text": text
+                }
+                section_map[section_num] = section_entry
+                top_sections.append(section_entry)
+                last_section_num = section_num
+
+            elif section_num and re.fullmatch(r'\d+(?:\.\d+)+', section_num):
+                # It's a subsection: merge into parent
+                parent_num = section_num.split('.')[0]
+                if parent_num in section_map:
+                    if text:
+                        section_map[parent_num]["text"] += '\n\n' + text
+                    last_section_num = parent_num
+                else:
+                    # Orphan subsection — add as top-level section
+                    section_map[section_num] = {
+                        "title": title,
+                        "text": text
+                    }
+                    top_sections.append(section_map[section_num])
+                    last_section_num = section_num
+
+            else:
+                # No numeric heading: optionally add as top-level
+                if text:
+                    if last_section_num:
+                        # Add as a new top-level section if we have a valid last section
+                        section_map[last_section_num] = {
+                            "title": title,
+                            "text": text
+                        }
+                    else:
+                        top_sections.append({
+                            "title": title,
+                            "text": text
+                        })
+        return top_sections
+
+    @cached_property
+    def title(self):
+        """
+        Main title of the paper from the TEI header, or None.
+        """
+        titles = self.root.xpath('//tei:teiHeader//tei:titleStmt/tei:title', namespaces=self.ns)
+        text = _joined_text(titles[0]).strip() if titles else ""
+        return text or None
+
+    @cached_property
+    def abstract(self):
+        abstract_paragraphs = self.root.xpath('//tei:abstract/tei:div/tei:p', namespaces=self.ns)
+
+        # Join all paragraph texts, stripping whitespace
+        return '\n'.join(p.text.strip() for p in abstract_paragraphs if p.text)
+
+    @cached_property
+    def raw_text(self):
+        """
+        All human-readable text in document order (header, abstract, body, references…).
+        """
+        return self._raw_text(remove_ref=False)
+
+    @cached_property
+    def raw_text_without_references(self):
+        return self._raw_text(remove_ref=True)
+
+    @cached_property
+    def authors(self):
+        """
+        Full names of every <author> with a <persName>, in document order.
+        """
+        names = []
+        for author in self.root.iter('{*}author'):
+            pers = next(author.iter('{*}persName'), None)
+            if pers is None:
+                continue
+            parts = [_joined_text(fn) for fn in pers.iter('{*}forename')]
+            surname = next(pers.iter('{*}surname'), None)
+            if surname is not None:
+                parts.append(_joined_text(surname))
+            if parts:
+                names.append(" ".join(parts))
+        return names
+
+    def _raw_text(self, remove_ref):
+        if remove_ref:
+            skip = lambda el: el.tag == f'{{{TEI_NS}}}div' and el.get('type') == 'references'
+        else:
+            skip = lambda el: False
+
+        # Every non-empty text node, stripped and joined with newlines
+        raw = '\n'.join(t for t in (s.strip() for s in _text_nodes(self.root, skip)) if t)
+
+        # Fix common hyphenation artifacts ("word-\nnext")
+        raw = re.sub(r"(\w+)-\n(\w+)", r"\1\2", raw)
+
+        # Collapse any 3+ blank lines down to two
+        raw = re.sub(r"\n{3,}", "\n", raw)
+
+        return raw
+
 
-        for ref_section in soup.find_all("div", attrs={"type": "references"}):
-            ref_section.decompose()
+def _text_nodes(el, skip):
+    # Text and tails in document order, ignoring comments/PIs and skipped subtrees
+    if isinstance(el.tag, str) and not skip(el):
+        if el.text:
+            yield el.text
+        for child in el:
+            yield from _text_nodes(child, skip)
+            if child.tail:
+                yield child.tail
 
-    # 2) pull every text node, joining with newlines
-    raw = soup.get_text(separator="\n", strip=True)
 
-    # 3) fix common hyphenation artifacts ("word-\nnext")
-    raw = re.sub(r"(\w+)-\n(\w+)", r"\1\2", raw)
+def _joined_text(el):
+    return ''.join(s.strip() for s in el.itertext())
 
-    # 4) collapse any 3+ blank lines down to two
-    raw = re.sub(r"\n{3,}", "\n", raw)
 
-    return raw
+def _as_document(tei):
+    return tei if isinstance(tei, TEIDocument) else TEIDocument(tei)
+
+
+def extract_sections_fulltext(tei_xml_str):
+    return _as_document(tei_xml_str).sections
+
+def extract_abstract(tei_xml_str):
+    return _as_document(tei_xml_str).abstract
+
+def tei_to_full_raw_text(tei_xml: str, remove_ref = None) -> str:
+    # Extract *all* human‐readable text from a GROBID TEI string,
+    # preserving document order (header, abstract, body, references…).
+    doc = _as_document(tei_xml)
+    return doc.raw_text_without_references if remove_ref else doc.raw_text
 
 # def extract_flat_sections_with_subtext(tei_xml_str):
 #     ns = {'tei': 'http://www.tei-c.org/ns/1.0'}
@@ -125,87 +409,115 @@ def tei_to_full_raw_text(tei_xml: str, remove_ref = None) -> str:
 
 #     return top_sections
 def extract_flat_sections_with_subtext(tei_xml_str):
-    ns = {'tei': 'http://www.tei-c.org/ns/1.0'}
-    root = etree.fromstring(tei_xml_str.encode())
-
-    divs = root.xpath('//tei:text/tei:body/tei:div', namespaces=ns)
-    section_map = {}
-    top_sections = []
-    last_section_num = None  # Track most recent valid section
-
-    for div in divs:
-        head = div.find('tei:head', namespaces=ns)
-        if head is None or not head.text:
-            continue
-
-        title = head.text.strip()
-        n_attr = head.get('n')
-        section_num = n_attr.strip() if n_attr else None
-        # print(f"Processing section: {title} (n={section_num})")
-        # print(f"Last section number: {last_section_num}")
-
-
-        # Get all paragraph text in this <div>
-        paragraphs = [
-            ''.join(p.itertext()).strip()
-            for p in div.xpath('.//tei:p', namespaces=ns)
-            if p.text or len(p)
-        ]
-        text = '\n\n'.join(paragraphs)
-
-        if section_num and re.fullmatch(r'\d+', section_num):
-            # It's a top-level section
-            section_entry = {
-                "title": title,
-                "text": text
-            }
-            section_map[section_num] = section_entry
-            top_sections.append(section_entry)
-            last_section_num = section_num
-
-        elif section_num and re.fullmatch(r'\d+(?:\.\d+)+', section_num):
-            # It's a subsection: merge into parent
-            parent_num = section_num.split('.')[0]
-            if parent_num in section_map:
-                if text:
-                    section_map[parent_num]["text"] += '\n\n' + text
-                last_section_num = parent_num
-            else:
-                # Orphan subsection — ignore or treat as top-level
-                # print(f"Orphan subsection {section_num} found with title '{title}'")
-                # add as top-level section
-                section_map[section_num] = {
-                    "title": title,
-                    "text": text
-                }
-                top_sections.append(section_map[section_num])
-                last_section_num = section_num
-
+    return _as_document(tei_xml_str).flat_sections
+
+def rank_sections_by_semantic_similarity(section_titles, queries,model, cache=None):
+    # Cosine similarity of normalized NumPy embeddings, so `model` may be a
+    # SentenceTransformer or any SentenceEncoder backend
+    return rank_sections_corpus([section_titles], queries, model, cache=cache)[0]
+
+
+class EmbeddingCache:
+    """
+    Persistent text -> normalized embedding cache for one encoder model.
+
+    Entries are keyed by model name and exact text, so section titles that repeat
+    across papers ("Experiments", "Related Work", ...) are encoded only once.
+    With `cache_dir=None` the cache lives in memory only.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str | None = None):
+        self.model_name = model_name
+        self.path = None
+        self._index = {}
+        self._vectors = None
+        self._dirty = False
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            safe_name = re.sub(r"[^\w.-]+", "_", model_name)
+            self.path = os.path.join(cache_dir, f"{safe_name}.npz")
+            if os.path.exists(self.path):
+                with np.load(self.path, allow_pickle=False) as data:
+                    self._vectors = data["vectors"]
+                    self._index = {text: i for i, text in enumerate(data["texts"].tolist())}
+
+    def __len__(self):
+        return len(self._index)
+
+    def encode(self, texts, model, batch_size: int = 64) -> np.ndarray:
+        """
+        Returns a (len(texts), dim) float32 matrix of L2-normalized embeddings,
+        encoding only the texts not seen before.
+        """
+        distinct = list(dict.fromkeys(texts))
+        missing = [t for t in distinct if t not in self._index]
+        # Hits and misses are distinct texts: a repeat within the batch is not a hit
+        inst.count("embedding_cache_hits_total", len(distinct) - len(missing))
+        inst.count("embedding_cache_misses_total", len(missing))
+        if missing:
+            new_vectors = _encode_normalized(model, missing, batch_size)
+            start = len(self._index)
+            self._vectors = new_vectors if self._vectors is None else np.vstack([self._vectors, new_vectors])
+            self._index.update((t, start + i) for i, t in enumerate(missing))
+            self._dirty = True
+        return self._vectors[[self._index[t] for t in texts]]
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, texts=np.array(list(self._index)), vectors=self._vectors)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def _encode_normalized(model, texts, batch_size=64):
+    embs = np.asarray(model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs / np.maximum(norms, 1e-12)
+
+
+def rank_sections_corpus(papers_section_titles, queries, model, top_k=None, cache=None):
+    """
+    Ranks the section titles of many papers at once against the same queries.
+
+    Queries are encoded once, titles are deduplicated across the corpus, and
+    each title is scored by its maximum cosine similarity to any query with a
+    single matrix product. Returns, per paper, up to `top_k` (title, score)
+    pairs sorted by decreasing score, like `rank_sections_by_semantic_similarity`;
+    every ranking is empty when there are no queries.
+    """
+    if cache is not None:
+        encode = cache.encode
+    else:
+        def encode(texts, model):
+            return _encode_normalized(model, texts)
+    queries = list(queries)
+    papers_section_titles = [[t or "" for t in titles] for titles in papers_section_titles]
+    unique_titles = list(dict.fromkeys(t for titles in papers_section_titles for t in titles))
+    # Nothing to score without titles or without queries
+    if not unique_titles or not queries:
+        return [[] for _ in papers_section_titles]
+
+    with inst.span("tei.encode_titles", papers=len(papers_section_titles), titles=len(unique_titles)):
+        query_embs = encode(queries, model)
+        title_embs = encode(unique_titles, model)
+    if cache is not None:
+        cache.save()
+
+    # (queries x titles) cosine similarities, max over queries
+    title_scores = (query_embs @ title_embs.T).max(axis=0)
+    title_pos = {t: i for i, t in enumerate(unique_titles)}
+
+    ranked_papers = []
+    for titles in papers_section_titles:
+        scores = title_scores[[title_pos[t] for t in titles]] if titles else np.empty(0)
+        k = len(titles) if top_k is None else min(top_k, len(titles))
+        if k < len(titles):
+            top = np.argpartition(-scores, k - 1)[:k]
         else:
-            # No numeric heading: optionally add as top-level
-            if text:
-                if last_section_num:
-                    # Add as a new top-level section if we have a valid last section
-                    section_map[last_section_num] = {
-                        "title": title,
-                        "text": text
-                    }
-                else:
-                    top_sections.append({
-                        "title": title,
-                        "text": text
-                    })
-    return top_sections
-
-def rank_sections_by_semantic_similarity(section_titles, queries,model):
-    # Encode query list and section titles
-    query_embs = model.encode(queries, convert_to_tensor=True)
-    section_embs = model.encode(section_titles, convert_to_tensor=True)
-
-    # Compute cosine similarities (queries × section_titles)
-    sim_matrix = util.cos_sim(query_embs, section_embs)
-
-    # For each section title, get the max similarity across all queries
-    max_scores = sim_matrix.max(dim=0).values
-    ranked = sorted(zip(section_titles, max_scores.tolist()), key=lambda x: -x[1])
-    return ranked
+            top = np.arange(len(titles))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        ranked_papers.append([(titles[i], float(scores[i])) for i in top])
+    return ranked_papers
@@ -0,0 +1,361 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from . import instrumentation as inst
+from .tei_extraction import TEIDocument, _encode_normalized, get_sentence_model, DEFAULT_SENTENCE_MODEL
+
+# On-disk vector index over every paragraph of the corpus (the paragraphs of
+# `extract_sections_fulltext`), for retrieval across papers:
+#
+#     index = ParagraphIndex("paragraph_index", model_name="all-mpnet-base-v2")
+#     index.add_papers(papers, model)            # (paper_id, TEI) pairs
+#     index.search(["datasets used for evaluation"], model, k=10)
+#
+# Directory layout:
+#   vectors.f16       (n, dim) float16 L2-normalized embeddings, memory-mapped
+#   rows.i32          (n, 3) int32 (paper, section, paragraph); paper indexes meta["papers"]
+#   ivf_centroids.npy (clusters, dim) float32, only after build_ivf
+#   ivf_assign.i32    (n,) int32 cluster of every row, only after build_ivf
+#   meta.json         dim, model, committed row count, paper ids
+# Rows are append-only and meta.json is replaced last, so rows written by an
+# interrupted append are ignored (and truncated by the next writer).
+# Section and paragraph numbers index `TEIDocument.sections`, as in CorpusStore.
+
+FORMAT = 1
+META_NAME = "meta.json"
+VECTORS_NAME = "vectors.f16"
+ROWS_NAME = "rows.i32"
+CENTROIDS_NAME = "ivf_centroids.npy"
+ASSIGN_NAME = "ivf_assign.i32"
+# Rows scored per matrix product in exhaustive search
+SEARCH_BLOCK = 65536
+DEFAULT_NPROBE = 8
+
+
+def paper_paragraphs(tei) -> list[tuple[int, int, str]]:
+    """(section, paragraph, text) of every paragraph of a paper's TEI (or TEIDocument)."""
+    doc = tei if isinstance(tei, TEIDocument) else TEIDocument(tei)
+    return [
+        (s, p, text)
+        for s, section in enumerate(doc.sections)
+        for p, text in enumerate(section["paragraphs"])
+    ]
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, best_scores: np.ndarray, best_rows: np.ndarray, k: int):
+    # Merges a (queries x candidates) block of scores into the running top-k of every query
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, np.broadcast_to(rows, (scores.shape[0], rows.shape[0]))], axis=1)
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        rows = np.take_along_axis(rows, top, axis=1)
+    return scores, rows
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid of every vector, scored `block` vectors at a time."""
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+        assign[start:start + block] = (chunk @ centroids.T).argmax(axis=1)
+    return assign
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids of (normalized) `vectors` by cosine k-means, as float32."""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # An empty cluster restarts from a random vector
+        empty = norms[:, 0] == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class ParagraphIndex:
+    """
+    Paragraph embeddings of many papers in one directory, searched by cosine
+    similarity.
+
+    Papers are appended as they are added to the corpus. Search is exhaustive
+    (block by block over the memory-mapped vectors, all queries at once)
+    until `build_ivf` partitions the rows into clusters; from then on new
+    rows are assigned to their nearest centroid when appended and a query
+    only scores the rows of its `nprobe` closest clusters.
+    """
+
+    def __init__(self, path: str, dim: int | None = None, model_name: str | None = None):
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, META_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if model_name is not None and self.meta["model"] not in (None, model_name):
+                raise ValueError(f"Index {self.path!r} holds {self.meta['model']!r} embeddings, not {model_name!r}")
+        else:
+            self.meta = {"format": FORMAT, "dim": dim, "model": model_name, "count": 0, "papers": []}
+        self._paper_pos = {paper_id: i for i, paper_id in enumerate(self.meta["papers"])}
+        self._vectors = None
+        self._rows = None
+        self._centroids = None
+        self._lists = None
+        centroids_path = os.path.join(self.path, CENTROIDS_NAME)
+        if os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def __contains__(self, paper_id):
+        return paper_id in self._paper_pos
+
+    @property
+    def dim(self) -> int | None:
+        return self.meta["dim"]
+
+    @property
+    def paper_ids(self) -> list[str]:
+        return list(self.meta["papers"])
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _map(self, name: str, dtype, width: int | None):
+        shape = (len(self),) if width is None else (len(self), width)
+        if not len(self):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """(n, dim) float16 memory map of the committed rows."""
+        if self._vectors is None:
+            self._vectors = self._map(VECTORS_NAME, np.float16, self.dim or 0)
+        return self._vectors
+
+    @property
+    def rows(self) -> np.ndarray:
+        """(n, 3) int32 (paper position, section, paragraph) of the committed rows."""
+        if self._rows is None:
+            self._rows = self._map(ROWS_NAME, np.int32, 3)
+        return self._rows
+
+    def _invalidate(self):
+        self._vectors = self._rows = self._lists = None
+
+    def _truncate(self):
+        # Drops rows written after the last committed meta.json
+        count = len(self)
+        for name, row_bytes in ((VECTORS_NAME, 2 * (self.dim or 0)), (ROWS_NAME, 12), (ASSIGN_NAME, 4)):
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > count * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(count * row_bytes)
+
+    def add(self, paper_id: str, paragraphs, vectors: np.ndarray):
+        """
+        Appends one paper: `paragraphs` are its (section, paragraph, ...)
+        tuples and `vectors` their L2-normalized embeddings, in the same order.
+        """
+        if paper_id in self._paper_pos:
+            raise ValueError(f"Paper {paper_id!r} already indexed")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(paragraphs), -1) if len(paragraphs) \
+            else np.zeros((0, self.dim or 0), dtype=np.float32)
+        if self.dim is None and len(paragraphs):
+            self.meta["dim"] = vectors.shape[1]
+        elif len(paragraphs) and vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+        self._truncate()
+        position = len(self.meta["papers"])
+        rows = np.array([(position, s, p) for s, p, *_ in paragraphs], dtype=np.int32).reshape(-1, 3)
+        with open(self._file(VECTORS_NAME), "ab") as f:
+            f.write(vectors.astype(np.float16).tobytes())
+        with open(self._file(ROWS_NAME), "ab") as f:
+            f.write(rows.tobytes())
+        if self._centroids is not None:
+            with open(self._file(ASSIGN_NAME), "ab") as f:
+                f.write(nearest_centroids(vectors, self._centroids).tobytes())
+
+        self.meta["papers"].append(paper_id)
+        self.meta["count"] += len(rows)
+        self._paper_pos[paper_id] = position
+        self._save_meta()
+        self._invalidate()
+        inst.count("vector_index_rows_added_total", len(rows))
+
+    def add_papers(self, papers, model, batch_size: int = 64) -> int:
+        """
+        Encodes and appends the paragraphs of (paper_id, TEI) pairs, skipping
+        papers already indexed. Returns the number of papers added.
+        """
+        added = 0
+        for paper_id, tei in papers:
+            if paper_id in self._paper_pos:
+                continue
+            paragraphs = paper_paragraphs(tei)
+            with inst.span("vector_index.encode", paper=paper_id, paragraphs=len(paragraphs)) as span:
+                texts = [text for _, _, text in paragraphs]
+                span.add_bytes(sum(len(t) for t in texts))
+                vectors = _encode_normalized(model, texts, batch_size) if texts else None
+            self.add(paper_id, paragraphs, vectors)
+            added += 1
+        return added
+
+    def build_ivf(self, n_clusters: int | None = None, sample_size: int = 100_000, iterations: int = 10, seed: int = 0):
+        """
+        Partitions the rows into `n_clusters` (default ~4 * sqrt(n)) with
+        spherical k-means trained on a sample, and assigns every row. Re-run
+        it when the corpus has grown a lot to retrain the centroids.
+        """
+        n = len(self)
+        if n == 0:
+            raise ValueError("Cannot build an IVF over an empty index")
+        n_clusters = min(n, n_clusters or max(1, int(4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        with inst.span("vector_index.build_ivf", rows=n, clusters=n_clusters):
+            sample = np.sort(rng.choice(n, min(n, max(sample_size, n_clusters)), replace=False))
+            centroids = spherical_kmeans(self.vectors[sample], n_clusters, iterations, seed)
+            assign = nearest_centroids(self.vectors, centroids)
+
+        self._write_atomic(ASSIGN_NAME, assign.tobytes())
+        tmp_path = self._file(f"{CENTROIDS_NAME}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, centroids)
+        os.replace(tmp_path, self._file(CENTROIDS_NAME))
+        self._centroids = centroids
+        self._invalidate()
+        return n_clusters
+
+    def _inverted_lists(self):
+        # Row ids grouped by cluster, built once per process from ivf_assign.i32
+        if self._lists is None:
+            assign = self._map(ASSIGN_NAME, np.int32, None)
+            order = np.argsort(assign, kind="stable")
+            offsets = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def search(self, queries, model=None, k: int = 10, nprobe: int | None = None) -> list[list[dict]]:
+        """
+        Top-`k` paragraphs for each query, as [{"paper", "section",
+        "paragraph", "score"}] sorted by decreasing cosine similarity.
+        `queries` are strings (encoded with `model`) or normalized vectors.
+        With an IVF only the `nprobe` clusters closest to each query are
+        scanned; `nprobe=0` forces an exhaustive search.
+        """
+        if len(self) == 0:
+            # Nothing to search, and no dimension yet to reshape vector queries to
+            single_vector = len(queries) and not isinstance(queries[0], str) and np.ndim(queries) == 1
+            return [[]] if single_vector else [[] for _ in queries]
+        if len(queries) and isinstance(queries[0], str):
+            queries = _encode_normalized(model, queries)
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        k = min(k, len(self))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        if k == 0 or not len(queries):
+            return [[] for _ in queries]
+
+        nprobe = DEFAULT_NPROBE if nprobe is None else nprobe
+        with inst.span("vector_index.search", queries=len(queries), rows=len(self)) as span:
+            if self._centroids is None or nprobe <= 0 or nprobe >= len(self._centroids):
+                scanned = len(self)
+                for start in range(0, len(self), SEARCH_BLOCK):
+                    block = np.asarray(self.vectors[start:start + SEARCH_BLOCK], dtype=np.float32)
+                    best_scores, best_rows = _top_k(queries @ block.T, np.arange(start, start + len(block)),
+                                                    best_scores, best_rows, k)
+            else:
+                order, offsets = self._inverted_lists()
+                probes = np.argpartition(-(queries @ self._centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+                scanned = 0
+                # Each probed cluster is read once and scored against every query probing it
+                for cluster in np.unique(probes):
+                    members = order[offsets[cluster]:offsets[cluster + 1]]
+                    if not len(members):
+                        continue
+                    probing = np.flatnonzero((probes == cluster).any(axis=1))
+                    # members are in row order (stable argsort): sequential reads of the memory map
+                    block = np.asarray(self.vectors[members], dtype=np.float32)
+                    scores = np.full((len(queries), len(members)), -np.inf, dtype=np.float32)
+                    scores[probing] = queries[probing] @ block.T
+                    best_scores, best_rows = _top_k(scores, members, best_scores, best_rows, k)
+                    scanned += len(members) * len(probing)
+            span.set(scanned=scanned)
+
+        results = []
+        for scores, rows in zip(best_scores, best_rows):
+            ranked = np.argsort(-scores, kind="stable")
+            hits = []
+            for i in ranked:
+                if not np.isfinite(scores[i]):
+                    continue
+                paper, section, paragraph = (int(v) for v in self.rows[rows[i]])
+                hits.append({
+                    "paper": self.meta["papers"][paper],
+                    "section": section,
+                    "paragraph": paragraph,
+                    "score": float(scores[i]),
+                })
+            results.append(hits)
+        return results
+
+    def _write_atomic(self, name: str, data: bytes):
+        tmp_path = self._file(f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._file(name))
+
+    def _save_meta(self):
+        self._write_atomic(META_NAME, json.dumps(self.meta, ensure_ascii=False).encode("utf-8"))
+
+
+def main():
+    from .corpus_store import CorpusStore
+    from .grobid_service import GrobidService
+
+    parser = argparse.ArgumentParser(description="Build or query the paragraph vector index")
+    parser.add_argument("index", help="Index directory")
+    parser.add_argument("--add", nargs="*", default=[], help="PDFs to add (paper id = file stem)")
+    parser.add_argument("--grobid-config", default="./Grobid/config.json")
+    parser.add_argument("--tei-cache-dir", default=".pipeline_cache/tei")
+    parser.add_argument("--model", default=DEFAULT_SENTENCE_MODEL)
+    parser.add_argument("--build-ivf", type=int, nargs="?", const=0, metavar="CLUSTERS",
+                        help="Partition the index (default number of clusters: ~4 * sqrt(rows))")
+    parser.add_argument("--query", action="append", default=[])
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--corpus-store", help="CorpusStore file to print the matching paragraphs from")
+    args = parser.parse_args()
+
+    index = ParagraphIndex(args.index, model_name=args.model)
+    model = get_sentence_model(args.model) if args.add or args.query else None
+    if args.add:
+        grobid = GrobidService(config_path=args.grobid_config, cache_dir=args.tei_cache_dir)
+        papers = ((os.path.splitext(os.path.basename(p))[0], grobid.process_full_text(p)) for p in args.add)
+        print(f"{index.add_papers(papers, model)} papers added, {len(index)} paragraphs indexed")
+    if args.build_ivf is not None:
+        print(f"IVF built with {index.build_ivf(args.build_ivf or None)} clusters")
+
+    store = CorpusStore(args.corpus_store) if args.corpus_store else None
+    for query, hits in zip(args.query, index.search(args.query, model, args.k, args.nprobe) if args.query else []):
+        print(f"# {query}")
+        for hit in hits:
+            print(f"{hit['score']:.3f}  {hit['paper']}  section {hit['section']}, paragraph {hit['paragraph']}")
+            if store is not None and hit["paper"] in store:
+                text = CorpusStore.text(store.paragraph(hit["paper"], hit["section"], hit["paragraph"]))
+                print(f"       {text[:200]}")
+
+
+if __name__ == "__main__":
+    main()